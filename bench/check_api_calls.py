@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+
+""" API call-count regression checks of taw commands (against the stand-in; see standin.py).
+
+    eg) python bench/check_api_calls.py
+        python bench/check_api_calls.py --only instance_list,vpc_list --verbose
+
+    Each check runs a taw command at two inventory sizes and compares the
+    number of API calls with a budget. A budget is either a constant
+    (the number of calls must not grow with the inventory) or a function
+    of the inventory sizes (for commands whose calls are inherently per item).
+    An extra round trip per item (an N+1 pattern) makes a constant budget fail
+    at the larger size. The exit status is 1 if any check fails.
+"""
+
+from __future__ import print_function
+import os, sys, json, argparse
+
+from run_bench import prepare_environment, Bench
+
+# inventory sizes at which every check is run: (instances, S3 keys, Route53 records, images)
+check_sizes = [
+    (  10,  20,  20,  5),
+    (1000, 200, 700, 40),
+]
+
+
+def per_key(max_calls_per_key, fixed):
+    """ a budget that grows with the number of S3 keys the command touches """
+    return lambda sizes: fixed + max_calls_per_key * sizes[1]
+
+
+# name -> (taw arguments, budget)
+# Budgets that depend on sizes mark known per-item patterns; tighten them when they are fixed.
+checks = [
+    ('instance_list'      , ['instance', 'list']                               , 3),
+    ('instance_list_v'    , ['instance', 'list', '-v']                         , 3),
+    ('list_instance'      , ['list']                                           , 3),
+    ('instance_list_attr' , ['instance', 'list', '-a', 'instance_id', '-a', 'state'], 1),  # a projection needs no subnets or VPCs
+    ('instance_list_filter', ['instance', 'list', 'state=running', 'name=worker0000*', 'type~large'], 3),  # filtered by EC2
+    ('list_subnets'       , ['list', 'subnets']                                , 3),
+    ('list_sg'            , ['list', 'sg']                                     , 2),
+    ('list_sg_verbose'    , ['list', 'sg', '-v']                               , 3),
+    ('list_keypairs'      , ['list', 'keypairs']                               , 1),
+    ('list_snapshots'     , ['list', 'snapshots']                              , 1),
+    ('list_ip'            , ['list', 'ip']                                     , 2),
+    ('list_az'            , ['list', 'az']                                     , 1),
+    ('list_buckets'       , ['list', 'buckets']                                , 2),  # 1 + an ACL per bucket (1 bucket)
+    ('list_buckets_names' , ['list', 'buckets', '-a', 'name']                  , 1),  # no ACLs
+    ('vpc_list'           , ['vpc', 'list']                                    , 4),
+    ('vpc_list_verbose'   , ['vpc', 'list', '-v']                              , 5),
+    ('vpc_list_attr'      , ['vpc', 'list', '-a', 'vpc_id', '-a', 'cidr_block'], 1),
+    ('image_list'         , ['image', 'list']                                  , 2),  # the account ID + images
+    ('image_list_perm'    , ['image', 'list', '--perm']                        , lambda sizes: 2 + sizes[3]),  # an attribute per image (concurrently)
+    ('image_list_keywords', ['image', 'list', 'bench', '/image 3']             , 2),
+    ('image_prune_dryrun' , ['image', 'prune', '--keep', '2']                  , 3),  # images, snapshots and instances using them
+    ('image_prune'        , ['image', 'prune', '--keep', '2', '--force']       , lambda sizes: 3 + 2 * (sizes[3] - 3)),  # + a call per image and snapshot
+    ('image_replicate'    , ['image', 'replicate', 'image0001', 'image0002', '--to', 'tokyo,oregon'], 7),  # images + 4 copies + a poll per region
+    ('image_refresh'      , ['image', 'refresh']                               , 1),  # a DescribeImages for all recommended families
+    ('instance_ip'        , ['instance', 'ip', 'worker00001', 'worker00002']   , 2),
+    ('instance_start'     , ['instance', 'start', 'worker00001', 'worker00002'], 4),
+    ('instance_stop'      , ['instance', 'stop', 'worker00001', '--force']     , 2),
+    ('instance_settag'    , ['instance', 'settag', 'worker00003', 'k', 'v']    , 2),
+    ('pssh'               , ['--dryrun', 'pssh', 'worker*', '--', 'uptime']   , 1),
+    ('launch_spec_dryrun' , ['--dryrun', 'instance', 'launch', '--spec', '{workdir}/spec.json'], 6),  # + a page of the instance type catalog
+    ('launch_fleet'       , ['instance', 'launch', '--spec', '{workdir}/fleet.json']  , 31),  # 11 + a CreateTags (Name) per instance (20)
+    ('instance_types'     , ['instance', 'types', '--min-vcpu', '8', '--max-price', '2'], 3),  # cold catalog + on-demand and spot prices
+    ('cost'               , ['cost']                                           , 4),  # regions + instances, volumes and addresses per region (1)
+    ('volume_list'        , ['volume', 'list']                                 , lambda sizes: 1 + (sizes[0] + 199) // 200),  # volumes + the names of their instances (200 IDs per call)
+    ('snapshot_list'      , ['snapshot', 'list']                               , 3),
+    ('snapshot_create'    , ['snapshot', 'create', 'worker0000*']             , 11),  # instances + a CreateSnapshots per instance (10)
+    ('snapshot_rm'        , ['snapshot', 'rm', '--older-than', '1', '--force'] , 2),  # nothing to remove: all snapshots back images
+    ('zone_list'          , ['zone', 'list']                                   , 1),
+    ('zone_list_records'  , ['zone', 'list', 'example.com']                    , lambda sizes: 1 + (sizes[2] + 1 + 299) // 300),
+    ('zone_list_limit'    , ['--limit', '10', 'zone', 'list', 'example.com']   , 2),  # a page of 10 records
+    ('zone_list_name'     , ['zone', 'list', 'example.com', 'name=host00001']  , 2),  # starts at host00001 and stops after it
+    ('bucket_ls_limit'    , ['--limit', '5', 'list', 'buckets', 'bench-bucket'], 1),  # a page of 5 keys
+    ('instance_list_sort' , ['--sort', '-name', '--limit', '5', 'instance', 'list'], 3),
+    ('instance_list_limit', ['--limit', '5', 'instance', 'list']                , 3),  # a page of 5 instances
+    ('bucket_ls_filter'   , ['list', 'buckets', 'bench-bucket', 'key=data/0001*'], 1),  # the key prefix is sent as Prefix
+    ('bucket_ls'          , ['list', 'buckets', 'bench-bucket:data/*']         , lambda sizes: 2 + (sizes[1] + 999) // 1000),
+    ('bucket_rm'          , ['bucket', 'rm', 'bench-bucket:data/*', '--force'] , per_key(1, 3)),  # a DeleteObject per key
+]
+
+
+def budget_at(budget, sizes):
+    return budget(sizes) if callable(budget) else budget
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the number of AWS API calls issued by taw commands.')
+    parser.add_argument('--only', help='comma-separated check names')
+    parser.add_argument('--verbose', '-v', action='store_true', help='show the calls by operation')
+    args = parser.parse_args()
+
+    workdir = prepare_environment()
+    with open(os.path.join(workdir, 'spec.json'), 'w') as f:
+        json.dump({'defaults': {'ami': 'image0001', 'keyname': 'bench', 'subnet': 'subnet0000', 'securitygroup': ['sg000']},
+                   'groups': [{'name': 'head', 'instancetype': 'm5.large'},
+                              {'name': 'new-worker', 'count': 50, 'instancetype': 'c5.xlarge'}]}, f)
+    with open(os.path.join(workdir, 'fleet.json'), 'w') as f:
+        json.dump({'groups': [{'name': 'batch-{01..20}', 'ami': 'image0001', 'keyname': 'bench', 'subnet': 'subnet0000', 'securitygroup': ['sg000'],
+                               'instancetype': ['c5.xlarge', 'm5.xlarge'], 'spot': True, 'ondemand': 2}]}, f)
+    import standin
+    import taw.util
+    fake = standin.FakeAWS()
+    bench = Bench(fake)
+    selected = set(args.only.split(',')) if args.only else None
+    failures = []
+    for sizes in check_sizes:
+        print("inventory: %d instances, %d S3 keys, %d records, %d images" % sizes)
+        for name, taw_args, budget in checks:
+            if selected is not None and name not in selected: continue
+            fake.clear()  # some commands modify the inventory
+            standin.build_inventory(fake, 'us-east-1', *sizes)
+            taw.util.region_to_instance_type_catalog.clear()  # every check starts with a cold instance type catalog (and prices)
+            taw.util.region_and_market_to_prices.clear()
+            if os.path.exists(taw.util.get_instance_type_catalog_file_path()): os.remove(taw.util.get_instance_type_catalog_file_path())
+            limit = budget_at(budget, sizes)
+            try:
+                _, calls = bench.measure(lambda: bench.run_taw([a.format(workdir=workdir) for a in taw_args]), 1)
+            except Exception as e:
+                failures.append((name, sizes, str(e).split("\n")[0]))
+                print("  %-20s FAILED: %s" % (name, str(e).split("\n")[0]))
+                continue
+            n = sum(calls.values())
+            status = 'ok' if n <= limit else 'OVER BUDGET'
+            print("  %-20s %6d calls (budget %6d) %s" % (name, n, limit, status))
+            if args.verbose or n > limit:
+                for op in sorted(calls.keys()):
+                    print("      %-40s %6d" % (op, calls[op]))
+            if n > limit:
+                failures.append((name, sizes, "%d calls > budget %d" % (n, limit)))
+    if failures:
+        print("%d check(s) failed" % len(failures))
+        for name, sizes, reason in failures:
+            print("  %s at %d instances: %s" % (name, sizes[0], reason))
+        sys.exit(1)
+    print("All checks passed")
+
+
+if __name__ == '__main__':
+    main()
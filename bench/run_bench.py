@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+""" Benchmarks of taw commands against an in-process AWS stand-in (see standin.py).
+
+    eg) python bench/run_bench.py --preset small
+        python bench/run_bench.py --preset large --only instance_list,list_subnets --output results.json
+
+    Each scenario runs a taw command in-process and records the wall time
+    (the median of --repeat runs) and the API calls issued, per operation.
+    The results are written to a JSON file so that API call counts and wall
+    times can be compared from one version of taw to the next.
+"""
+
+from __future__ import print_function
+import os, sys, time, json, tempfile, argparse, subprocess, platform
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(bench_dir))
+sys.path.insert(0, bench_dir)
+
+presets = {
+    #            instances, S3 keys, Route53 records, images
+    'tiny'   : (       10,     100,             100,     10),
+    'small'  : (     1000,   10000,            1000,    100),
+    'large'  : (    10000,  100000,            5000,   1000),
+}
+
+
+def prepare_environment():
+    """ point taw at a scratch HOME and fake credentials. This must be done before importing taw. """
+    home = tempfile.mkdtemp(prefix='taw-bench-')
+    os.environ['HOME'] = home
+    os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+    os.environ['AWS_ACCESS_KEY_ID'] = 'AKIASTANDIN'
+    os.environ['AWS_SECRET_ACCESS_KEY'] = 'standin'
+    os.environ['AWS_CONFIG_FILE'] = os.path.join(home, 'nonexistent-config')
+    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = os.path.join(home, 'nonexistent-credentials')
+    os.environ.pop('AWS_PROFILE', None)
+    os.environ.pop('AWS_DEFAULT_PROFILE', None)
+    os.mkdir(os.path.join(home, '.ssh'))
+    os.mkdir(os.path.join(home, '.aws'))  # for the local AMI database
+    return home
+
+
+class Bench(object):
+    """ holds the stand-in and runs taw commands against it """
+
+    def __init__(self, fake):
+        import click.testing
+        import taw.main  # noqa: F401 (registers all commands)
+        import taw.taw
+        import taw.util
+        self.fake = fake
+        self.group = taw.taw.taw
+        self.runner = click.testing.CliRunner()
+        fake.install(taw.util.register_session_event_handler)
+
+    def run_taw(self, args, input_text=None):
+        """ run a taw command in-process. Returns the click Result. """
+        result = self.runner.invoke(self.group, ['--noless'] + list(args), input=input_text, catch_exceptions=True)
+        if result.exit_code != 0:
+            raise RuntimeError("'taw %s' failed (exit code %s)\n%s\n%s" % (" ".join(args), result.exit_code, result.output, result.exception))
+        return result
+
+    def measure(self, func, repeat):
+        """ run func `repeat` times. Returns (median wall time, API calls per run by operation) """
+        times = []
+        calls = None
+        for _ in range(repeat):
+            self.fake.reset_call_counts()
+            started = time.time()
+            func()
+            times.append(time.time() - started)
+            if calls is None:
+                calls = dict(["%s.%s" % k, v] for k, v in self.fake.call_counts.items())
+        times.sort()
+        return times[len(times) // 2], calls
+
+
+def scenarios(bench, sizes, workdir):
+    """ returns the list of (scenario name, function) """
+    n_instances, n_objects, n_records, n_images = sizes
+    upload_dir = os.path.join(workdir, 'upload')
+    download_dir = os.path.join(workdir, 'download')
+    os.mkdir(upload_dir)
+    os.mkdir(download_dir)
+    n_files = min(100, n_objects)
+    for i in range(n_files):
+        with open(os.path.join(upload_dir, 'f%04d.txt' % i), 'wb') as f:
+            f.write(b'x' * 1024)
+
+    def output_table_rendering():
+        import taw.util
+        import taw.taw
+
+        params = taw.taw.GlobalParameters()
+        params.output_format = 'simple_with_color'
+        params.output_header = True
+        params.output_noless = True
+        params.output_sort, params.output_group_by, params.output_limit = None, None, None
+        rows = [['worker%05d' % i, 'i-%017x' % i, 't3.micro', '198.51.100.%d' % (i % 250), 'sg000', 'running', ['subnet0000'], ['vpc000']]
+                for i in range(n_instances)]
+        with open(os.devnull, 'w') as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                taw.util.output_table(params, ['Name', 'ID', 'Instance Type', 'Public IP', 'Security Groups', 'State', 'Subnet Name', 'VPC Name'], rows,
+                                      [lambda r: {-1: 'red'} if r[5] == 'stopped' else None])
+            finally:
+                sys.stdout = stdout
+
+    def bucket_rm():
+        bench.run_taw(['bucket', 'rm', 'bench-bucket:data/*', '--force'])
+        for k in range(n_objects):  # restore for the next run
+            bench.fake.put_object('bench-bucket', 'data/%06d.txt' % k, 1024)
+
+    return [
+        ('instance_list'     , lambda: bench.run_taw(['instance', 'list'])),
+        ('list_instance'     , lambda: bench.run_taw(['list'])),
+        ('list_subnets'      , lambda: bench.run_taw(['list', 'subnets'])),
+        ('list_sg_verbose'   , lambda: bench.run_taw(['list', 'sg', '-v'])),
+        ('vpc_list'          , lambda: bench.run_taw(['vpc', 'list'])),
+        ('image_list'        , lambda: bench.run_taw(['image', 'list'])),
+        ('list_buckets'      , lambda: bench.run_taw(['list', 'buckets', 'bench-bucket:data/0000*'])),
+        ('bucket_cp_upload'  , lambda: bench.run_taw(['bucket', 'cp', os.path.join(upload_dir, '*'), 'bench-bucket:'])),
+        ('bucket_cp_download', lambda: bench.run_taw(['bucket', 'cp', 'bench-bucket:f*', download_dir])),
+        ('bucket_rm'         , bucket_rm),
+        ('zone_list'         , lambda: bench.run_taw(['zone', 'list'])),
+        ('zone_list_records' , lambda: bench.run_taw(['zone', 'list', 'example.com'])),
+        ('name_resolution'   , lambda: bench.run_taw(['instance', 'ip', 'worker%05d' % (n_instances - 1)])),
+        ('output_table'      , output_table_rendering),
+    ]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=bench_dir, stderr=subprocess.STDOUT).decode('utf-8').strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark taw commands against an in-process AWS stand-in.')
+    parser.add_argument('--preset', choices=sorted(presets.keys()), default='tiny', help='inventory size')
+    parser.add_argument('--instances', type=int, help='number of instances (overrides the preset)')
+    parser.add_argument('--objects', type=int, help='number of S3 keys (overrides the preset)')
+    parser.add_argument('--records', type=int, help='number of Route53 records (overrides the preset)')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs per scenario (the median is reported)')
+    parser.add_argument('--only', help='comma-separated scenario names')
+    parser.add_argument('--output', default='bench_results.json', help='JSON file to write the results to')
+    args = parser.parse_args()
+
+    n_instances, n_objects, n_records, n_images = presets[args.preset]
+    if args.instances is not None: n_instances = args.instances
+    if args.objects is not None: n_objects = args.objects
+    if args.records is not None: n_records = args.records
+    sizes = (n_instances, n_objects, n_records, n_images)
+
+    home = prepare_environment()
+    import standin
+    fake = standin.build_inventory(standin.FakeAWS(), 'us-east-1', n_instances, n_objects, n_records, n_images)
+    bench = Bench(fake)
+    selected = set(args.only.split(',')) if args.only else None
+    results = []
+    for name, func in scenarios(bench, sizes, home):
+        if selected is not None and name not in selected: continue
+        try:
+            wall, calls = bench.measure(func, args.repeat)
+        except Exception as e:
+            results.append({'scenario': name, 'error': str(e)})
+            print("%-20s FAILED: %s" % (name, str(e).split("\n")[0]))
+            continue
+        results.append({'scenario': name, 'seconds': wall, 'api_calls': sum(calls.values()), 'calls_by_operation': calls})
+        print("%-20s %10.3f s %8d API calls" % (name, wall, sum(calls.values())))
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'sizes': {'instances': n_instances, 'objects': n_objects, 'records': n_records, 'images': n_images},
+        'repeat': args.repeat,
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print("Results were written to '%s'" % args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,753 @@
+#!/usr/bin/env python3
+
+""" An in-process stand-in for the AWS APIs used by taw.
+
+    The stand-in answers API calls from a synthetic inventory kept in memory,
+    so that taw commands can be run (and timed) without an AWS account.
+    It hooks the 'before-call' event of botocore; a handler that returns a
+    response makes botocore skip the HTTP request, so everything above the
+    wire (boto3 resources, paginators, s3transfer, taw itself) runs as usual.
+
+    Only the operations (and the filters) taw uses are implemented.
+    Unknown operations are answered with an error 'NotImplementedByStandIn'.
+"""
+
+from __future__ import print_function
+import copy, datetime, fnmatch, io, json, threading, bisect
+import botocore.awsrequest
+import botocore.response
+
+
+account_id = '123456789012'
+utc = datetime.timezone.utc if hasattr(datetime, 'timezone') else None  # the API returns aware date-times
+default_page_size = None  # EC2 returns everything in one page unless MaxResults is given
+
+
+def _camel(name):
+    """ 'instance-id' -> 'InstanceId' """
+    return ''.join([w.capitalize() for w in name.split('-')])
+
+
+# filter name -> function (item -> list of values) for the filters whose names cannot be mechanically converted
+special_filters = {
+    'instance-state-name'    : lambda d: [d.get('State', {}).get('Name')],
+    'is-public'              : lambda d: ['true' if d.get('Public') else 'false'],
+    'ip-address'             : lambda d: [d.get('PublicIpAddress')],
+    'cidr'                   : lambda d: [d.get('CidrBlock')],
+    'fingerprint'            : lambda d: [d.get('KeyFingerprint')],
+    'instance.group-name'    : lambda d: [g['GroupName'] for g in d.get('SecurityGroups', [])],
+    'attachment.instance-id' : lambda d: [a['InstanceId'] for a in d.get('Attachments', [])],
+    'attachment.vpc-id'      : lambda d: [a['VpcId'] for a in d.get('Attachments', [])],
+    'tag-key'                : lambda d: [t['Key'] for t in d.get('Tags', [])],
+    'owner-alias'            : lambda d: [d.get('ImageOwnerAlias')],
+    'availability-zone'      : lambda d: [d.get('AvailabilityZone') or d.get('Placement', {}).get('AvailabilityZone')],
+    'status'                 : lambda d: [d.get('State') or d.get('Status')],
+}
+
+
+def filter_values(item, name):
+    """ returns the values of an item (a dict of an API response) that a filter named `name` tests """
+    if name.startswith('tag:'):
+        return [t['Value'] for t in item.get('Tags', []) if t['Key'] == name[4:]]
+    if name in special_filters:
+        vs = special_filters[name](item)
+    else:
+        v = item
+        for component in name.split('.'):
+            v = v.get(_camel(component)) if isinstance(v, dict) else None
+        vs = v if isinstance(v, list) else [v]
+    return [('true' if v else 'false') if isinstance(v, bool) else str(v) for v in vs if v is not None]
+
+
+def match_filters(item, filters):
+    for f in filters or []:
+        values = filter_values(item, f['Name'])
+        if not any([fnmatch.fnmatchcase(v, pat) for v in values for pat in f['Values']]):
+            return False
+    return True
+
+
+class RegionInventory(object):
+    """ EC2 resources in a region """
+    collections = ['instances', 'subnets', 'vpcs', 'security_groups', 'key_pairs', 'images',
+                   'snapshots', 'volumes', 'addresses', 'internet_gateways', 'route_tables', 'instance_types']
+
+    def __init__(self, region):
+        self.region = region
+        for c in self.collections: setattr(self, c, [])
+
+
+class StandInError(Exception):
+    def __init__(self, code, message, status_code=400):
+        Exception.__init__(self, message)
+        self.code = code
+        self.message = message
+        self.status_code = status_code
+
+
+class FakeAWS(object):
+    """ The in-memory AWS.
+        Use install() to hook it to a boto3 session.
+    """
+
+    # EC2 describe operation -> (inventory collection, response key, ID parameter -> item key)
+    ec2_describe_operations = {
+        'DescribeSubnets'         : ('subnets'          , 'Subnets'         , {'SubnetIds': 'SubnetId'}),
+        'DescribeVpcs'            : ('vpcs'             , 'Vpcs'            , {'VpcIds': 'VpcId'}),
+        'DescribeSecurityGroups'  : ('security_groups'  , 'SecurityGroups'  , {'GroupIds': 'GroupId', 'GroupNames': 'GroupName'}),
+        'DescribeKeyPairs'        : ('key_pairs'        , 'KeyPairs'        , {'KeyNames': 'KeyName', 'KeyPairIds': 'KeyPairId'}),
+        'DescribeImages'          : ('images'           , 'Images'          , {'ImageIds': 'ImageId'}),
+        'DescribeSnapshots'       : ('snapshots'        , 'Snapshots'       , {'SnapshotIds': 'SnapshotId'}),
+        'DescribeVolumes'         : ('volumes'          , 'Volumes'         , {'VolumeIds': 'VolumeId'}),
+        'DescribeAddresses'       : ('addresses'        , 'Addresses'       , {'AllocationIds': 'AllocationId', 'PublicIps': 'PublicIp'}),
+        'DescribeInternetGateways': ('internet_gateways', 'InternetGateways', {'InternetGatewayIds': 'InternetGatewayId'}),
+        'DescribeRouteTables'     : ('route_tables'     , 'RouteTables'     , {'RouteTableIds': 'RouteTableId'}),
+        'DescribeInstanceTypes'   : ('instance_types'   , 'InstanceTypes'   , {'InstanceTypes': 'InstanceType'}),
+    }
+
+    def __init__(self):
+        self.regions = {}
+        self.buckets = {}        # bucket name -> {'CreationDate', 'Region', 'keys' (sorted), 'objects' (key -> dict)}
+        self.zones = {}          # zone ID -> {'zone', 'records' (sorted list of record sets)}
+        self.call_counts = {}    # (service, operation) -> count
+        self.lock = threading.Lock()
+        self.id_counter = 0
+        self.no_capacity = set()       # (AZ, instance type) where on-demand launches fail with InsufficientInstanceCapacity
+        self.no_spot_capacity = set()  # (AZ, instance type) where spot launches fail
+        self.launch_templates = {}     # launch template ID -> LaunchTemplateData
+
+    # -------------
+    #  bookkeeping
+    # -------------
+    def region(self, region_name):
+        if region_name not in self.regions:
+            self.regions[region_name] = RegionInventory(region_name)
+        return self.regions[region_name]
+
+    def new_id(self, prefix):
+        with self.lock:
+            self.id_counter += 1
+            return "%s-%017x" % (prefix, self.id_counter)
+
+    def clear(self):
+        """ forget the whole inventory (eg, to rebuild it with another size) """
+        with self.lock:
+            self.regions = {}
+            self.buckets = {}
+            self.zones = {}
+            self.call_counts = {}
+            self.launch_templates = {}
+
+    def reset_call_counts(self):
+        with self.lock:
+            self.call_counts = {}
+
+    def total_calls(self):
+        return sum(self.call_counts.values())
+
+    # -----------------
+    #  botocore events
+    # -----------------
+    def install(self, register):
+        """ install the stand-in.
+            register is a function that takes an event name and a handler
+            (eg, taw.util.register_session_event_handler or session.events.register).
+        """
+        register('before-parameter-build.*.*', self._capture_params)
+        register('before-call.*.*', self._serve)
+
+    def _capture_params(self, params, model, context, **kwargs):
+        context['standin_params'] = copy.copy(params)
+
+    def _serve(self, model, context, **kwargs):
+        service = model.service_model.service_name
+        operation = model.name
+        params = context.get('standin_params', {})
+        region_name = context.get('client_region') or 'us-east-1'
+        with self.lock:
+            key = (service, operation)
+            self.call_counts[key] = self.call_counts.get(key, 0) + 1
+        method = getattr(self, "%s_%s" % (service.replace('-', '_'), operation), None)
+        try:
+            if method is None:
+                raise StandInError('NotImplementedByStandIn', "%s.%s is not implemented by the stand-in" % (service, operation))
+            parsed = method(params, region_name) or {}
+            status_code = 200
+        except StandInError as e:
+            parsed = {'Error': {'Code': e.code, 'Message': e.message}}
+            status_code = e.status_code
+        parsed['ResponseMetadata'] = {'HTTPStatusCode': status_code, 'RetryAttempts': 0, 'HTTPHeaders': {}}
+        return botocore.awsrequest.AWSResponse(None, status_code, {}, None), parsed
+
+    # -----
+    #  EC2
+    # -----
+    def _select(self, items, params, id_params):
+        for param_name, item_key in id_params.items():
+            if params.get(param_name):
+                wanted = set(params[param_name])
+                items = [i for i in items if i.get(item_key) in wanted]
+        return [i for i in items if match_filters(i, params.get('Filters'))]
+
+    @staticmethod
+    def _paginate(items, params, token_name='NextToken', size_name='MaxResults'):
+        start = int(params.get(token_name) or 0)
+        size = params.get(size_name) or default_page_size or len(items)
+        page = items[start:start + size]
+        next_token = str(start + size) if start + size < len(items) else None
+        return page, next_token
+
+    def __getattr__(self, name):
+        # generic EC2 describe operations
+        if name.startswith('ec2_') and name[4:] in FakeAWS.ec2_describe_operations:
+            collection, response_key, id_params = FakeAWS.ec2_describe_operations[name[4:]]
+
+            def describe(params, region_name):
+                items = self._select(getattr(self.region(region_name), collection), params, id_params)
+                if collection == 'images' and params.get('Owners'):
+                    owners = set([account_id if o == 'self' else o for o in params['Owners']])
+                    items = [i for i in items if i['OwnerId'] in owners or i.get('ImageOwnerAlias') in owners]
+                if collection == 'snapshots' and params.get('OwnerIds'):
+                    owners = set([account_id if o == 'self' else o for o in params['OwnerIds']])
+                    items = [i for i in items if i['OwnerId'] in owners]
+                page, next_token = self._paginate(items, params)
+                response = {response_key: copy.deepcopy(page)}
+                if next_token: response['NextToken'] = next_token
+                return response
+            return describe
+        raise AttributeError(name)
+
+    def ec2_DescribeInstances(self, params, region_name):
+        instances = self._select(self.region(region_name).instances, params, {'InstanceIds': 'InstanceId'})
+        page, next_token = self._paginate(instances, params)
+        response = {'Reservations': [{'ReservationId': 'r-' + i['InstanceId'][2:], 'OwnerId': account_id,
+                                      'Instances': [copy.deepcopy(i)]} for i in page]}
+        if next_token: response['NextToken'] = next_token
+        return response
+
+    def _change_instance_states(self, params, region_name, new_state, new_code):
+        instances = self._select(self.region(region_name).instances, params, {'InstanceIds': 'InstanceId'})
+        if len(instances) != len(set(params['InstanceIds'])):
+            raise StandInError('InvalidInstanceID.NotFound', "The instance IDs '%s' do not exist" % ", ".join(params['InstanceIds']))
+        changes = []
+        for i in instances:
+            changes.append({'InstanceId': i['InstanceId'], 'PreviousState': copy.deepcopy(i['State']),
+                            'CurrentState': {'Name': new_state, 'Code': new_code}})
+            i['State'] = {'Name': new_state, 'Code': new_code}
+        return changes
+
+    def ec2_StartInstances(self, params, region_name):
+        return {'StartingInstances': self._change_instance_states(params, region_name, 'running', 16)}
+
+    def ec2_StopInstances(self, params, region_name):
+        return {'StoppingInstances': self._change_instance_states(params, region_name, 'stopped', 80)}
+
+    def ec2_TerminateInstances(self, params, region_name):
+        return {'TerminatingInstances': self._change_instance_states(params, region_name, 'terminated', 48)}
+
+    def _launch_instance(self, inv, params, subnet_id, instance_type, spot):
+        """ add an instance for RunInstances-like params (or LaunchTemplateData) to the inventory. Returns a copy of it. """
+        subnets = [s for s in inv.subnets if s['SubnetId'] == subnet_id]
+        if not subnets:
+            raise StandInError('InvalidSubnetID.NotFound', "The subnet ID '%s' does not exist" % subnet_id)
+        if not [i for i in inv.images if i['ImageId'] == params['ImageId']]:
+            raise StandInError('InvalidAMIID.NotFound', "The image id '[%s]' does not exist" % params['ImageId'])
+        subnet = subnets[0]
+        if (subnet['AvailabilityZone'], instance_type) in (self.no_spot_capacity if spot else self.no_capacity):
+            raise StandInError('InsufficientInstanceCapacity', "We currently do not have sufficient %s capacity in %s" %
+                               (instance_type, subnet['AvailabilityZone']), 500)
+        interface = (params.get('NetworkInterfaces') or [{}])[0]
+        group_ids = interface.get('Groups') or params.get('SecurityGroupIds') or []
+        tags = []
+        for spec in params.get('TagSpecifications', []):
+            if spec['ResourceType'] == 'instance': tags = copy.deepcopy(spec['Tags'])
+        n = len(inv.instances)
+        instance = {'InstanceId': self.new_id('i'), 'InstanceType': instance_type, 'ImageId': params['ImageId'],
+                    'PrivateIpAddress': '10.1.%d.%d' % (n // 250 % 250, n % 250 + 1),
+                    'State': {'Name': 'running', 'Code': 16}, 'StateReason': {'Message': ''},
+                    'SubnetId': subnet_id, 'VpcId': subnet['VpcId'],
+                    'Placement': {'AvailabilityZone': subnet['AvailabilityZone'], 'Tenancy': 'default'},
+                    'Architecture': 'x86_64', 'LaunchTime': datetime.datetime(2020, 1, 1, tzinfo=utc),
+                    'SecurityGroups': [{'GroupId': g, 'GroupName': ([s['GroupName'] for s in inv.security_groups if s['GroupId'] == g] or [g])[0]}
+                                       for g in group_ids],
+                    'BlockDeviceMappings': [], 'Tags': tags}
+        if spot: instance['InstanceLifecycle'] = 'spot'
+        if params.get('KeyName'): instance['KeyName'] = params['KeyName']
+        if interface.get('AssociatePublicIpAddress', True):
+            instance['PublicIpAddress'] = '203.0.%d.%d' % (n // 250 % 250, n % 250 + 1)
+        inv.instances.append(instance)
+        return copy.deepcopy(instance)
+
+    def ec2_RunInstances(self, params, region_name):
+        inv = self.region(region_name)
+        interface = (params.get('NetworkInterfaces') or [{}])[0]
+        subnet_id = interface.get('SubnetId') or params.get('SubnetId')
+        spot = params.get('InstanceMarketOptions', {}).get('MarketType') == 'spot'
+        launched = [self._launch_instance(inv, params, subnet_id, params['InstanceType'], spot) for _ in range(params['MaxCount'])]
+        return {'ReservationId': self.new_id('r'), 'OwnerId': account_id, 'Instances': launched}
+
+    def ec2_CreateLaunchTemplate(self, params, region_name):
+        template_id = self.new_id('lt')
+        self.launch_templates[template_id] = copy.deepcopy(params['LaunchTemplateData'])
+        return {'LaunchTemplate': {'LaunchTemplateId': template_id, 'LaunchTemplateName': params['LaunchTemplateName'],
+                                   'DefaultVersionNumber': 1, 'LatestVersionNumber': 1}}
+
+    def ec2_DeleteLaunchTemplate(self, params, region_name):
+        self.launch_templates.pop(params['LaunchTemplateId'], None)
+        return {'LaunchTemplate': {'LaunchTemplateId': params['LaunchTemplateId']}}
+
+    def ec2_CreateFleet(self, params, region_name):
+        """ an 'instant' fleet: fills the on-demand part and then the spot part from the overrides in order,
+            moving on to the next override when one has no capacity """
+        inv = self.region(region_name)
+        config = params['LaunchTemplateConfigs'][0]
+        data = self.launch_templates[config['LaunchTemplateSpecification']['LaunchTemplateId']]
+        target = params['TargetCapacitySpecification']
+        n_on_demand = target.get('OnDemandTargetCapacity', 0)
+        n_spot = target.get('SpotTargetCapacity', target['TotalTargetCapacity'] - n_on_demand)
+        fulfilled, errors = {}, {}
+        for lifecycle, n in [('on-demand', n_on_demand), ('spot', n_spot)]:
+            overrides = list(config['Overrides'])
+            while 0 < n and overrides:
+                o = overrides[0]
+                try:
+                    instance = self._launch_instance(inv, data, o['SubnetId'], o['InstanceType'], lifecycle == 'spot')
+                except StandInError as e:
+                    errors[(o['InstanceType'], o['SubnetId'], lifecycle)] = e
+                    overrides.pop(0)
+                    continue
+                fulfilled.setdefault((o['InstanceType'], o['SubnetId'], lifecycle), []).append(instance['InstanceId'])
+                n -= 1
+        spec = {'LaunchTemplateId': config['LaunchTemplateSpecification']['LaunchTemplateId'], 'Version': '1'}
+        return {'FleetId': self.new_id('fleet'),
+                'Instances': [{'LaunchTemplateAndOverrides': {'LaunchTemplateSpecification': spec, 'Overrides': {'InstanceType': t, 'SubnetId': s}},
+                               'Lifecycle': l, 'InstanceIds': ids, 'InstanceType': t} for (t, s, l), ids in sorted(fulfilled.items())],
+                'Errors': [{'LaunchTemplateAndOverrides': {'LaunchTemplateSpecification': spec, 'Overrides': {'InstanceType': t, 'SubnetId': s}},
+                            'Lifecycle': l, 'ErrorCode': e.code, 'ErrorMessage': e.message} for (t, s, l), e in sorted(errors.items())]}
+
+    def ec2_DescribeSpotPriceHistory(self, params, region_name):
+        history = []
+        for t in self.region(region_name).instance_types:
+            for k, az in enumerate(['a', 'b', 'c']):
+                history.append({'AvailabilityZone': region_name + az, 'InstanceType': t['InstanceType'], 'ProductDescription': 'Linux/UNIX',
+                                'SpotPrice': '%.6f' % (on_demand_price(t) * (0.3 + 0.05 * k)), 'Timestamp': datetime.datetime(2020, 1, 1)})
+        page, next_token = self._paginate(history, params)
+        response = {'SpotPriceHistory': page}
+        if next_token: response['NextToken'] = next_token
+        return response
+
+    def ec2_DescribeAvailabilityZones(self, params, region_name):
+        return {'AvailabilityZones': [{'ZoneName': region_name + s, 'State': 'available', 'Messages': [],
+                                       'RegionName': region_name} for s in 'abc']}
+
+    def ec2_DescribeRegions(self, params, region_name):
+        return {'Regions': [{'RegionName': r, 'Endpoint': 'ec2.%s.amazonaws.com' % r} for r in sorted(self.regions.keys())]}
+
+    def ec2_DescribeImageAttribute(self, params, region_name):
+        for i in self.region(region_name).images:
+            if i['ImageId'] == params['ImageId']:
+                return {'ImageId': i['ImageId'], 'LaunchPermissions': copy.deepcopy(i.get('LaunchPermissions', []))}
+        raise StandInError('InvalidAMIID.NotFound', "The image id '[%s]' does not exist" % params['ImageId'])
+
+    def _all_taggable(self, region_name):
+        inv = self.region(region_name)
+        for c in RegionInventory.collections:
+            for item in getattr(inv, c):
+                yield item
+
+    def ec2_CopyImage(self, params, region_name):
+        sources = [i for i in self.region(params['SourceRegion']).images if i['ImageId'] == params['SourceImageId']]
+        if not sources:
+            raise StandInError('InvalidAMIID.NotFound', "The image id '[%s]' does not exist" % params['SourceImageId'])
+        inv = self.region(region_name)
+        image_id = self.new_id('ami')
+        with self.lock:
+            if [i for i in inv.images if i['Name'] == params['Name'] and i['OwnerId'] == account_id]:
+                raise StandInError('InvalidAMIName.Duplicate', "AMI name %s is already in use by AMI" % params['Name'])
+            image = copy.deepcopy(sources[0])
+            image.update({'ImageId': image_id, 'Name': params['Name'], 'Description': params.get('Description'), 'State': 'available',
+                          'Tags': [t for s in params.get('TagSpecifications', []) for t in s['Tags']]})
+            inv.images.append(image)
+        return {'ImageId': image['ImageId']}
+
+    def ec2_CreateSnapshots(self, params, region_name):
+        inv = self.region(region_name)
+        spec = params['InstanceSpecification']
+        instances = [i for i in inv.instances if i['InstanceId'] == spec['InstanceId']]
+        if not instances:
+            raise StandInError('InvalidInstanceID.NotFound', "The instance ID '%s' does not exist" % spec['InstanceId'])
+        volume_ids = [d['Ebs']['VolumeId'] for d in instances[0].get('BlockDeviceMappings', []) if 'Ebs' in d]
+        if spec.get('ExcludeBootVolume'): volume_ids = volume_ids[1:]
+        snapshots = []
+        for v in [v for v in inv.volumes if v['VolumeId'] in volume_ids]:
+            tags = [t for s in params.get('TagSpecifications', []) for t in s['Tags']]
+            if params.get('CopyTagsFromSource') == 'volume': tags = v.get('Tags', []) + tags
+            snapshots.append({'SnapshotId': self.new_id('snap'), 'VolumeId': v['VolumeId'], 'VolumeSize': v['Size'], 'State': 'pending',
+                              'StartTime': datetime.datetime.now(utc), 'Progress': '', 'OwnerId': account_id, 'Encrypted': False,
+                              'Description': params.get('Description', ''), 'Tags': tags})
+        with self.lock:
+            inv.snapshots += snapshots
+        return {'Snapshots': copy.deepcopy(snapshots)}
+
+    def ec2_DeregisterImage(self, params, region_name):
+        inv = self.region(region_name)
+        with self.lock:
+            if not [i for i in inv.images if i['ImageId'] == params['ImageId']]:
+                raise StandInError('InvalidAMIID.NotFound', "The image id '[%s]' does not exist" % params['ImageId'])
+            inv.images = [i for i in inv.images if i['ImageId'] != params['ImageId']]
+        return {}
+
+    def ec2_DeleteSnapshot(self, params, region_name):
+        inv = self.region(region_name)
+        with self.lock:
+            if [i for i in inv.images if params['SnapshotId'] in [d.get('Ebs', {}).get('SnapshotId') for d in i.get('BlockDeviceMappings', [])]]:
+                raise StandInError('InvalidSnapshot.InUse', "The snapshot %s is currently in use by an AMI" % params['SnapshotId'])
+            inv.snapshots = [x for x in inv.snapshots if x['SnapshotId'] != params['SnapshotId']]
+        return {}
+
+    def ec2_CreateTags(self, params, region_name):
+        resources = set(params['Resources'])
+        found = set()
+        for item in self._all_taggable(region_name):
+            ids = [v for k, v in item.items() if k.endswith('Id') and isinstance(v, str)]
+            rid = [i for i in ids if i in resources]
+            if not rid: continue
+            found.update(rid)
+            tags = [t for t in item.get('Tags', []) if t['Key'] not in set([n['Key'] for n in params['Tags']])]
+            item['Tags'] = tags + [{'Key': t['Key'], 'Value': t.get('Value', '')} for t in params['Tags']]
+        missing = resources - found
+        if missing:
+            raise StandInError('InvalidID', "The ID '%s' is not valid" % sorted(missing)[0])
+        return {}
+
+    def ec2_DeleteTags(self, params, region_name):
+        resources = set(params['Resources'])
+        for item in self._all_taggable(region_name):
+            ids = [v for k, v in item.items() if k.endswith('Id') and isinstance(v, str)]
+            if not any([i in resources for i in ids]): continue
+            for t in params.get('Tags', []):
+                item['Tags'] = [x for x in item.get('Tags', [])
+                                if not (x['Key'] == t['Key'] and ('Value' not in t or x['Value'] == t['Value']))]
+        return {}
+
+    # ---------
+    #  Pricing
+    # ---------
+    def pricing_GetProducts(self, params, region_name):
+        filters = dict([(f['Field'], f['Value']) for f in params.get('Filters', [])])
+        products = []
+        for t in self.region(filters.get('regionCode', 'us-east-1')).instance_types:
+            sku = 'SKU%s' % t['InstanceType'].replace('.', '')
+            products.append(json.dumps({
+                'product': {'sku': sku, 'productFamily': 'Compute Instance',
+                            'attributes': {'instanceType': t['InstanceType'], 'regionCode': filters.get('regionCode'), 'operatingSystem': 'Linux'}},
+                'terms': {'OnDemand': {sku + '.TERM': {'priceDimensions': {sku + '.TERM.DIM': {'unit': 'Hrs',
+                                                                                               'pricePerUnit': {'USD': '%.6f' % on_demand_price(t)}}}}}}}))
+        page, next_token = self._paginate(products, params)
+        response = {'FormatVersion': 'aws_v1', 'PriceList': page}
+        if next_token: response['NextToken'] = next_token
+        return response
+
+    # -----
+    #  STS
+    # -----
+    def sts_GetCallerIdentity(self, params, region_name):
+        return {'UserId': 'AIDASTANDIN', 'Account': account_id, 'Arn': 'arn:aws:iam::%s:user/standin' % account_id}
+
+    # ----
+    #  S3
+    # ----
+    def _bucket(self, name):
+        if name not in self.buckets:
+            raise StandInError('NoSuchBucket', 'The specified bucket does not exist', 404)
+        return self.buckets[name]
+
+    def add_bucket(self, name, region_name='us-east-1'):
+        self.buckets[name] = {'CreationDate': datetime.datetime(2020, 1, 1), 'Region': region_name, 'keys': [], 'objects': {}}
+        return self.buckets[name]
+
+    def put_object(self, bucket_name, key, size, body=None):
+        b = self._bucket(bucket_name)
+        if key not in b['objects']:
+            bisect.insort(b['keys'], key)
+        b['objects'][key] = {'Key': key, 'Size': size, 'LastModified': datetime.datetime(2020, 1, 1),
+                             'ETag': '"%032x"' % (hash(key) & (2 ** 128 - 1)), 'StorageClass': 'STANDARD',
+                             'Owner': {'DisplayName': 'standin', 'ID': 'standin-id'},
+                             'Body': body}
+
+    def _delete_key(self, b, key):
+        if key in b['objects']:
+            del b['objects'][key]
+            b['keys'].pop(bisect.bisect_left(b['keys'], key))
+
+    def s3_ListBuckets(self, params, region_name):
+        return {'Buckets': [{'Name': k, 'CreationDate': v['CreationDate']} for k, v in sorted(self.buckets.items())
+                            if k.startswith(params.get('Prefix') or '')],
+                'Owner': {'DisplayName': 'standin', 'ID': 'standin-id'}}
+
+    def s3_GetBucketLocation(self, params, region_name):
+        r = self._bucket(params['Bucket'])['Region']
+        return {'LocationConstraint': None if r == 'us-east-1' else r}
+
+    def s3_GetBucketAcl(self, params, region_name):
+        self._bucket(params['Bucket'])
+        return {'Owner': {'DisplayName': 'standin', 'ID': 'standin-id'},
+                'Grants': [{'Grantee': {'Type': 'CanonicalUser', 'DisplayName': 'standin', 'ID': 'standin-id'},
+                            'Permission': 'FULL_CONTROL'}]}
+
+    s3_GetObjectAcl = s3_GetBucketAcl
+
+    def _list_objects(self, params, start_after):
+        b = self._bucket(params['Bucket'])
+        prefix = params.get('Prefix') or ''
+        keys = b['keys']
+        i = bisect.bisect_right(keys, start_after) if start_after else bisect.bisect_left(keys, prefix)
+        size = params.get('MaxKeys') or 1000
+        contents = []
+        while i < len(keys) and len(contents) < size:
+            if not keys[i].startswith(prefix):
+                if prefix < keys[i]: break
+                i += 1
+                continue
+            o = dict(b['objects'][keys[i]]); del o['Body']
+            contents.append(o)
+            i += 1
+        truncated = i < len(keys) and keys[i].startswith(prefix)
+        return contents, truncated
+
+    def s3_ListObjects(self, params, region_name):
+        contents, truncated = self._list_objects(params, params.get('Marker'))
+        response = {'Name': params['Bucket'], 'Prefix': params.get('Prefix', ''), 'Contents': contents, 'IsTruncated': truncated}
+        if truncated: response['NextMarker'] = contents[-1]['Key']
+        return response
+
+    def s3_ListObjectsV2(self, params, region_name):
+        contents, truncated = self._list_objects(params, params.get('ContinuationToken') or params.get('StartAfter'))
+        response = {'Name': params['Bucket'], 'Prefix': params.get('Prefix', ''), 'Contents': contents,
+                    'IsTruncated': truncated, 'KeyCount': len(contents)}
+        if truncated: response['NextContinuationToken'] = contents[-1]['Key']
+        return response
+
+    def s3_HeadObject(self, params, region_name):
+        b = self._bucket(params['Bucket'])
+        if params['Key'] not in b['objects']:
+            raise StandInError('404', 'Not Found', 404)
+        o = b['objects'][params['Key']]
+        return {'ContentLength': o['Size'], 'ETag': o['ETag'], 'LastModified': o['LastModified'],
+                'ContentType': 'application/octet-stream'}
+
+    def s3_GetObject(self, params, region_name):
+        b = self._bucket(params['Bucket'])
+        if params['Key'] not in b['objects']:
+            raise StandInError('NoSuchKey', 'The specified key does not exist.', 404)
+        o = b['objects'][params['Key']]
+        data = o['Body'] if o['Body'] is not None else b'\0' * o['Size']
+        return {'Body': botocore.response.StreamingBody(io.BytesIO(data), len(data)), 'ContentLength': len(data),
+                'ETag': o['ETag'], 'LastModified': o['LastModified'], 'ContentType': 'application/octet-stream'}
+
+    def s3_PutObject(self, params, region_name):
+        body = params.get('Body')
+        data = body.read() if hasattr(body, 'read') else (body or b'')
+        self.put_object(params['Bucket'], params['Key'], len(data), data)
+        return {'ETag': self.buckets[params['Bucket']]['objects'][params['Key']]['ETag']}
+
+    def s3_CopyObject(self, params, region_name):
+        src = params['CopySource']
+        if not isinstance(src, dict):
+            sb, _, sk = src.lstrip('/').partition('/')
+            src = {'Bucket': sb, 'Key': sk}
+        o = self._bucket(src['Bucket'])['objects'][src['Key']]
+        self.put_object(params['Bucket'], params['Key'], o['Size'], o['Body'])
+        return {'CopyObjectResult': {'ETag': o['ETag']}}
+
+    def s3_DeleteObject(self, params, region_name):
+        self._delete_key(self._bucket(params['Bucket']), params['Key'])
+        return {}
+
+    def s3_DeleteObjects(self, params, region_name):
+        b = self._bucket(params['Bucket'])
+        deleted = []
+        for o in params['Delete']['Objects']:
+            self._delete_key(b, o['Key'])
+            deleted.append({'Key': o['Key']})
+        return {'Deleted': deleted}
+
+    # ---------
+    #  Route53
+    # ---------
+    def add_zone(self, name, private=False):
+        zone_id = '/hostedzone/Z%012d' % (len(self.zones) + 1)
+        self.zones[zone_id] = {'zone': {'Id': zone_id, 'Name': name, 'CallerReference': zone_id,
+                                        'Config': {'Comment': '', 'PrivateZone': private}, 'ResourceRecordSetCount': 0},
+                               'records': []}
+        return zone_id
+
+    @staticmethod
+    def record_order(name):
+        """ Route53 lists record sets in the order of their labels from the right (com, example, www) """
+        return tuple(reversed(name.rstrip('.').split('.')))
+
+    def add_record(self, zone_id, name, type_str, values, ttl=300):
+        z = self.zones[zone_id]
+        bisect.insort(z['records'], (name, type_str, ttl, tuple(values)), key=lambda r: (self.record_order(r[0]), r[1]))
+        z['zone']['ResourceRecordSetCount'] = len(z['records'])
+
+    def route53_ListHostedZones(self, params, region_name):
+        zones = [v['zone'] for k, v in sorted(self.zones.items())]
+        start = int(params.get('Marker') or 0)
+        size = int(params.get('MaxItems') or 100)
+        response = {'HostedZones': copy.deepcopy(zones[start:start + size]), 'IsTruncated': start + size < len(zones),
+                    'MaxItems': str(size), 'Marker': params.get('Marker', '')}
+        if start + size < len(zones): response['NextMarker'] = str(start + size)
+        return response
+
+    def route53_ListResourceRecordSets(self, params, region_name):
+        if params['HostedZoneId'] not in self.zones and '/hostedzone/' + params['HostedZoneId'] not in self.zones:
+            raise StandInError('NoSuchHostedZone', 'No hosted zone found with ID: %s' % params['HostedZoneId'], 404)
+        z = self.zones.get(params['HostedZoneId']) or self.zones['/hostedzone/' + params['HostedZoneId']]
+        records = z['records']
+        start = 0
+        if params.get('StartRecordName'):
+            start = bisect.bisect_left(records, (self.record_order(params['StartRecordName']), params.get('StartRecordType', '')),
+                                       key=lambda r: (self.record_order(r[0]), r[1]))
+        size = int(params.get('MaxItems') or 300)
+        page = records[start:start + size]
+        response = {'ResourceRecordSets': [{'Name': n, 'Type': t, 'TTL': ttl, 'ResourceRecords': [{'Value': v} for v in vs]}
+                                           for n, t, ttl, vs in page],
+                    'IsTruncated': start + size < len(records), 'MaxItems': str(size)}
+        if start + size < len(records):
+            response['NextRecordName'] = records[start + size][0]
+            response['NextRecordType'] = records[start + size][1]
+        return response
+
+
+# the synthetic instance type catalog: family -> (vCPUs of 'large', GiB per vCPU, GPU name or None, architecture)
+instance_families = {
+    't3'  : (2, 4, None, 'x86_64'),
+    'm5'  : (2, 4, None, 'x86_64'),
+    'c5'  : (2, 2, None, 'x86_64'),
+    'c5a' : (2, 2, None, 'x86_64'),
+    'r5'  : (2, 8, None, 'x86_64'),
+    'm6g' : (2, 4, None, 'arm64'),
+    'c6g' : (2, 2, None, 'arm64'),
+    'g4dn': (4, 4, 'T4', 'x86_64'),
+    'p3'  : (8, 7.625, 'V100', 'x86_64'),
+}
+instance_sizes = [('large', 1), ('xlarge', 2), ('2xlarge', 4), ('4xlarge', 8), ('8xlarge', 16), ('12xlarge', 24), ('16xlarge', 32), ('24xlarge', 48)]
+
+
+def on_demand_price(item):
+    """ the synthetic on-demand price (USD per hour) of a DescribeInstanceTypes item """
+    gpus = sum([g['Count'] for g in item.get('GpuInfo', {}).get('Gpus', [])])
+    return 0.02 * item['VCpuInfo']['DefaultVCpus'] + 0.005 * item['MemoryInfo']['SizeInMiB'] / 1024.0 + 0.5 * gpus
+
+
+def instance_type_items():
+    """ DescribeInstanceTypes items of the synthetic catalog """
+    items = []
+    for family, (vcpu, mem_per_vcpu, gpu, arch) in sorted(instance_families.items()):
+        for size, factor in instance_sizes:
+            n_vcpus = vcpu * factor
+            item = {'InstanceType': '%s.%s' % (family, size), 'CurrentGeneration': True,
+                    'VCpuInfo': {'DefaultVCpus': n_vcpus}, 'MemoryInfo': {'SizeInMiB': int(n_vcpus * mem_per_vcpu * 1024)},
+                    'ProcessorInfo': {'SupportedArchitectures': [arch]},
+                    'NetworkInfo': {'NetworkPerformance': 'Up to 10 Gigabit' if factor <= 4 else '%d Gigabit' % (factor * 25 // 16)},
+                    'EbsInfo': {'EbsOptimizedInfo': {'MaximumBandwidthInMbps': min(19000, 4750 * factor // 2)}}}
+            if gpu:
+                n_gpus = max(1, factor // 4)
+                item['GpuInfo'] = {'Gpus': [{'Name': gpu, 'Manufacturer': 'NVIDIA', 'Count': n_gpus, 'MemoryInfo': {'SizeInMiB': 16384}}],
+                                   'TotalGpuMemoryInMiB': 16384 * n_gpus}
+            items.append(item)
+    return items
+
+
+# public images of trusted owners: (owner ID, owner alias, name, architecture, creation date)
+public_images = [
+    ('137112412989', 'amazon', 'al2023-ami-2023.4.20240401.1-kernel-6.1-x86_64', 'x86_64', '2024-04-01T00:00:00.000Z'),
+    ('137112412989', 'amazon', 'al2023-ami-2023.4.20240416.0-kernel-6.1-x86_64', 'x86_64', '2024-04-16T00:00:00.000Z'),
+    ('137112412989', 'amazon', 'al2023-ami-2023.4.20240416.0-kernel-6.1-arm64' , 'arm64' , '2024-04-16T00:00:00.000Z'),
+    ('137112412989', 'amazon', 'al2023-ami-minimal-2023.4.20240416.0-kernel-6.1-x86_64', 'x86_64', '2024-04-17T00:00:00.000Z'),
+    ('099720109477', None    , 'ubuntu/images/hvm-ssd/ubuntu-jammy-22.04-amd64-server-20240411', 'x86_64', '2024-04-11T00:00:00.000Z'),
+    ('099720109477', None    , 'ubuntu/images/hvm-ssd/ubuntu-jammy-22.04-arm64-server-20240411', 'arm64' , '2024-04-11T00:00:00.000Z'),
+    ('111122223333', None    , 'ubuntu/images/hvm-ssd/ubuntu-jammy-22.04-amd64-server-20990101', 'x86_64', '2099-01-01T00:00:00.000Z'),  # untrusted
+]
+
+
+def build_inventory(fake, region_name='us-east-1', n_instances=10, n_objects=100, n_records=100, n_images=10):
+    """ populate a FakeAWS with a synthetic account.
+        Subnets, VPCs and security groups are scaled with the number of instances.
+    """
+    inv = fake.region(region_name)
+    n_subnets = max(1, n_instances // 50)
+    n_vpcs = max(1, n_subnets // 10)
+    n_sgs = max(2, n_instances // 100)
+    launch_time = datetime.datetime(2020, 1, 1, tzinfo=utc)
+    for v in range(n_vpcs):
+        inv.vpcs.append({'VpcId': fake.new_id('vpc'), 'CidrBlock': '10.%d.0.0/16' % v, 'State': 'available',
+                         'IsDefault': v == 0, 'DhcpOptionsId': 'dopt-0', 'InstanceTenancy': 'default',
+                         'Tags': [{'Key': 'Name', 'Value': 'vpc%03d' % v}]})
+        inv.internet_gateways.append({'InternetGatewayId': fake.new_id('igw'),
+                                      'Attachments': [{'VpcId': inv.vpcs[-1]['VpcId'], 'State': 'available'}], 'Tags': []})
+    for s in range(n_subnets):
+        vpc = inv.vpcs[s % n_vpcs]
+        inv.subnets.append({'SubnetId': fake.new_id('subnet'), 'VpcId': vpc['VpcId'], 'CidrBlock': '10.%d.%d.0/24' % (s % n_vpcs, s),
+                            'State': 'available', 'DefaultForAz': False, 'AvailableIpAddressCount': 250,
+                            'AvailabilityZone': region_name + 'abc'[s % 3], 'Tags': [{'Key': 'Name', 'Value': 'subnet%04d' % s}]})
+    for g in range(n_sgs):
+        vpc = inv.vpcs[g % n_vpcs]
+        inv.security_groups.append({'GroupId': fake.new_id('sg'), 'GroupName': 'sg%03d' % g, 'VpcId': vpc['VpcId'],
+                                    'Description': 'bench', 'OwnerId': account_id,
+                                    'IpPermissions': [{'IpProtocol': 'tcp', 'FromPort': 22, 'ToPort': 22,
+                                                       'IpRanges': [{'CidrIp': '0.0.0.0/0'}], 'UserIdGroupPairs': []}],
+                                    'IpPermissionsEgress': [{'IpProtocol': '-1', 'IpRanges': [{'CidrIp': '0.0.0.0/0'}],
+                                                             'UserIdGroupPairs': []}],
+                                    'Tags': []})
+    inv.instance_types = instance_type_items()
+    inv.key_pairs.append({'KeyName': 'bench', 'KeyPairId': fake.new_id('key'), 'KeyFingerprint': '00:11:22'})
+    for i in range(n_images):
+        inv.images.append({'ImageId': fake.new_id('ami'), 'Name': 'image%04d' % i, 'State': 'available', 'Architecture': 'x86_64',
+                           'CreationDate': '2020-01-%02dT00:00:00.000Z' % (1 + i % 28), 'Public': False, 'OwnerId': account_id,
+                           'Description': 'bench image %d' % i, 'VirtualizationType': 'hvm', 'Hypervisor': 'xen',
+                           'RootDeviceName': '/dev/xvda',
+                           'BlockDeviceMappings': [{'DeviceName': '/dev/xvda',
+                                                    'Ebs': {'SnapshotId': fake.new_id('snap'), 'VolumeSize': 8, 'VolumeType': 'gp3',
+                                                            'Encrypted': False, 'DeleteOnTermination': True}}],
+                           'LaunchPermissions': [], 'Tags': []})
+        snapshot_id = inv.images[-1]['BlockDeviceMappings'][0]['Ebs']['SnapshotId']
+        inv.snapshots.append({'SnapshotId': snapshot_id, 'VolumeId': 'vol-ffffffff', 'VolumeSize': 8, 'State': 'completed',
+                              'StartTime': launch_time, 'Progress': '100%', 'OwnerId': account_id, 'Encrypted': False,
+                              'Description': 'Created by CreateImage for image%04d' % i, 'Tags': []})
+    for owner, alias, name, arch, date in public_images:
+        inv.images.append({'ImageId': fake.new_id('ami'), 'Name': name, 'State': 'available', 'Architecture': arch,
+                           'CreationDate': date, 'Public': True, 'OwnerId': owner, 'ImageOwnerAlias': alias,
+                           'VirtualizationType': 'hvm', 'Hypervisor': 'xen', 'RootDeviceName': '/dev/xvda', 'Tags': []})
+    for n in range(n_instances):
+        subnet = inv.subnets[n % n_subnets]
+        sg = inv.security_groups[n % n_sgs]
+        instance_id = fake.new_id('i')
+        volume_id = fake.new_id('vol')
+        inv.instances.append({'InstanceId': instance_id, 'InstanceType': 't3.micro', 'KeyName': 'bench',
+                              'ImageId': inv.images[0]['ImageId'] if inv.images else 'ami-0',
+                              'PublicIpAddress': '198.51.%d.%d' % (n // 250 % 250, n % 250 + 1),
+                              'PrivateIpAddress': '10.0.%d.%d' % (n // 250 % 250, n % 250 + 1),
+                              'State': {'Name': 'running', 'Code': 16}, 'StateReason': {'Message': ''},
+                              'SubnetId': subnet['SubnetId'], 'VpcId': subnet['VpcId'],
+                              'Placement': {'AvailabilityZone': subnet['AvailabilityZone'], 'Tenancy': 'default'},
+                              'Architecture': 'x86_64', 'LaunchTime': launch_time,
+                              'SecurityGroups': [{'GroupName': sg['GroupName'], 'GroupId': sg['GroupId']}],
+                              'BlockDeviceMappings': [{'DeviceName': '/dev/xvda', 'Ebs': {'VolumeId': volume_id, 'Status': 'attached'}}],
+                              'Tags': [{'Key': 'Name', 'Value': 'worker%05d' % n}, {'Key': 'root', 'Value': 'ec2-user'}]})
+        inv.volumes.append({'VolumeId': volume_id, 'Size': 8, 'VolumeType': 'gp3', 'State': 'in-use',
+                            'AvailabilityZone': subnet['AvailabilityZone'], 'CreateTime': launch_time, 'Encrypted': False,
+                            'Attachments': [{'VolumeId': volume_id, 'InstanceId': instance_id, 'Device': '/dev/xvda', 'State': 'attached'}],
+                            'Tags': []})
+    if 'bench-bucket' not in fake.buckets:
+        fake.add_bucket('bench-bucket', region_name)
+        for k in range(n_objects):
+            fake.put_object('bench-bucket', 'data/%06d.txt' % k, 1024)
+    if not fake.zones:
+        zone_id = fake.add_zone('example.com.')
+        fake.add_record(zone_id, 'example.com.', 'NS', ['ns1.example.com.'], 172800)
+        for r in range(n_records):
+            fake.add_record(zone_id, 'host%05d.example.com.' % r, 'A', ['198.51.100.%d' % (r % 250 + 1)])
+    return fake
@@ -15,7 +15,8 @@ depending_libraries = \
         'pyperclip',
         'awscli>=1.11.35',
         'dnspython',
-        'ipython'
+        'ipython',
+        'PyYAML'
     ]
 if sys.version_info < (3, 0):
     depending_libraries.append('pysqlite')  # this is only needed by Python 2.x
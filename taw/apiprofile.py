@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+from __future__ import print_function
+from __future__ import absolute_import
+import sys, time, json, threading, contextlib, functools
+
+
+# This module must not import taw.util (taw.util imports this module).
+# Heavy modules (boto3, tabulate) are imported lazily so that the import
+# itself can be used as the reference point for the 'import' phase.
+
+# Global variables
+module_loaded_time = time.time()
+is_profiling = False
+profile_trace_path = None
+api_call_records = []
+api_call_records_lock = threading.Lock()
+phase_stack = []     # list of [phase name, time when the phase was (re)entered]
+phase_to_seconds = {}
+phase_order = []
+
+# request parameters that mean 'give me the next page'
+pagination_token_names = ['NextToken', 'Marker', 'ContinuationToken', 'StartRecordName', 'KeyMarker', 'ContinuationSequenceNumber']
+
+
+def _add_phase_time(phase_name, seconds):
+    if phase_name not in phase_to_seconds:
+        phase_to_seconds[phase_name] = 0.0
+        phase_order.append(phase_name)
+    phase_to_seconds[phase_name] += seconds
+
+
+def current_phase():
+    """ returns the name of the phase we are in (or None if not profiling) """
+    if len(phase_stack) <= 0: return None
+    return phase_stack[-1][0]
+
+
+@contextlib.contextmanager
+def profile_phase(phase_name):
+    """ account the wall time spent in the with-block to a phase named phase_name.
+        Phases nest; the time is accounted to the innermost phase only.
+        This is a no-op unless the API profiler is running.
+    """
+    if not is_profiling or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+    now = time.time()
+    if 0 < len(phase_stack):
+        _add_phase_time(phase_stack[-1][0], now - phase_stack[-1][1])
+    phase_stack.append([phase_name, now])
+    try:
+        yield
+    finally:
+        now = time.time()
+        name, started = phase_stack.pop()
+        _add_phase_time(name, now - started)
+        if 0 < len(phase_stack):
+            phase_stack[-1][1] = now
+
+
+def profiled_phase(phase_name):
+    """ decorator version of profile_phase() """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with profile_phase(phase_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# botocore event handlers
+def _on_before_parameter_build(params, model, context, **kwargs):
+    context['taw_profile_start'] = time.time()
+    context['taw_profile_phase'] = current_phase()
+    context['taw_profile_continuation'] = any([params.get(k) for k in pagination_token_names])
+
+
+def _record_call(model, context, http_response, parsed, error):
+    if 'taw_profile_start' not in context: return
+    now = time.time()
+    nbytes = 0
+    retries = 0
+    if http_response is not None:
+        try:
+            nbytes = int(http_response.headers.get('content-length', 0))
+        except (TypeError, ValueError):
+            nbytes = 0
+    if parsed is not None:
+        retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+    record = {
+        'service'     : model.service_model.service_name,
+        'operation'   : model.name,
+        'region'      : context.get('client_region'),
+        'phase'       : context.get('taw_profile_phase'),
+        'start'       : context['taw_profile_start'] - module_loaded_time,
+        'latency'     : now - context['taw_profile_start'],
+        'retries'     : retries,
+        'bytes'       : nbytes,
+        'continuation': context.get('taw_profile_continuation', False),
+        'error'       : error,
+    }
+    with api_call_records_lock:
+        api_call_records.append(record)
+
+
+def _on_after_call(http_response, parsed, model, context, **kwargs):
+    error = None
+    if http_response is not None and 300 <= http_response.status_code:
+        error = parsed.get('Error', {}).get('Code', str(http_response.status_code))
+    _record_call(model, context, http_response, parsed, error)
+
+
+def _on_after_call_error(exception, context, **kwargs):
+    # 'model' is not given to this event, so we cannot use _record_call as is.
+    if 'taw_profile_start' not in context: return
+    model = context.get('taw_profile_model')
+    if model is None: return
+    _record_call(model, context, None, None, exception.__class__.__name__)
+
+
+def _on_before_call(model, context, **kwargs):
+    context['taw_profile_model'] = model
+
+
+def session_event_handlers():
+    """ returns the list of (event name, handler) used by the profiler """
+    return [
+        ('before-parameter-build.*.*', _on_before_parameter_build),
+        ('before-call.*.*'           , _on_before_call),
+        ('after-call.*.*'            , _on_after_call),
+        ('after-call-error.*.*'      , _on_after_call_error),
+    ]
+
+
+def start_api_profiler(trace_path=None):
+    """ start recording API calls and phases.
+        The report is printed to stderr (or written to trace_path as JSON) at exit.
+        Returns False if the profiler has already been started.
+    """
+    global is_profiling, profile_trace_path
+    if is_profiling: return False
+    import atexit
+    is_profiling = True
+    profile_trace_path = trace_path
+    now = time.time()
+    _add_phase_time('import', now - module_loaded_time)
+    phase_stack.append(['fetch', now])
+    atexit.register(report_api_profile)
+    return True
+
+
+def summarize_api_calls(records):
+    """ group API call records by (service, operation, region) """
+    groups = {}
+    order = []
+    for r in records:
+        key = (r['service'], r['operation'], r['region'])
+        if key not in groups:
+            groups[key] = {'service': r['service'], 'operation': r['operation'], 'region': r['region'],
+                           'calls': 0, 'pages': 0, 'retries': 0, 'errors': 0, 'bytes': 0,
+                           'total': 0.0, 'max': 0.0}
+            order.append(key)
+        g = groups[key]
+        g['calls'] += 1
+        if r['continuation']: g['pages'] += 1
+        g['retries'] += r['retries']
+        if r['error'] is not None: g['errors'] += 1
+        g['bytes'] += r['bytes']
+        g['total'] += r['latency']
+        g['max'] = max(g['max'], r['latency'])
+    return [groups[k] for k in order]
+
+
+def report_api_profile():
+    """ print the summary of API calls and phases (or write a JSON trace) """
+    global is_profiling
+    if not is_profiling: return
+    if 0 < len(phase_stack):
+        # the outer phases have been paused, so only the innermost one is running
+        name, started = phase_stack[-1]
+        _add_phase_time(name, time.time() - started)
+    del phase_stack[:]
+    is_profiling = False
+    with api_call_records_lock:
+        records = list(api_call_records)
+    summary = summarize_api_calls(records)
+    phases = [{'phase': p, 'seconds': phase_to_seconds[p]} for p in phase_order]
+    if profile_trace_path is not None:
+        with open(profile_trace_path, "w") as f:
+            json.dump({'phases': phases, 'summary': summary, 'calls': records}, f, indent=2, default=str)
+        print("API profile was written to '%s'" % profile_trace_path, file=sys.stderr)
+        return
+    import tabulate
+    header = ['Service', 'Operation', 'Region', 'Calls', 'Cont. Pages', 'Retries', 'Errors', 'KBytes', 'Total (ms)', 'Max (ms)']
+    rows = [[g['service'], g['operation'], g['region'], g['calls'], g['pages'], g['retries'], g['errors'],
+             "%.1f" % (g['bytes'] / 1024.0), "%.1f" % (g['total'] * 1000), "%.1f" % (g['max'] * 1000)]
+            for g in sorted(summary, key=lambda g: -g['total'])]
+    print("", file=sys.stderr)
+    print(tabulate.tabulate(rows, header, 'simple'), file=sys.stderr)
+    print("", file=sys.stderr)
+    print(tabulate.tabulate([[p['phase'], "%.1f" % (p['seconds'] * 1000)] for p in phases], ['Phase', 'Time (ms)'], 'simple'), file=sys.stderr)
+    print("", file=sys.stderr)
+    print("%d API calls, %.1f ms in total" % (len(records), sum([r['latency'] for r in records]) * 1000), file=sys.stderr)
+    for g in summary:
+        if 5 <= g['calls'] - g['pages']:
+            print("NOTE: %s.%s (%s) was called %d times; this might be an N+1 pattern." %
+                  (g['service'], g['operation'], g['region'], g['calls'] - g['pages']), file=sys.stderr)
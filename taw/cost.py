@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+from __future__ import print_function
+from __future__ import absolute_import
+import click, re, datetime
+import concurrent.futures
+from taw.util import *
+from taw.taw import *  # This must be the end of imports
+
+# commands/subcommands
+
+
+# ==============
+#  COST COMMAND
+# ==============
+def name_prefix(name):
+    """ returns the prefix of a name that groups numbered resources (eg, 'worker-012' -> 'worker') """
+    if not name: return '(no name)'
+    return re.sub(r'[-_.]?\d+$', '', name) or name
+
+
+def hours_since(t, now):
+    """ returns the hours from t (a datetime from the API) to now (a naive datetime in UTC) """
+    if t is None: return 0.0
+    if t.tzinfo is not None: t = t.replace(tzinfo=None) - t.utcoffset()
+    return max(0.0, (now - t).total_seconds() / 3600.0)
+
+
+def take_inventory_snapshot(ec2):
+    """ returns (instances, volumes, addresses) (dicts of the API responses) in the region of an EC2 client """
+    instances = []
+    for page in ec2.get_paginator('describe_instances').paginate(Filters=[{'Name': 'instance-state-name',
+                                                                           'Values': ['pending', 'running', 'stopping', 'stopped']}]):
+        for reservation in page['Reservations']: instances += reservation['Instances']
+    volumes = []
+    for page in ec2.get_paginator('describe_volumes').paginate():
+        volumes += page['Volumes']
+    return instances, volumes, ec2.describe_addresses()['Addresses']
+
+
+def take_inventory_snapshots(region_names):
+    """ take inventory snapshots of regions concurrently (a thread per region).
+        Returns a dictionary (region name -> (instances, volumes, addresses)); the regions that failed are warned and skipped.
+    """
+    import botocore.exceptions
+    clients = [get_ec2_client_for_region(r) for r in region_names]  # creating clients is not thread-safe
+    snapshots = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(16, len(region_names)))) as executor:
+        future_to_region = dict([(executor.submit(take_inventory_snapshot, c), r) for c, r in zip(clients, region_names)])
+        for future in concurrent.futures.as_completed(future_to_region):
+            try:
+                snapshots[future_to_region[future]] = future.result()
+            except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+                print_warning("Could not list the resources in %s: %s" % (future_to_region[future], e))
+    return snapshots
+
+
+def cost_items_of_snapshot(region_name, snapshot, instance_prices, resource_prices, now):
+    """ returns the list of cost items (dicts) of the resources in a snapshot of a region.
+        An item has kind ('instance', 'volume' or 'address'), region, id, name, tags (dict), vpc, running (bool), size (GiB),
+        hourly (USD per hour, or None if the price is unknown) and accrued (USD since the launch/creation).
+    """
+    instances, volumes, addresses = snapshot
+    id_to_instance = dict([(i['InstanceId'], i) for i in instances])
+    items = []
+
+    def tags_of(resource, instance_id=None):
+        tags = dict([(t['Key'], t['Value']) for t in resource.get('Tags') or []])
+        if 'Name' not in tags and instance_id in id_to_instance:  # named after the instance it is attached to
+            tags = dict([(t['Key'], t['Value']) for t in id_to_instance[instance_id].get('Tags') or []] + list(tags.items()))
+        return tags
+
+    for i in instances:
+        running = i['State']['Name'] in ['pending', 'running']
+        price = instance_prices.get(price_list_key_of_instance(region_name, i['InstanceType'], i.get('PlatformDetails'), i.get('Platform'),
+                                                               i.get('Placement', {}).get('Tenancy')))
+        hourly = (price if running else 0.0) if price is not None or not running else None
+        items.append({'kind': 'instance', 'region': region_name, 'id': i['InstanceId'], 'tags': tags_of(i), 'vpc': i.get('VpcId'),
+                      'running': running, 'size': 0, 'hourly': hourly,
+                      'accrued': (hourly or 0.0) * hours_since(i.get('LaunchTime'), now) if running else 0.0})
+    for v in volumes:
+        instance_id = (v.get('Attachments') or [{}])[0].get('InstanceId')
+        price = resource_prices.get((region_name, 'volume:' + v.get('VolumeType', '')))
+        hourly = None if price is None else price * v['Size'] / hours_per_month
+        items.append({'kind': 'volume', 'region': region_name, 'id': v['VolumeId'], 'tags': tags_of(v, instance_id),
+                      'vpc': id_to_instance.get(instance_id, {}).get('VpcId'), 'running': False, 'size': v['Size'], 'hourly': hourly,
+                      'accrued': (hourly or 0.0) * hours_since(v.get('CreateTime'), now)})
+    for a in addresses:
+        instance_id = a.get('InstanceId')
+        hourly = resource_prices.get((region_name, 'address:in-use' if a.get('AssociationId') else 'address:idle'))
+        items.append({'kind': 'address', 'region': region_name, 'id': a.get('AllocationId') or a.get('PublicIp'), 'tags': tags_of(a, instance_id),
+                      'vpc': id_to_instance.get(instance_id, {}).get('VpcId'), 'running': False, 'size': 0, 'hourly': hourly,
+                      'accrued': 0.0})  # the allocation time is not known
+    for item in items: item['name'] = item['tags'].get('Name')
+    return items
+
+
+@taw.command("cost", short_help='show the hourly burn and the accrued cost of running resources')
+@click.option('--by', 'group_by', default='name', metavar='name|tag:KEY|vpc|region',
+              help="Group by the name prefix (default; eg, worker-01 and worker-02 are 'worker'), a tag, VPC or region")
+@click.option('--allregions/--thisregion', default=True, help="Look at all regions (default) or the current region only")
+@click.option('--verbose', '-v', is_flag=True, help='Verbose output.')
+@pass_global_parameters
+def cost_cmd(params, group_by, allregions, verbose):
+    """ show what instances, EBS volumes and public IPs are costing now (USD per hour),
+        and the cost accrued since instances were launched (or volumes were created).
+
+        \b
+        eg) taw cost
+            taw cost --by tag:project
+            taw cost --by region --thisregion
+        Prices come from the offline price catalog (see 'taw list price import').
+        Instances are charged from the last launch (start). Public IPs are not in the accrued cost
+        because their allocation time is unknown.
+    """
+    if group_by not in ['name', 'vpc', 'region'] and not group_by.startswith('tag:'):
+        error_exit("--by must be one of name, tag:KEY, vpc and region")
+    if allregions:
+        region_names = sorted([r['RegionName'] for r in get_ec2_client().describe_regions()['Regions']])
+    else:
+        region_names = [get_ec2_client().meta.region_name]
+    snapshots = take_inventory_snapshots(region_names)
+    instance_prices = get_local_instance_prices()
+    resource_prices = get_resource_price_catalog()
+    now = datetime.datetime.utcnow()
+    items = []
+    for region_name in sorted(snapshots.keys()):
+        items += cost_items_of_snapshot(region_name, snapshots[region_name], instance_prices, resource_prices, now)
+
+    def group_of(item):
+        if group_by == 'name': return name_prefix(item['name'])
+        if group_by == 'vpc': return item['vpc'] or '(no VPC)'
+        if group_by == 'region': return item['region']
+        return item['tags'].get(group_by[4:], '(none)')
+
+    groups = {}
+    for item in items:
+        g = groups.setdefault(group_of(item), {'instances': 0, 'stopped': 0, 'volumes': 0, 'gib': 0, 'addresses': 0,
+                                               'hourly': 0.0, 'accrued': 0.0, 'unpriced': 0})
+        if item['kind'] == 'instance':
+            g['instances' if item['running'] else 'stopped'] += 1
+        elif item['kind'] == 'volume':
+            g['volumes'] += 1
+            g['gib'] += item['size']
+        else:
+            g['addresses'] += 1
+        if item['hourly'] is None:
+            g['unpriced'] += 1
+        else:
+            g['hourly'] += item['hourly']
+        g['accrued'] += item['accrued']
+    all_list_columns = [
+            (True , "instances", "# Running"  , ident)                      ,
+            (True , "stopped"  , "# Stopped"  , ident)                      ,
+            (True , "volumes"  , "# Volumes"  , ident)                      ,
+            (False, "gib"      , "Volume GiB" , ident)                      ,
+            (True , "addresses", "# IPs"      , ident)                      ,
+            (True , "hourly"   , "USD/hour"   , lambda x: "%.4f" % x)       ,
+            (False, "hourly"   , "USD/month"  , lambda x: "%.2f" % (x * hours_per_month)),
+            (True , "accrued"  , "Accrued USD", lambda x: "%.2f" % x)       ,
+            (False, "unpriced" , "# Unpriced" , ident)                      ,
+        ]
+    list_columns = [x for x in all_list_columns if verbose or x[0]]
+    header = [group_by.capitalize() if not group_by.startswith('tag:') else group_by] + [x[2] for x in list_columns]
+    rows = []
+    total = dict([(k, sum([g[k] for g in groups.values()])) for _, k, _, _ in all_list_columns])
+    for name, g in sorted(groups.items(), key=lambda x: (-x[1]['hourly'], x[0])):
+        rows.append([name] + [f(g[k]) for _, k, _, f in list_columns])
+    output_table(params, header, rows, [lambda r: {-1: 'yellow'} if r[0] == 'TOTAL' else None],
+                 footer_rows=[['TOTAL'] + [f(total[k]) for _, k, _, f in list_columns]])
+    unpriced_regions = sorted(set([i['region'] for i in items if i['hourly'] is None]))
+    if 0 < len(unpriced_regions):
+        print_warning("%d resource(s) have no price (not counted). Import the price lists of %s by 'taw -r REGION list price import'." %
+                      (total['unpriced'], ", ".join(unpriced_regions)))
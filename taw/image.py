@@ -2,7 +2,7 @@
 
 from __future__ import print_function
 from __future__ import absolute_import
-import click, six
+import click, six, re, time, datetime
 from taw.util import *
 from taw.taw import *  # This must be the end of imports
 
@@ -27,6 +27,23 @@ def device_mappings_to_device_mapping_strs(xs):
         rows.append("\n".join(devs))
     return rows
 
+
+def describe_launch_permissions(image_ids):
+    """ returns a dictionary (image ID -> the list of launch permissions, or None if it could not be described).
+        The images are described concurrently.
+    """
+    import concurrent.futures
+    import botocore.exceptions
+    ec2_client = get_ec2_client()
+
+    def describe(image_id):
+        try:
+            return ec2_client.describe_image_attribute(ImageId=image_id, Attribute='launchPermission')['LaunchPermissions']
+        except botocore.exceptions.ClientError:
+            return None
+    with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
+        return dict(zip(image_ids, executor.map(describe, image_ids)))
+
 # ==============
 #  AMI COMMAND
 # ==============
@@ -91,18 +108,29 @@ def name_amicmd(param, ami_id, name):
 @click.argument('keywords', nargs=-1)
 @click.option('--argdoc', is_flag=True)
 @click.option('--verbose', is_flag=True)
-@click.option('--attr', '-a', multiple=True, help='Attribute name(s).')
+@click.option('--perm', is_flag=True, help='Show the launch permissions of my images (implied by --verbose).')
+@click.option('--attr', '-a', multiple=True, help='Attribute name(s) or column header(s) to show (only they are shown).')
 @click.option('--allregions', is_flag=True, help='List for all regions.')
 @pass_global_parameters
-def list_image(params, keywords, argdoc, verbose, attr, allregions):
-    """ list images (of mine or trusted parties) """
-    dummy_argument = keywords # renaming
+def list_image(params, keywords, argdoc, verbose, perm, attr, allregions):
+    """ list images (of mine or trusted parties).
+        Keywords are searched in the descriptions (all of them must be found); a keyword /abc excludes descriptions with abc.
+        Filter terms (eg, name=ubuntu-* arch=arm64) narrow the list; keys are name, id, state, arch, owner, description, public and tag:KEY.
+    """
+    filter_terms, dummy_argument = split_filter_terms(keywords)
+    image_filter = ResourceFilter(filter_terms, {
+            'name'       : ('name'        , lambda i: i.name)        ,
+            'id'         : ('image-id'    , lambda i: i.image_id)    ,
+            'state'      : ('state'       , lambda i: i.state)       ,
+            'arch'       : ('architecture', lambda i: i.architecture),
+            'owner'      : ('owner-id'    , lambda i: i.owner_id)    ,
+            'description': ('description' , lambda i: i.description) ,
+            'public'     : ('is-public'   , lambda i: i.public)      ,
+        })
     if argdoc:
         click.launch('https://boto3.readthedocs.io/en/latest/reference/services/ec2.html#image')
         return
-    sts_client = get_sts_client()
-    sts_result = sts_client.get_caller_identity()
-    user_id = sts_result['Account']
+    user_id = get_account_id()
 
     def self_if_mine(account_str):
         if account_str == user_id:
@@ -122,59 +150,226 @@ def list_image(params, keywords, argdoc, verbose, attr, allregions):
             (False, "hypervisor"           , "Hypervisor"      , ident)                       ,
             (False, "block_device_mappings", "Block Device Map", device_mappings_to_device_mapping_strs)        ,
         ]
-    list_columns = [x for x in all_list_columns if verbose or x[0]]
-    for v in attr: list_columns.append((True, v, v, ident))
+    list_columns = select_list_columns(all_list_columns, verbose, attr)
     header = [x[2] for x in list_columns]; rows = []
     ec2 = get_ec2_connection()
+    positive_keywords = [k for k in dummy_argument if not k.startswith('/')]
+    negative_keywords = [k[1:] for k in dummy_argument if k.startswith('/')]
+    # positive keywords are filtered by EC2 (filters are ANDed; '*' is a wildcard, so is '?')
+    keyword_filters = [{'Name': 'description', 'Values': ['*' + k + '*']} for k in positive_keywords]
     if 0 < len(dummy_argument):
         images = ec2.images.filter(Owners=['self', '099720109477'],
                                    Filters=[{'Name': 'is-public', 'Values': ['true']},
-                                            {'Name': 'virtualization-type', 'Values': ['hvm']}])
+                                            {'Name': 'virtualization-type', 'Values': ['hvm']}] + keyword_filters + image_filter.ec2_filters())
     else:
         images = ec2.images.filter(Owners=['self'],
                                    Filters=[{'Name': 'is-public', 'Values': ['false']},
-                                            {'Name': 'virtualization-type', 'Values': ['hvm']}])
-    header.append('Permissions')
+                                            {'Name': 'virtualization-type', 'Values': ['hvm']}] + image_filter.ec2_filters())
+    images = [i for i in images
+              if (len(dummy_argument) <= 0 or (i.description is not None and all([i.description.find(k) < 0 for k in negative_keywords])))
+              and image_filter.matches(i)]
+    if perm or verbose:
+        header.append('Permissions')
+        image_id_to_perms = describe_launch_permissions([i.image_id for i in images if i.owner_id == user_id])
     try:
         for image in images:
             row = [f(getattr(image, i)) for _, i, _, f in list_columns]
-            if image.owner_id == user_id:
-                try:
-                    perms = image.describe_attribute(Attribute='launchPermission')['LaunchPermissions']
-                    # print(perms)
-                    # print(list(map(lambda x: x['UserId'], perms)))
-                    row.append(", ".join(['self'] + list(map(lambda x: x['UserId'], perms))))
-                except:
+            if perm or verbose:
+                if image.owner_id != user_id:
+                    row.append('Not mine')
+                elif image_id_to_perms.get(image.image_id) is None:
                     row.append('ERROR')
-            else:
-                row.append('Not mine')
-            has_to_exclude = False
-            desc = row[7]
-            if desc is None and len(dummy_argument) > 0:
-                has_to_exclude = True
-            if len(dummy_argument) > 0 and desc is not None:
-                all_found = True
-                any_pos_keyword = False
-                for i in dummy_argument:
-                    if i.startswith('/'):
-                        if desc.find(i[1:]) >= 0:
-                            has_to_exclude = True
-                            break
-                    else:
-                        any_pos_keyword = True
-                        if desc.find(i) < 0:
-                            all_found = False
-                if any_pos_keyword and not all_found:
-                    has_to_exclude = True
-            if not has_to_exclude:
-                rows.append(row)
+                else:
+                    row.append(", ".join(['self'] + [x['UserId'] for x in image_id_to_perms[image.image_id] if 'UserId' in x] +
+                                         [x['Group'] for x in image_id_to_perms[image.image_id] if 'Group' in x]))
+            rows.append(row)
     except AttributeError as e:
         error_exit(str(e) + "\nNo such attribute.\nTry 'taw list --argdoc' to see all attributes.")
 
+    state_index = header.index('State') if 'State' in header else None
+
     def coloring(r):
-        if verbose: return None
-        if r[2] == 'pending': return {-1: 'cyan'}
+        if verbose or state_index is None: return None
+        if r[state_index] == 'pending': return {-1: 'cyan'}
         return None
 
     output_table(params, header, rows, [coloring])
 
+
+def snapshot_ids_of_image(image):
+    """ returns the IDs of the EBS snapshots that back an image (a dict of DescribeImages) """
+    return [d['Ebs']['SnapshotId'] for d in image.get('BlockDeviceMappings', []) if d.get('Ebs', {}).get('SnapshotId')]
+
+
+@image_group.command("prune")
+@click.option('--keep', type=int, help='Keep the newest N images (of those that match --name-glob).')
+@click.option('--older-than', 'older_than', type=float, help='Remove only the images older than D days.')
+@click.option('--name-glob', 'name_glob', default='*', help="Prune only the images whose names match (eg, 'web-*').")
+@click.option('--force', is_flag=True, help='Actually remove (otherwise shows what would be removed).')
+@pass_global_parameters
+def prune_amicmd(params, keep, older_than, name_glob, force):
+    """ deregister old images of mine and delete the EBS snapshots behind them.
+        Images used by existing instances are kept.
+
+        \b
+        eg) taw image prune --name-glob 'web-*' --keep 3
+            taw image prune --older-than 90 --force
+    """
+    if keep is None and older_than is None: error_exit("Specify --keep and/or --older-than")
+    ec2_client = get_ec2_client()
+    images = ec2_client.describe_images(Owners=['self'], Filters=[{'Name': 'name', 'Values': [name_glob]}])['Images']
+    snapshot_id_to_size = dict([(x['SnapshotId'], x['VolumeSize']) for p in ec2_client.get_paginator('describe_snapshots').paginate(OwnerIds=['self'])
+                                for x in p['Snapshots']])
+    images_in_use = set()
+    image_ids = [i['ImageId'] for i in images]
+    for k in range(0, len(image_ids), 200):  # the number of filter values is limited
+        for p in ec2_client.get_paginator('describe_instances').paginate(Filters=[{'Name': 'image-id', 'Values': image_ids[k:k + 200]}]):
+            for r in p['Reservations']: images_in_use.update([i['ImageId'] for i in r['Instances']])
+    images.sort(key=lambda i: i['CreationDate'], reverse=True)
+    oldest_to_keep = None
+    if older_than is not None:
+        oldest_to_keep = (datetime.datetime.utcnow() - datetime.timedelta(days=older_than)).strftime("%Y-%m-%dT%H:%M:%S")
+    expired = [i for n, i in enumerate(images) if (keep is None or keep <= n) and (oldest_to_keep is None or i['CreationDate'] < oldest_to_keep)]
+    to_prune = [i for i in expired if i['ImageId'] not in images_in_use]
+    image_ids_to_prune = set([i['ImageId'] for i in to_prune])
+    snapshots_to_keep = set([s for i in images if i['ImageId'] not in image_ids_to_prune for s in snapshot_ids_of_image(i)])
+    snapshot_ids = []  # in order, once each even if images share a snapshot
+    for s in [s for i in to_prune for s in snapshot_ids_of_image(i) if s not in snapshots_to_keep and s in snapshot_id_to_size]:
+        if s not in snapshot_ids: snapshot_ids.append(s)
+    header = ['Name', 'Image ID', 'Created', 'Snapshots', 'GB']
+    rows = [[i.get('Name'), i['ImageId'], convert_amazon_time_to_local(i['CreationDate']), snapshot_ids_of_image(i),
+             sum([snapshot_id_to_size.get(s, 0) for s in snapshot_ids_of_image(i) if s not in snapshots_to_keep])] for i in to_prune]
+    output_table(params, header, rows)
+    reclaimed_gb = sum([snapshot_id_to_size[s] for s in snapshot_ids])
+    if len(to_prune) < len(expired): print_info("%d image(s) are kept because instances use them" % (len(expired) - len(to_prune)))
+    if not force or params.aws_dryrun:
+        print("%d image(s) and %d snapshot(s) (%d GB) would be removed. Please add --force to actually remove them." %
+              (len(to_prune), len(snapshot_ids), reclaimed_gb))
+        return
+    failed_images = set()
+    for image_id, _, e in run_concurrently(lambda x: ec2_client.deregister_image(ImageId=x), [i['ImageId'] for i in to_prune]):
+        if e is not None:
+            print_warning("Could not deregister %s: %s" % (image_id, e))
+            failed_images.add(image_id)
+    snapshots_of_failed_images = set([s for i in to_prune if i['ImageId'] in failed_images for s in snapshot_ids_of_image(i)])
+    snapshot_ids = [s for s in snapshot_ids if s not in snapshots_of_failed_images]
+    deleted_gb = 0
+    for snapshot_id, _, e in run_concurrently(lambda x: ec2_client.delete_snapshot(SnapshotId=x), snapshot_ids):
+        if e is not None:
+            print_warning("Could not delete %s: %s" % (snapshot_id, e))
+        else:
+            deleted_gb += snapshot_id_to_size[snapshot_id]
+    print_info("Removed %d image(s) and %d GB of snapshots" % (len(to_prune) - len(failed_images), deleted_gb))
+
+
+@image_group.command("replicate")
+@click.argument('ami_ids', nargs=-1, required=True)
+@click.option('--to', 'to_regions', required=True, help='Comma-separated regions (names or nicknames; eg, tokyo,oregon).')
+@click.option('--wait/--nowait', default=True, help='Wait until the copies become available (default).')
+@click.option('--interval', type=float, default=30, help='Seconds between polls (default: 30).')
+@click.option('--timeout', type=float, default=3600, help='Seconds to wait at most (default: 3600).')
+@pass_global_parameters
+def replicate_amicmd(params, ami_ids, to_regions, wait, interval, timeout):
+    """ copy images of mine to other regions at once.
+        The copies have the same names and tags (plus taw:source-image), and they are registered in the local AMI database
+        when they become available (with --nowait, when they are requested),
+        so that 'instance launch' in any of the regions finds an image by its name.
+
+        \b
+        eg) taw image replicate myimage --to tokyo,oregon
+            taw image replicate ami-0123456789abcdef0 image-b --to eu-west-1 --nowait
+    """
+    started = time.time()
+    ec2_client = get_ec2_client()
+    source_region = ec2_client.meta.region_name
+    ids = [a for a in ami_ids if re.match(r'ami-[0-9a-f]+$', a)]
+    names = [a for a in ami_ids if a not in ids]
+    images = ec2_client.describe_images(ImageIds=ids)['Images'] if 0 < len(ids) else []
+    if 0 < len(names): images += ec2_client.describe_images(Owners=['self'], Filters=[{'Name': 'name', 'Values': names}])['Images']
+    for a in ids:
+        if a not in [i['ImageId'] for i in images]: error_exit("Cannot find an AMI ID '%s'" % a)
+    for a in names:
+        found = [i['ImageId'] for i in images if i['Name'] == a]
+        if len(found) <= 0: error_exit("Cannot find an AMI '%s'" % a)
+        if 1 < len(found): error_exit("There are multiple AMI IDs with name='%s'.\nCandidates are:\n\t%s" % (a, "\n\t".join(found)))
+    region_names = []
+    for r in to_regions.split(','):
+        r = normalize_region_name(r.strip())
+        if r == source_region:
+            print_warning("Skipped %s (the images are there)" % r)
+        elif r not in region_names:
+            region_names.append(r)
+    if len(region_names) <= 0: error_exit("No regions to copy to")
+    if params.aws_dryrun:
+        output_table(params, ['Name', 'Image ID', 'To'], [[i['Name'], i['ImageId'], region_names] for i in images])
+        return
+    region_to_client = dict([(r, get_ec2_client_for_region(r)) for r in region_names])  # creating clients is not thread-safe
+
+    def copy(image_and_region):
+        image, region_name = image_and_region
+        tags = [t for t in image.get('Tags', []) if not t['Key'].startswith('aws:')]
+        tags.append({'Key': 'taw:source-image', 'Value': source_region + '/' + image['ImageId']})
+        args = {'SourceRegion': source_region, 'SourceImageId': image['ImageId'], 'Name': image['Name'],
+                'ClientToken': "%s-%s-%d" % (image['ImageId'], region_name, started),  # retrying (but not running again) returns the same copy
+                'TagSpecifications': [{'ResourceType': 'image', 'Tags': tags}]}
+        if image.get('Description'): args['Description'] = image['Description']
+        return region_to_client[region_name].copy_image(**args)['ImageId']
+    copies = {}  # (source image ID, region) -> [copy ID, state]
+    for (image, region_name), copy_id, e in run_concurrently(copy, [(i, r) for i in images for r in region_names]):
+        copies[(image['ImageId'], region_name)] = [copy_id, 'pending'] if e is None else [None, 'ERROR: %s' % e]
+    while wait:
+        region_to_pending = {}
+        for (_, region_name), c in six.iteritems(copies):
+            if c[1] == 'pending': region_to_pending.setdefault(region_name, []).append(c[0])
+        if len(region_to_pending) <= 0: break
+        if started + timeout < time.time():
+            print_warning("Timed out. The copies are still pending in %s (they are not registered in the local AMI database)" %
+                          ", ".join(sorted(region_to_pending.keys())))
+            break
+        copy_id_to_state = {}
+        for _, found, e in run_concurrently(lambda r: region_to_client[r].describe_images(ImageIds=region_to_pending[r])['Images'],
+                                            list(region_to_pending.keys())):  # a poll per region
+            for i in found or []:
+                copy_id_to_state[i['ImageId']] = i['State'] if i['State'] != 'failed' else 'failed: ' + i.get('StateReason', {}).get('Message', '')
+        for c in copies.values():
+            if c[0] in copy_id_to_state: c[1] = copy_id_to_state[c[0]]
+        n_available = len([c for c in copies.values() if c[1] == 'available'])
+        print_info("%d/%d copies are available (%d seconds)" % (n_available, len(copies), time.time() - started))
+        if [c for c in copies.values() if c[1] == 'pending']: time.sleep(interval)
+    registered_states = ['available'] if wait else ['pending']  # a failed (or timed-out) copy must not be found by its name
+    conn = open_AMI_DB()
+    with conn:
+        for image in images:
+            region_to_ami = dict([(r, copies[(image['ImageId'], r)][0]) for r in region_names if copies[(image['ImageId'], r)][1] in registered_states])
+            region_to_ami[source_region] = image['ImageId']
+            add_AMI_regions_to_local_database(conn, image['Name'], region_to_ami)
+    conn.close()
+    header = ['Name', 'Source', 'Region', 'Image ID', 'State']
+    rows = [[i['Name'], i['ImageId'], r] + copies[(i['ImageId'], r)] for i in images for r in region_names]
+    output_table(params, header, rows, [lambda r: {-1: 'red'} if r[4] != 'available' and r[4] != 'pending' else None])
+    print_info("Took %d seconds" % (time.time() - started))
+
+
+@image_group.command("refresh")
+@click.argument('regions', nargs=-1)
+@click.option('--allregions', is_flag=True, help='Refresh all regions.')
+@pass_global_parameters
+def refresh_amicmd(params, regions, allregions):
+    """ look up the latest images of popular OS (Amazon Linux, Ubuntu, RHEL, etc.) by trusted owners
+        and store them in the local AMI database, so that 'instance launch' can find them offline.
+
+        \b
+        eg) taw image refresh
+            taw image refresh ap-northeast-1 us-west-2
+            taw image refresh --allregions
+    """
+    if allregions:
+        regions = sorted([r['RegionName'] for r in get_ec2_client().describe_regions()['Regions']])
+    elif len(regions) <= 0:
+        regions = [get_ec2_client().meta.region_name]
+    region_to_images = update_recommended_image_cache(list(regions))
+    header = ['Region', 'Name', 'AMI', 'Arch', 'Image Name', 'Created']; rows = []
+    for region_name in sorted(region_to_images.keys()):
+        for name, i in region_to_images[region_name]:
+            rows.append([region_name, name, i['ImageId'], i['Architecture'], i['Name'], convert_amazon_time_to_local(i['CreationDate'])])
+    output_table(params, header, rows)
@@ -7,8 +7,9 @@ from taw.list import *
 from taw.util import *
 from taw.taw import *  # This must be the end of imports
 from six.moves import input
-import shlex
-import six
+import shlex, json, six, uuid
+import concurrent.futures, threading
+import botocore.exceptions
 
 
 # =======================
@@ -121,22 +122,16 @@ def change_instance_type_instancecmd(params, hostname, new_instance_name):
 def set_host_name(params, hostname):
     """ set or fix the host name of a specified host """
     instance = convert_host_name_to_instance(hostname)
-    import __main__
-    cmdline = [__main__.__file__] + params.global_opt_str
-    cmdline += ['ssh', hostname, '--', 'sudo', 'sh', '-c', shlex.quote("echo %s > /etc/hostname" % hostname)]
-    subprocess.check_call(cmdline)
-    cmdline = [__main__.__file__] + params.global_opt_str
-    cmdline += ['ssh', hostname, '--', 'sudo', 'hostname', hostname]
-    subprocess.check_call(cmdline)
-    cmdline = [__main__.__file__] + params.global_opt_str
-    cmdline += ['ssh', hostname, '--', 'cat', '/etc/hosts']
-    etc_hosts = subprocess.check_output(cmdline)
-    if len(list(filter(lambda x: re.search(hostname, x), six.text_type(etc_hosts).split("\\n")))) <= 0: # TODO: this needs to be more sophisticated ...
+    ssh_like_call(params, 'ssh', instance, ['sudo', 'sh', '-c', shlex.quote("echo %s > /etc/hostname" % hostname)])
+    ssh_like_call(params, 'ssh', instance, ['sudo', 'hostname', hostname])
+    etc_hosts = ssh_like_call(params, 'ssh', instance, ['cat', '/etc/hosts'], True)
+    if etc_hosts is None:
+        if params.aws_dryrun: return
+        error_exit("Could not read /etc/hosts on '%s'" % hostname)
+    if len(list(filter(lambda x: re.search(hostname, x), etc_hosts.decode('utf-8').split("\n")))) <= 0: # TODO: this needs to be more sophisticated ...
         print_info("/etc/hosts does not contain the host '%s'" % hostname)
         print_info("Try to add IP for the host...")
-        cmdline = [__main__.__file__] + params.global_opt_str
-        cmdline += ['ssh', hostname, '--', 'sudo', 'sh', '-c', shlex.quote("echo 127.0.0.1 %s >> /etc/hosts" % hostname)]
-        subprocess.check_call(cmdline)
+        ssh_like_call(params, 'ssh', instance, ['sudo', 'sh', '-c', shlex.quote("echo 127.0.0.1 %s >> /etc/hosts" % hostname)])
 
 
 @instance_group.command("set_api_termination", short_help='allow/disallow API termination')
@@ -204,11 +199,15 @@ def createimage_instancecmd(params, hostname, name, description, options):
         )
 
 
-def ask_instance_name_interactively(ctx, params, name):
+def ask_instance_name_interactively(ctx, params, name, count=None):
+    """ returns (the name pattern, the list of names of new instances).
+        A pattern such as 'worker-{01..20}' names multiple instances (see instance_names_from_pattern).
+    """
     if name is None:
         print("")
         print("Name a new instance. Type '?' for listing current instances. CTRL+C to quit.")
-    ec2 = get_ec2_connection()
+        if count is not None and 1 < count:
+            print("Use a pattern such as 'worker-{01..%02d}' to name %d instances." % (count, count))
     while True:
         while name is None:
             print("")
@@ -218,17 +217,20 @@ def ask_instance_name_interactively(ctx, params, name):
                 continue
             if name == '': continue
             name = new_name
-        if not re.match("^[\w\d]+$", name):
-            print_warning("Name '%s' is invalid (contains illegal character(s))" % name)
+        try:
+            names = instance_names_from_pattern(name, count)
+        except ValueError as e:
+            print_warning(str(e))
             name = None
             continue
-        instances = list(ec2.instances.filter(Filters=[{'Name': 'tag:Name', 'Values': [name]}]))
-        if 0 < len(instances):
-            print_warning("An instance with name '%s' already exists (ID=%s).\nTry with another name." % (name, instances[0].id))
+        existing_names = find_instance_ids_by_names(names)
+        if 0 < len(existing_names):
+            print_warning("\n".join(["An instance with name '%s' already exists (ID=%s)." % (n, existing_names[n]) for n in sorted(existing_names.keys())]) +
+                          "\nTry with another name.")
             name = None
             continue
         break
-    return name
+    return name, names
 
 
 def ask_instance_type_interactively(ctx, params, instancetype):
@@ -236,25 +238,28 @@ def ask_instance_type_interactively(ctx, params, instancetype):
         print("")
         print("Choose an instance type. Type '?' for listing instance types. CTRL+C to quit.")
         print("To list specific types of instances, type '?prefix' (eg: ?t2)")
-    completer = PrefixCompleter(instance_type_name_to_instance_type.keys()); readline.set_completer(completer.completer)
+        print("To find instance types by constraints, type '?' and options of 'taw instance types' (eg: ?--min-vcpu 8 --max-price 0.5)")
+    catalog = get_instance_type_catalog()
+    completer = PrefixCompleter(catalog.keys()); readline.set_completer(completer.completer)
     while True:
         while instancetype is None:
             print("")
             new_inst = input("  Instance type: ")
+            if new_inst.startswith('?') and ' -' in ' ' + new_inst[1:]:
+                try:
+                    with taw.make_context('taw', params.global_opt_str + ['--noless', 'instance', 'types'] + shlex.split(new_inst[1:])) as ncon: _ = taw.invoke(ncon)
+                except click.ClickException as e:
+                    e.show()
+                continue
             if new_inst.startswith('?'):
                 prefix_str = new_inst[1:]
-                header = ['type', '#vcpu', 'mem (GB)', 'desc']
-                rows = []
-                for t in sorted(instance_type_name_to_instance_type.keys()):
-                    if not t.startswith(prefix_str): continue
-                    v = instance_type_name_to_instance_type[t]
-                    rows.append([t, v['vcpu'], v['mem'], v['desc']])
-                output_table(params, header, rows)
+                rows = [instance_type_catalog_row(t, catalog[t]) for t in sorted_instance_type_names(catalog, prefix_str)]
+                output_table(params, instance_type_catalog_header, rows)
                 continue
             if new_inst == '': continue
             instancetype = new_inst
-        if instancetype not in instance_type_name_to_instance_type:
-            print_warning("%s is not a valid instance type" % instancetype)
+        if 0 < len(catalog) and instancetype not in catalog:  # an empty catalog means it could not be fetched
+            print_warning("%s is not a valid instance type (or not offered in this region)" % instancetype)
             instancetype = None
             continue
         break
@@ -263,18 +268,19 @@ def ask_instance_type_interactively(ctx, params, instancetype):
 
 def ask_ami_id_interactively(ctx, params, ami_id):
     ami_name = '(unknown)'
-    db_path = get_AMI_DB_file_path()
-    conn = sqlite3.connect(db_path)
-    completion_candidates = [sql_row[0] for sql_row in conn.execute("SELECT * FROM ami_ids;")]
-    # IMAGES
+    conn = open_AMI_DB()
     ec2 = get_ec2_connection()
+    my_region = ec2.meta.client.meta.region_name
+    completion_candidates = [sql_row[0] for sql_row in conn.execute("SELECT name FROM images")]
+    completion_candidates += [r[0] for r in query_recommended_images(conn, my_region)]
+    # IMAGES
     images = ec2.images.filter(Filters=[{'Name': 'is-public', 'Values': ['false']}])
     image_id = map(lambda x: x.id, images)
     image_names = map(lambda x: x.name, images)
     completion_candidates += image_id
     completion_candidates += image_names
     if ami_id is None and len(completion_candidates) <= 0:
-        error_exit("You have to register AMI ID first. Type 'taw instance register_market_ami'.\nAlternatively you can directly specify an AMI ID if you know one.")
+        error_exit("You have to register AMI ID first. Type 'taw image refresh' (or 'taw instance register_market_ami').\nAlternatively you can directly specify an AMI ID if you know one.")
     completer = PrefixCompleter(completion_candidates); readline.set_completer(completer.completer)
     if ami_id is None:
         print("")
@@ -296,18 +302,14 @@ def ask_ami_id_interactively(ctx, params, ami_id):
             ami_id = new_ami_id
         # conver name to ami
         if not re.match('^ami-([\d\w]+)$', ami_id):
-            my_region = get_aws_region()
-            candidate_ami = []
-            for sql_row in conn.execute("SELECT * FROM ami_ids;"):
-                image_name = sql_row[0]
-                if not image_name.startswith(ami_id): continue
-                region_to_ami = pickle.loads(sql_row[1])
-                if my_region in region_to_ami:
-                    candidate_ami.append((image_name, region_to_ami[my_region]))
+            candidate_ami = [(r[0], r[1]) for r in query_recommended_images(conn, my_region, ami_id)]
+            candidate_ami += query_AMI_DB_by_name_prefix(conn, ami_id, my_region)
             for image in images:
                 name = image.name
                 if not name.startswith(ami_id): continue
                 candidate_ami.append((name, image.id))
+            if 1 < len(candidate_ami) and ami_id in [n for n, _ in candidate_ami]:  # an exact match (eg, 'ubuntu-22.04' rather than 'ubuntu-22.04-arm64')
+                candidate_ami = [(n, ami) for n, ami in candidate_ami if n == ami_id][:1]
             if len(candidate_ami) <= 0:
                 print_warning("No such AMIs. Try different AMI (or name query).")
                 ami_id = None
@@ -562,16 +564,46 @@ def estimate_root_accout_name_from_ami_name(ami_name):
 @click.option('--subnet')
 @click.option('--rootaccount')
 @click.option('--keyname', help="Name of SSH private key you use")
-@click.option('--count', default=1, type=int, help="Number of instances you need to launch")
+@click.option('--count', default=1, type=int, help="Number of instances you need to launch (name them by a pattern such as 'worker-{01..20}')")
+@click.option('--spread', is_flag=True, help="Spread the instances over the subnets of the VPC (and use them when an AZ runs out of capacity)")
+@click.option('--spot', is_flag=True, help="Launch spot instances (fall back to on-demand when no spot capacity is found by --deadline)")
+@click.option('--fleet', is_flag=True, help="Launch with one EC2 Fleet request; --instancetype may list acceptable types (eg: c5.xlarge,c5a.xlarge,m5.xlarge)")
+@click.option('--ondemand', default=0, type=int, help="Number of on-demand instances in a --spot --fleet launch (the rest are spot)")
+@click.option('--deadline', default=0, type=int, help="Seconds to keep trying spot capacity before falling back to on-demand")
 @click.option('--ebsoptimized', is_flag=True, help="Use optimized EBS backend")
 @click.option('--noebsoptimized', is_flag=True, help="Do not use optimized EBS backend")
 @click.option('--securitygroup', multiple=True)
 @click.option('--disableapitermination', is_flag=True, help="Prevent a new instance from being terminated by API")
 @click.option('--enableapitermination', is_flag=True, help="Allow termination by API")
+@click.option('--spec', type=click.Path(exists=True, dir_okay=False), help="Launch the instances described in a YAML/JSON file without asking anything")
 @pass_global_parameters
 @click.pass_context
-def launch_instancecmd(ctx, params, name, instancetype, amiid, keyname, vpc, subnet, count, ebsoptimized, noebsoptimized, disableapitermination, enableapitermination, securitygroup, shutdownbehavior, rootaccount, ami_name):
-    """ Launch a new instance interactively """
+def launch_instancecmd(ctx, params, name, instancetype, amiid, keyname, vpc, subnet, count, spread, spot, fleet, ondemand, deadline, ebsoptimized, noebsoptimized, disableapitermination, enableapitermination, securitygroup, shutdownbehavior, rootaccount, ami_name, spec):
+    """ Launch a new instance interactively
+
+        \b
+        With --spec, launch groups of instances described in a file non-interactively, eg)
+            defaults:
+              ami: ami-0123456789abcdef0      # AMI ID or name
+              keyname: mykey
+              subnet: [subnet-a, subnet-b]    # subnet names or IDs (spread over them)
+              securitygroup: [ssh]            # names (in the VPC of the subnet) or IDs
+              tags: {project: foo}
+            groups:
+              - name: head
+                instancetype: m5.large
+              - name: worker-{01..20}         # or 'name: worker' and 'count: 20'
+                instancetype: c5.xlarge
+              - name: batch-{001..100}
+                instancetype: [c5.xlarge, c5a.xlarge, m5.xlarge]  # a list launches the group with EC2 Fleet
+                spot: true                    # capacity-optimized spot
+                ondemand: 10                  # of which 10 are on-demand
+                deadline: 300                 # seconds before falling back to on-demand
+        Other keys: rootaccount, shutdownbehavior, ebsoptimized, disableapitermination, publicip, fleet.
+    """
+    if spec:
+        launch_instances_from_spec(params, spec)
+        return
 
     try:
         count = int(count)
@@ -579,8 +611,15 @@ def launch_instancecmd(ctx, params, name, instancetype, amiid, keyname, vpc, sub
         error_exit(count + " is not an integer")
     (amiid, new_ami_name) = ask_ami_id_interactively(ctx, params, amiid)
     ami_name = ami_name or new_ami_name
-    name = ask_instance_name_interactively(ctx, params, name)
-    instancetype = ask_instance_type_interactively(ctx, params, instancetype)
+    name, names = ask_instance_name_interactively(ctx, params, name, count)
+    count = len(names)
+    if fleet:
+        instancetypes = [ask_instance_type_interactively(ctx, params, t.strip()) for t in (instancetype or '').split(',') if t.strip() != '']
+        if len(instancetypes) <= 0: instancetypes = [ask_instance_type_interactively(ctx, params, None)]
+        instancetype = ",".join(instancetypes)
+    else:
+        if instancetype is not None and ',' in instancetype: error_exit("Multiple instance types need --fleet")
+        instancetype = ask_instance_type_interactively(ctx, params, instancetype)
     keyname = ask_key_interactively(ctx, params, keyname)
     vpc = ask_vpc_interactively(ctx, params, vpc)
     subnet = ask_subnet_interactively(ctx, params, vpc, subnet)
@@ -593,6 +632,9 @@ def launch_instancecmd(ctx, params, name, instancetype, amiid, keyname, vpc, sub
         ebsoptimized = False
     else:
         ebsoptimized = ask_if_not_set("Need EBS optimization? If set, you get faster storage but pay more. Not available for all instance types.", ebsoptimized)
+    if spot and shutdownbehavior != 'terminate':
+        if shutdownbehavior is not None: print_warning("Spot instances are terminated on shutdown (--shutdownbehavior %s is ignored)" % shutdownbehavior)
+        shutdownbehavior = 'terminate'
     shutdownbehavior = ask_shutdownbehavior_interactively(shutdownbehavior)
     if rootaccount:
         root_account_name = rootaccount
@@ -608,7 +650,12 @@ def launch_instancecmd(ctx, params, name, instancetype, amiid, keyname, vpc, sub
     print("You can retry this with the following command:")
     print("")
     cmd_line = "taw instance launch --count %d --name %s --instancetype %s --amiid %s --vpc %s --subnet %s --shutdownbehavior %s --keyname %s" % (
-                    count, name, instancetype, amiid, vpc, subnet, shutdownbehavior, keyname)
+                    count, shlex.quote(name), instancetype, amiid, vpc, subnet, shutdownbehavior, keyname)
+    if spread: cmd_line += ' --spread'
+    if spot: cmd_line += ' --spot --deadline %d' % deadline
+    if fleet: cmd_line += ' --fleet'
+    if spot and fleet and 0 < ondemand: cmd_line += ' --ondemand %d' % ondemand
+
     cmd_line += ''.join(map(lambda x: " --securitygroup " + x, securitygroup))
     cmd_line += " --rootaccount " + root_account_name
     cmd_line += " --ami_name '" + ami_name + "'"
@@ -622,53 +669,424 @@ def launch_instancecmd(ctx, params, name, instancetype, amiid, keyname, vpc, sub
         cmd_line += ' --noebsoptimized'
     print(cmd_line)
     print("=" * 70)
-    ec2 = get_ec2_connection()
+    ec2 = get_ec2_client()
+    subnets = [(i['SubnetId'], i['AvailabilityZone']) for i in ec2.describe_subnets(Filters=[{'Name': 'vpc-id', 'Values': [vpc]}])['Subnets']]
+    subnets = [i for i in subnets if i[0] == subnet] + (sorted([i for i in subnets if i[0] != subnet], key=lambda x: x[1]) if spread else [])
+    fleet_spec = {'instance_types': instancetype.split(','), 'on_demand': ondemand} if fleet else None
+    requests = [{'name': n, 'image_id': amiid, 'instance_type': instancetype.split(',')[0], 'key_name': keyname, 'subnets': subnets,
+                 'security_group_ids': list(securitygroup), 'root_account': root_account_name, 'shutdown_behavior': shutdownbehavior,
+                 'ebs_optimized': ebsoptimized, 'disable_api_termination': disableapitermination, 'public_ip': True, 'tags': {},
+                 'spot': spot, 'deadline': deadline, 'fleet': fleet_spec}
+                for n in names]
     print("")
-    print("Creating new instance(s) ...")
-    result_instances = ec2.create_instances(
-        ImageId=amiid,
-        MinCount=count,
-        MaxCount=count,
-        KeyName=keyname,
-        InstanceType=instancetype,
-        # Placement={
-        #     'AvailabilityZone': 'string',
-        #     'GroupName': 'string',
-        #     'Tenancy': 'default',
-        #     'HostId': 'string',
-        #     'Affinity': 'string'
-        # },
-        # BlockDeviceMappings=[
-        #     ],
-        DisableApiTermination=disableapitermination,
-        InstanceInitiatedShutdownBehavior='stop',
-        EbsOptimized=ebsoptimized,
+    launch_instances_for_requests_and_report(params, requests)
+    print("Done.")
+
+
+# ==============================
+#  LAUNCH FROM A SPEC (IN BULK)
+# ==============================
+launch_spec_keys = ['name', 'count', 'ami', 'instancetype', 'keyname', 'subnet', 'securitygroup', 'shutdownbehavior',
+                    'rootaccount', 'ebsoptimized', 'disableapitermination', 'publicip', 'tags', 'spot', 'fleet', 'ondemand', 'deadline']
+max_concurrent_launches = 10
+spot_retry_interval = 15  # seconds between attempts to get spot capacity until the deadline
+
+
+def load_launch_spec(spec_path):
+    """ load a launch spec (YAML or JSON) and return the list of instance groups (dicts) with the defaults applied """
+    with open(spec_path) as f:
+        text = f.read()
+    if spec_path.endswith('.json'):
+        spec = json.loads(text)
+    else:
+        import yaml
+        spec = yaml.safe_load(text)
+    if not isinstance(spec, dict) or not isinstance(spec.get('groups'), list):
+        error_exit("'%s' must have 'groups' (a list of instance groups)" % spec_path)
+    defaults = spec.get('defaults') or {}
+    groups = []
+    for i, g in enumerate(spec['groups']):
+        group = dict(defaults)
+        group.update(g)
+        group['tags'] = dict(defaults.get('tags') or {})
+        group['tags'].update(g.get('tags') or {})
+        unknown_keys = [k for k in group.keys() if k not in launch_spec_keys]
+        if 0 < len(unknown_keys): error_exit("Unknown key(s) in group #%d of '%s': %s" % (i + 1, spec_path, ", ".join(unknown_keys)))
+        for k in ['name', 'ami', 'instancetype', 'subnet']:
+            if k not in group: error_exit("Group #%d of '%s' has no '%s'" % (i + 1, spec_path, k))
+        if isinstance(group.get('securitygroup'), six.string_types): group['securitygroup'] = [group['securitygroup']]
+        groups.append(group)
+    return groups
+
+
+def instance_names_from_pattern(pattern, count=None):
+    """ returns the names of new instances given by a pattern.
+        eg) instance_names_from_pattern('worker-{01..03}') -> ['worker-01', 'worker-02', 'worker-03']
+            instance_names_from_pattern('worker', 3)       -> ['worker-1', 'worker-2', 'worker-3']
+            instance_names_from_pattern('head')            -> ['head']
+        A range pads numbers to the width of its ends if either end begins with 0 (like bash).
+        Raises ValueError if the pattern is invalid or does not agree with count.
+    """
+    m = re.match(r'^(.*)\{(\d+)\.\.(\d+)\}(.*)$', pattern)
+    if m:
+        first, last = int(m.group(2)), int(m.group(3))
+        if last < first: raise ValueError("The range in '%s' is empty" % pattern)
+        width = max(len(m.group(2)), len(m.group(3))) if m.group(2).startswith('0') or m.group(3).startswith('0') else 0
+        names = ["%s%0*d%s" % (m.group(1), width, i, m.group(4)) for i in range(first, last + 1)]
+        if count is not None and 1 < count and count != len(names):
+            raise ValueError("'%s' gives %d names but --count is %d" % (pattern, len(names), count))
+    elif count is not None and 1 < count:
+        names = ["%s-%0*d" % (pattern, len(str(count)), i) for i in range(1, count + 1)]
+    else:
+        names = [pattern]
+    for name in names:
+        if not re.match(r'^[\w\-.]+$', name): raise ValueError("Name '%s' is invalid (contains illegal character(s))" % name)
+    return names
+
+
+def find_instance_ids_by_names(names):
+    """ returns a dictionary (name -> instance ID) of existing (not terminated) instances with any of names """
+    ec2 = get_ec2_client()
+    name_to_id = {}
+    for i in range(0, len(names), 200):  # a filter takes up to 200 values
+        for reservation in ec2.describe_instances(Filters=[{'Name': 'tag:Name', 'Values': names[i:i + 200]},
+                                                           {'Name': 'instance-state-name', 'Values': ['pending', 'running', 'stopping', 'stopped']}])['Reservations']:
+            for instance in reservation['Instances']:
+                name_to_id[extract_name_from_tags(instance.get('Tags'))] = instance['InstanceId']
+    return name_to_id
+
+
+def resolve_launch_requests(groups):
+    """ resolve the AMIs, subnets, security groups and key pairs that groups refer to with a few batched calls,
+        and check that the names of new instances are not used yet. All problems are reported at once.
+        Returns the list of launch requests (dicts), one per instance.
+    """
+    ec2 = get_ec2_client()
+    problems = []
+    # AMIs
+    ami_refs = sorted(set([g['ami'] for g in groups]))
+    ami_ids = [a for a in ami_refs if re.match(r'^ami-[0-9a-f]+$', a)]
+    ami_names = [a for a in ami_refs if a not in ami_ids]
+    ref_to_images = {}
+    if 0 < len(ami_ids):
+        for image in ec2.describe_images(Filters=[{'Name': 'image-id', 'Values': ami_ids}])['Images']:
+            ref_to_images.setdefault(image['ImageId'], []).append(image)
+    if 0 < len(ami_names):
+        for image in ec2.describe_images(Filters=[{'Name': 'name', 'Values': ami_names}])['Images']:
+            ref_to_images.setdefault(image['Name'], []).append(image)
+    for a in ami_refs:
+        if a not in ref_to_images: problems.append("Cannot find an AMI '%s'" % a)
+        elif 1 < len(ref_to_images[a]): problems.append("There are multiple AMIs with name='%s': %s" % (a, ", ".join([i['ImageId'] for i in ref_to_images[a]])))
+    # subnets, security groups, key pairs
+    ref_to_subnets = {}
+    for subnet in ec2.describe_subnets()['Subnets']:
+        ref_to_subnets.setdefault(subnet['SubnetId'], []).append(subnet)
+        ref_to_subnets.setdefault(extract_name_from_tags(subnet.get('Tags'), None), []).append(subnet)
+    vpc_and_ref_to_sg = {}
+    for sg in ec2.describe_security_groups()['SecurityGroups']:
+        vpc_and_ref_to_sg[(sg.get('VpcId'), sg['GroupId'])] = sg
+        vpc_and_ref_to_sg[(sg.get('VpcId'), sg['GroupName'])] = sg
+    key_names = set([k['KeyName'] for k in ec2.describe_key_pairs()['KeyPairs']])
+    catalog = get_instance_type_catalog()
+    requests = []
+    for g in groups:
+        instance_types = g['instancetype'] if isinstance(g['instancetype'], list) else [g['instancetype']]
+        for t in instance_types:
+            if 0 < len(catalog) and t not in catalog: problems.append("Instance type '%s' is not offered in %s" % (t, ec2.meta.region_name))
+        fleet = {'instance_types': instance_types, 'on_demand': int(g.get('ondemand', 0))} if 1 < len(instance_types) or g.get('fleet') else None
+        if g.get('keyname') is not None and g['keyname'] not in key_names: problems.append("Cannot find a key pair '%s'" % g['keyname'])
+        subnets = []
+        for ref in (g['subnet'] if isinstance(g['subnet'], list) else [g['subnet']]):
+            candidates = ref_to_subnets.get(ref, [])
+            if len(candidates) == 1: subnets.append(candidates[0])
+            else: problems.append(("Cannot find a subnet '%s'" if len(candidates) <= 0 else "There are multiple subnets with name='%s'") % ref)
+        if len(subnets) <= 0: continue
+        if 1 < len(set([i['VpcId'] for i in subnets])):
+            problems.append("The subnets of group '%s' must be in the same VPC" % g['name'])
+            continue
+        sg_ids = []
+        for ref in g.get('securitygroup') or []:
+            sg = vpc_and_ref_to_sg.get((subnets[0]['VpcId'], ref))
+            if sg is None: problems.append("Cannot find a security group '%s' in VPC %s" % (ref, subnets[0]['VpcId']))
+            else: sg_ids.append(sg['GroupId'])
+        images = ref_to_images.get(g['ami'], [])
+        if len(images) != 1: continue
+        root_account = g.get('rootaccount') or estimate_root_accout_name_from_ami_name(images[0].get('Name') or '')
+        try:
+            names = instance_names_from_pattern(g['name'], int(g['count']) if 'count' in g else None)
+        except ValueError as e:
+            problems.append(str(e))
+            continue
+        spot = bool(g.get('spot', False))
+        for name in names:
+            requests.append({'name': name, 'image_id': images[0]['ImageId'], 'instance_type': instance_types[0],
+                             'key_name': g.get('keyname'), 'subnets': [(i['SubnetId'], i['AvailabilityZone']) for i in subnets],
+                             'security_group_ids': sg_ids,
+                             'root_account': root_account, 'shutdown_behavior': 'terminate' if spot else (g.get('shutdownbehavior') or 'stop'),
+                             'ebs_optimized': bool(g.get('ebsoptimized', False)),
+                             'disable_api_termination': bool(g.get('disableapitermination', False)),
+                             'public_ip': bool(g.get('publicip', True)), 'tags': g['tags'],
+                             'spot': spot, 'deadline': int(g.get('deadline', 0)), 'fleet': fleet})
+    # names must be unique so that they can be used as host names
+    names = [r['name'] for r in requests]
+    for name in sorted(set([n for n in names if 1 < names.count(n)])): problems.append("Name '%s' is used more than once" % name)
+    existing_names = find_instance_ids_by_names(names)
+    for name in sorted(existing_names.keys()): problems.append("An instance with name '%s' already exists (ID=%s)" % (name, existing_names[name]))
+    if 0 < len(problems): error_exit("\n".join(problems))
+    return requests
+
+
+def launch_request_tags(request, with_name=True):
+    """ returns the tags (in the API format) of the instance (and its volumes) of a launch request """
+    tags = [{'Key': 'Name', 'Value': request['name']}] if with_name else []
+    tags += [{'Key': 'root', 'Value': request['root_account']}]
+    return tags + [{'Key': str(k), 'Value': str(v)} for k, v in sorted(request['tags'].items())]
+
+
+def run_launch_request(ec2, request, subnet_id, spot=False):
+    """ launch an instance for a launch request in a subnet (tags are set at creation). Returns the instance (a dict of the API response) """
+    tags = launch_request_tags(request)
+    args = {}
+    if request['key_name'] is not None: args['KeyName'] = request['key_name']
+    if spot: args['InstanceMarketOptions'] = {'MarketType': 'spot', 'SpotOptions': {'SpotInstanceType': 'one-time', 'InstanceInterruptionBehavior': 'terminate'}}
+    response = ec2.run_instances(
+        ImageId=request['image_id'],
+        MinCount=1,
+        MaxCount=1,
+        InstanceType=request['instance_type'],
+        DisableApiTermination=request['disable_api_termination'],
+        InstanceInitiatedShutdownBehavior='terminate' if spot else request['shutdown_behavior'],
+        EbsOptimized=request['ebs_optimized'],
         NetworkInterfaces=[
             {
                 'DeviceIndex': 0,
-                'SubnetId': subnet,
-                'Groups': securitygroup,
-                'AssociatePublicIpAddress': True},
+                'SubnetId': subnet_id,
+                'Groups': request['security_group_ids'],
+                'AssociatePublicIpAddress': request['public_ip']},
             ],  # noqa: E123
-    )
-    result_instances = list(result_instances)
-    if len(result_instances) <= 0: error_exit("Could not create any instance(s)")
-    wait_interval_in_sec = 3
-    for inst in result_instances:
-        while True:
+        TagSpecifications=[{'ResourceType': 'instance', 'Tags': tags},
+                           {'ResourceType': 'volume', 'Tags': tags}],
+        **args)
+    return response['Instances'][0]
+
+
+# error codes of RunInstances that mean 'try another AZ' (for the instance type) or 'try another subnet'
+capacity_error_codes = ['InsufficientInstanceCapacity', 'InsufficientCapacity', 'InsufficientHostCapacity', 'Unsupported']
+subnet_full_error_codes = ['InsufficientFreeAddressesInSubnet']
+
+
+def launch_instances_for_requests(requests):
+    """ launch instances for launch requests concurrently.
+        Requests are spread over their subnets (and thus AZs) in turn. When an AZ runs out of capacity
+        for an instance type (or a subnet runs out of addresses), the request is retried in the next subnet
+        and the pending requests avoid that AZ (or subnet) from then on.
+        A spot request goes round its subnets every spot_retry_interval seconds until its deadline,
+        and then falls back to on-demand.
+        Returns the list of (request, instance or None, error message or None).
+    """
+    ec2 = get_ec2_client()
+    exhausted = set()  # (AZ, instance type, market) and subnet IDs that have no room left
+    exhausted_lock = threading.Lock()
+
+    def launch(index_and_request):
+        index, request = index_and_request
+        subnets = request['subnets'][index % len(request['subnets']):] + request['subnets'][:index % len(request['subnets'])]
+        deadline = time.time() + request['deadline']
+        error = "No subnet/AZ has capacity left for %s" % request['instance_type']
+        for market in (['spot', 'on-demand'] if request['spot'] else ['on-demand']):
+            while True:
+                for subnet_id, az in subnets:
+                    with exhausted_lock:
+                        if subnet_id in exhausted or (az, request['instance_type'], market) in exhausted: continue
+                    try:
+                        return request, run_launch_request(ec2, request, subnet_id, market == 'spot'), None
+                    except botocore.exceptions.ClientError as e:
+                        code = e.response.get('Error', {}).get('Code')
+                        if code not in capacity_error_codes + subnet_full_error_codes: return request, None, str(e)
+                        with exhausted_lock:
+                            exhausted.add(subnet_id if code in subnet_full_error_codes else (az, request['instance_type'], market))
+                        error = str(e)
+                        if is_debugging: print_info("%s: %s (%s); trying another subnet" % (request['name'], code, market))
+                if market != 'spot' or deadline <= time.time(): break
+                time.sleep(max(0, min(spot_retry_interval, deadline - time.time())))
+                with exhausted_lock:  # spot capacity comes and goes
+                    exhausted.difference_update([(az, request['instance_type'], 'spot') for _, az in subnets])
+            if market == 'spot': print_info("%s: no spot capacity by the deadline; falling back to on-demand" % request['name'])
+        return request, None, error
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrent_launches) as executor:
+        return list(executor.map(launch, enumerate(requests)))
+
+
+def create_launch_template_for_request(ec2, request):
+    """ create a temporary launch template with the settings of a launch request except the instance type and the subnet. Returns its ID """
+    tags = launch_request_tags(request, False)  # names differ from instance to instance
+    data = {'ImageId': request['image_id'],
+            'DisableApiTermination': request['disable_api_termination'],
+            'InstanceInitiatedShutdownBehavior': 'terminate' if request['spot'] else request['shutdown_behavior'],
+            'EbsOptimized': request['ebs_optimized'],
+            'NetworkInterfaces': [{'DeviceIndex': 0, 'Groups': request['security_group_ids'], 'AssociatePublicIpAddress': request['public_ip']}],
+            'TagSpecifications': [{'ResourceType': 'instance', 'Tags': tags}, {'ResourceType': 'volume', 'Tags': tags}]}
+    if request['key_name'] is not None: data['KeyName'] = request['key_name']
+    response = ec2.create_launch_template(LaunchTemplateName="taw-fleet-%s" % uuid.uuid4().hex, LaunchTemplateData=data)
+    return response['LaunchTemplate']['LaunchTemplateId']
+
+
+def create_fleet_instances(ec2, template_id, request, n_on_demand, n_spot):
+    """ request n_on_demand on-demand and n_spot spot instances over the instance types and the subnets of a launch request
+        with one CreateFleet call (of type 'instant'; spot capacity is chosen by the capacity-optimized strategy).
+        Returns (the list of (instance ID, instance type, subnet ID, AZ, lifecycle), the list of error messages)
+    """
+    subnet_to_az = dict(request['subnets'])
+    overrides = [{'InstanceType': t, 'SubnetId': subnet_id} for t in request['fleet']['instance_types'] for subnet_id, _ in request['subnets']]
+    response = ec2.create_fleet(
+        Type='instant',
+        LaunchTemplateConfigs=[{'LaunchTemplateSpecification': {'LaunchTemplateId': template_id, 'Version': '$Latest'},
+                                'Overrides': overrides}],
+        TargetCapacitySpecification={'TotalTargetCapacity': n_on_demand + n_spot,
+                                     'OnDemandTargetCapacity': n_on_demand,
+                                     'SpotTargetCapacity': n_spot,
+                                     'DefaultTargetCapacityType': 'spot' if 0 < n_spot else 'on-demand'},
+        SpotOptions={'AllocationStrategy': 'capacity-optimized'},
+        OnDemandOptions={'AllocationStrategy': 'lowest-price'})
+    launched = []
+    for i in response.get('Instances', []):
+        o = i.get('LaunchTemplateAndOverrides', {}).get('Overrides', {})
+        for instance_id in i['InstanceIds']:
+            launched.append((instance_id, i.get('InstanceType') or o.get('InstanceType'), o.get('SubnetId'),
+                             o.get('AvailabilityZone') or subnet_to_az.get(o.get('SubnetId')), i.get('Lifecycle', 'on-demand')))
+    errors = []
+    for e in response.get('Errors', []):
+        o = e.get('LaunchTemplateAndOverrides', {}).get('Overrides', {})
+        errors.append("%s in %s (%s): %s" % (o.get('InstanceType'), subnet_to_az.get(o.get('SubnetId'), o.get('SubnetId')),
+                                             e.get('Lifecycle', 'on-demand'), e.get('ErrorMessage') or e.get('ErrorCode')))
+    return launched, errors
+
+
+def launch_fleet_for_requests(requests):
+    """ launch instances for the launch requests of a group (which share a fleet spec) with EC2 Fleet.
+        The spot part is requested again every spot_retry_interval seconds until the deadline of the group,
+        and what is still missing then is requested on-demand. The new instances are named after the requests.
+        Returns (the list of (request, instance or None, error message or None),
+                 the list of fulfilled (instance ID, instance type, subnet ID, AZ, lifecycle))
+    """
+    ec2 = get_ec2_client()
+    request = requests[0]
+    n_on_demand = min(request['fleet']['on_demand'], len(requests)) if request['spot'] else len(requests)
+    n_spot = len(requests) - n_on_demand
+    deadline = time.time() + request['deadline']
+    launched, errors = [], []
+    template_id = None
+    try:
+        template_id = create_launch_template_for_request(ec2, request)
+        while 0 < n_on_demand + n_spot:
+            new_launched, new_errors = create_fleet_instances(ec2, template_id, request, n_on_demand, n_spot)
+            launched += new_launched
+            errors += new_errors
+            n_spot -= len([i for i in new_launched if i[4] == 'spot'])
+            n_on_demand -= len([i for i in new_launched if i[4] != 'spot'])
+            if n_spot <= 0: break  # on-demand shortage is not likely to be resolved soon
+            if deadline <= time.time():
+                print_info("No spot capacity for %d instance(s) by the deadline; falling back to on-demand" % n_spot)
+                n_on_demand, n_spot = n_on_demand + n_spot, 0
+                continue
+            print_info("Got %d/%d instance(s); retrying spot capacity in %d seconds ..." % (len(launched), len(requests), spot_retry_interval))
+            time.sleep(max(0, min(spot_retry_interval, deadline - time.time())))
+    except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+        errors.append(str(e))  # the instances launched so far are still named and reported
+    finally:
+        if template_id is not None:
             try:
-                inst.create_tags(Tags=[
-                    {'Key': 'Name', 'Value': name}             ,  # noqa: E203
-                    {'Key': 'root', 'Value': root_account_name},
-                    ])  # noqa: E123
-                break
-            except Exception as e:
-                print(e)
-                print("\nWait for %d seconds..." % wait_interval_in_sec)
-                time.sleep(wait_interval_in_sec)  # interval
-                wait_interval_in_sec += 3
-        print("Successfully created an instance with ID = %s" % inst.id)
-    print("Done.")
+                ec2.delete_launch_template(LaunchTemplateId=template_id)
+            except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+                print_warning("Could not delete the launch template %s: %s" % (template_id, e))
+
+    def name_instance(request_and_launched):
+        request, (instance_id, _, _, _, _) = request_and_launched
+        for attempt in range(5):
+            try:
+                ec2.create_tags(Resources=[instance_id], Tags=[{'Key': 'Name', 'Value': request['name']}])
+                return request, {'InstanceId': instance_id}, None
+            except botocore.exceptions.ClientError as e:
+                # a new instance may not be visible to CreateTags yet
+                if not e.response.get('Error', {}).get('Code', '').endswith('NotFound') or attempt == 4:
+                    return request, {'InstanceId': instance_id}, "%s was launched but could not be named: %s" % (instance_id, e)
+                time.sleep(2 ** attempt)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_concurrent_launches) as executor:
+        results = list(executor.map(name_instance, zip(requests, launched)))
+    error = "; ".join(errors[-3:]) if 0 < len(errors) else "The fleet was not fulfilled"
+    return results + [(r, None, error) for r in requests[len(launched):]], launched
+
+
+def wait_for_instances_running(instance_ids):
+    """ wait until all instances run (one describe call per poll for up to 100 instances). Returns the instances (dicts).
+        If some of them do not run (eg, terminated for insufficient capacity, or the waiter times out), they are reported.
+    """
+    ec2 = get_ec2_client()
+    waiter = ec2.get_waiter('instance_running')
+    instances = []
+    for i in range(0, len(instance_ids), 100):
+        try:
+            waiter.wait(InstanceIds=instance_ids[i:i + 100])
+        except botocore.exceptions.WaiterError:
+            pass  # the instances in the batch are described (and those not running are reported) below
+        for reservation in ec2.describe_instances(InstanceIds=instance_ids[i:i + 100])['Reservations']:
+            instances += reservation['Instances']
+    not_running = [i for i in instances if i['State']['Name'] != 'running']
+    if 0 < len(not_running):
+        print_warning("%d instance(s) are not running:\n" % len(not_running) +
+                      "\n".join(["%s (%s): %s%s" % (extract_name_from_tags(i.get('Tags')), i['InstanceId'], i['State']['Name'],
+                                                   ' (' + i['StateReason']['Message'] + ')' if i.get('StateReason', {}).get('Message') else '') for i in not_running]))
+    return instances
+
+
+def launch_instances_from_spec(params, spec_path):
+    """ launch the instances described in a spec file """
+    launch_instances_for_requests_and_report(params, resolve_launch_requests(load_launch_spec(spec_path)))
+
+
+def capacity_of_launch_request(request):
+    """ returns a short description of the capacity a launch request asks for (eg, 'fleet: spot + 2 on-demand') """
+    if request['fleet'] is None: return 'spot' if request['spot'] else 'on-demand'
+    if not request['spot']: return 'fleet: on-demand'
+    if request['fleet']['on_demand'] <= 0: return 'fleet: spot'
+    return 'fleet: spot + %d on-demand' % request['fleet']['on_demand']
+
+
+def launch_instances_for_requests_and_report(params, requests):
+    """ launch instances for launch requests, wait for them and show them """
+    header = ['Name', 'AMI', 'Instance Type', 'Capacity', 'Subnets', 'Security Groups', 'Key']
+    rows = [[r['name'], r['image_id'], r['fleet']['instance_types'] if r['fleet'] else r['instance_type'], capacity_of_launch_request(r),
+             [i for i, _ in r['subnets']], r['security_group_ids'], r['key_name']] for r in requests]
+    if params.aws_dryrun:
+        output_table(params, header, rows)
+        return
+    print_info("Launching %d instance(s) ..." % len(requests))
+    fleet_groups = []  # requests of a group are adjacent
+    for r in requests:
+        if r['fleet'] is None: continue
+        if 0 < len(fleet_groups) and fleet_groups[-1][0]['fleet'] is r['fleet']: fleet_groups[-1].append(r)
+        else: fleet_groups.append([r])
+    results = launch_instances_for_requests([r for r in requests if r['fleet'] is None])
+    for group in fleet_groups:
+        group_results, fulfilled = launch_fleet_for_requests(group)
+        results += group_results
+        counts = {}
+        for _, instance_type, _, az, lifecycle in fulfilled:
+            counts[(instance_type, az, lifecycle)] = counts.get((instance_type, az, lifecycle), 0) + 1
+        print_info("Fleet for %d instance(s) (%s): %d fulfilled" % (len(group), capacity_of_launch_request(group[0]), len(fulfilled)))
+        output_table(params, ['Instance Type', 'AZ', 'Lifecycle', 'Count'], [list(k) + [v] for k, v in sorted(counts.items())])
+    launched = [(r, i) for r, i, _ in results if i is not None]
+    failed = [(r, e) for r, _, e in results if e is not None]
+    if 0 < len(launched):
+        print_info("Waiting for %d instance(s) to run ..." % len(launched))
+        instances = wait_for_instances_running([i['InstanceId'] for _, i in launched])
+        rows = [[extract_name_from_tags(i.get('Tags')), i['InstanceId'], i['InstanceType'], i.get('InstanceLifecycle', 'on-demand'), i.get('SubnetId'),
+                 i['Placement']['AvailabilityZone'], i['State']['Name'], i.get('PublicIpAddress')] for i in instances]
+        output_table(params, ['Name', 'ID', 'Instance Type', 'Lifecycle', 'Subnet', 'AZ', 'State', 'Public IP'], sorted(rows))
+    if 0 < len(failed):
+        error_exit("Could not launch %d instance(s):\n" % len(failed) + "\n".join(["%s: %s" % (r['name'], e) for r, e in failed]))
 
 
 @instance_group.command("settag")
@@ -712,18 +1130,18 @@ def name_instancecmd(params, instanceid, hostname):
                          Tags=[{'Key': 'Name',
                                 'Value': hostname}])
     if is_debugging: print("public ip = ", instance.public_ip_address)
-    res = ssh_like_call(params, 'which', instanceid, ['hostnamectl'], True)
+    res = ssh_like_call(params, 'ssh', instance, ['which', 'hostnamectl'], True)
     if is_debugging: print(res)
     if res is not None and res.decode('utf-8').strip().endswith('/hostnamectl'):
         # The system has hostnamectl
         if is_debugging: print("Using hostnamectl")
-        res = ssh_like_call(params, 'sudo', instanceid, ['-t', 'hostnamectl', 'set-hostname', hostname], True)
+        res = ssh_like_call(params, 'ssh', instance, ['sudo', 'hostnamectl', 'set-hostname', hostname], True)
         if is_debugging: print(res)
     else:
         if is_debugging: print("Using an old-fashoned hostname")
-        res = ssh_like_call(params, 'sudo', instanceid, ['-t', 'hostname', hostname], True)
+        res = ssh_like_call(params, 'ssh', instance, ['sudo', 'hostname', hostname], True)
         if is_debugging: print(res)
-    res = ssh_like_call(params, 'cat', instanceid, ['cat', '/etc/hosts'], True)
+    res = ssh_like_call(params, 'ssh', instance, ['cat', '/etc/hosts'], True)
     etc_hosts_lines = res.decode('utf-8').split("\n")
     if is_debugging:
         print("/etc/hosts:")
@@ -732,71 +1150,242 @@ def name_instancecmd(params, instanceid, hostname):
     if instance.public_ip_address is not None and all([i.find(instance.public_ip_address) == -1 for i in etc_hosts_lines]):
         line_to_add = "%s %s" % (instance.public_ip_address, hostname)
         new_etc_hosts = [line_to_add] + etc_hosts_lines
-        res = ssh_like_call(params, 'sudo', instanceid, ['-t', 'perl', '-i', '-pe', '\'if($.==1){print"' + line_to_add + '\\n"}\'', '/etc/hosts'])
+        res = ssh_like_call(params, 'ssh', instance, ['sudo', 'perl', '-i', '-pe', '\'if($.==1){print"' + line_to_add + '\\n"}\'', '/etc/hosts'])
         print_info("Added an entry '%s' to /etc/hosts" % line_to_add)
     else:
         print_info("/etc/hosts already has an entry with the public IP (%s)." % instance.public_ip_address)
 
 
+def make_instance_lister(verbose, attr, filter_terms, with_region=False):
+    """ returns (header, fetch, rows_of, coloring) to list instances (see 'taw instance list').
+        fetch(ec2_client, page_size=None) yields the instances (dicts) that match the filter terms by DescribeInstances (paginated).
+        rows_of(instances, region_name) yields the rows of instances. The subnets, VPCs and prices that the shown columns need are
+        fetched once per region, so a narrow projection (eg, -a instance_id -a state) costs only DescribeInstances.
+        If with_region, the rows start with the region.
+    """
+    subnet_id_to_name, vpc_id_to_name, region_to_price_function = {}, {}, {}  # filled only if the columns that need them are shown
+    price_of_instance = []  # the price function of the region being listed
+
+    def price_str(inst):
+        price = price_of_instance[0](inst) if inst['State']['Name'] in ['pending', 'running'] else None
+        return '' if price is None else "%.4f" % price
+    all_list_columns = [
+            (True , "Tags"           , "Name"           , extract_name_from_tags)                                            ,
+            (True , "InstanceId"     , "ID"             , ident)                                                             ,
+            (True , "InstanceType"   , "Instance Type"  , ident)                                                             ,
+            (False, "KeyName"        , "Key"            , ident)                                                             ,
+            (True , "PublicIpAddress", "Public IP"      , ident)                                                             ,
+            (True , "SecurityGroups" , "Security Groups", lambda l: ", ".join(security_group_list_to_strs(l)))               ,
+            (True , "State"          , "State"          , lambda d: dc(d, 'Name'))                                           ,
+            (False, "StateReason"    , "Reason"         , lambda d: dc(d, 'Message'))                                        ,
+            (False, "Tags"           , "Tag"            , lambda a: list(map(lambda x: x['Key'] + "=" + x['Value'], a or []))),
+            (False, "SubnetId"       , "Subnet ID"      , ident)                                                             ,
+            (False, "VpcId"          , "VPC ID"         , ident)                                                             ,
+            (True , "SubnetId"       , "Subnet Name"    , lambda x: [subnet_id_to_name[x]] if x in subnet_id_to_name else [], ('subnets',)),
+            (True , "VpcId"          , "VPC Name"       , lambda x: [vpc_id_to_name[x]] if x in vpc_id_to_name else []      , ('vpcs',))   ,
+            (False, None             , "USD/hour"       , price_str                                                          , ('prices',)) ,
+        ]
+    # other attributes (eg, -a launch_time) are read from DescribeInstances as they are
+    member_of_attribute = dict([(botocore.xform_name(k), k) for k in get_ec2_client().meta.service_model.shape_for('Instance').members])
+
+    def raw_column(name):
+        if name not in member_of_attribute and name not in member_of_attribute.values():
+            error_exit("No such attribute '%s'.\nTry 'taw list --argdoc' to see all attributes." % name)
+        return (True, member_of_attribute.get(name, name), name, ident)
+    list_columns = select_list_columns(all_list_columns, verbose, attr, raw_column)
+    header = (['Region'] if with_region else []) + [x[2] for x in list_columns]
+    instance_filter = ResourceFilter(filter_terms, {
+            'name'      : ('tag:Name'           , lambda i: extract_name_from_tags(i.get('Tags')))         ,
+            'id'        : ('instance-id'        , lambda i: i['InstanceId'])                               ,
+            'state'     : ('instance-state-name', lambda i: i['State']['Name'])                            ,
+            'type'      : ('instance-type'      , lambda i: i['InstanceType'])                             ,
+            'ip'        : ('ip-address'         , lambda i: i.get('PublicIpAddress'))                      ,
+            'private_ip': ('private-ip-address' , lambda i: i.get('PrivateIpAddress'))                     ,
+            'key'       : ('key-name'           , lambda i: i.get('KeyName'))                              ,
+            'subnet'    : ('subnet-id'          , lambda i: i.get('SubnetId'))                             ,
+            'vpc'       : ('vpc-id'             , lambda i: i.get('VpcId'))                                ,
+            'az'        : ('availability-zone'  , lambda i: i['Placement']['AvailabilityZone'])            ,
+            'image'     : ('image-id'           , lambda i: i.get('ImageId'))                              ,
+            'arch'      : ('architecture'       , lambda i: i.get('Architecture'))                         ,
+            'sg'        : ('instance.group-name', lambda i: [g['GroupName'] for g in i.get('SecurityGroups', [])]),
+        })
+
+    def fetch(ec2_client, page_size=None):
+        args = {'Filters': instance_filter.ec2_filters()}
+        if page_size: args['PaginationConfig'] = {'PageSize': page_size}
+        for page in ec2_client.get_paginator('describe_instances').paginate(**args):
+            for r in page['Reservations']:
+                for i in r['Instances']:
+                    if instance_filter.matches(i): yield i
+    needs = data_needed_by_list_columns(list_columns)
+    fetched_regions = set()
+
+    def rows_of(instances, region_name):
+        if region_name not in fetched_regions:
+            fetched_regions.add(region_name)
+            ec2_client = get_ec2_client_for_region(region_name)
+            if 'subnets' in needs:
+                subnet_id_to_name.update([(x['SubnetId'], extract_name_from_tags(x.get('Tags'), x['SubnetId']))
+                                          for page in ec2_client.get_paginator('describe_subnets').paginate() for x in page['Subnets']])
+            if 'vpcs' in needs:
+                vpc_id_to_name.update([(x['VpcId'], extract_name_from_tags(x.get('Tags'), x['VpcId']))
+                                       for page in ec2_client.get_paginator('describe_vpcs').paginate() for x in page['Vpcs']])
+            if 'prices' in needs:
+                region_to_price_function[region_name] = get_instance_hourly_price_function(region_name)  # local data only (see 'taw list price')
+        price_of_instance[:] = [region_to_price_function.get(region_name)]
+        for inst in instances:
+            yield ([region_name] if with_region else []) + [f(inst if k is None else inst.get(k)) for _, k, _, f in [c[:4] for c in list_columns]]
+    state_index = header.index('State') if 'State' in header else None
+
+    def coloring(r):
+        if verbose or state_index is None: return None
+        if r[state_index] == 'stopped': return {-1: 'red'}
+        if r[state_index] == 'stopping': return {-1: 'green'}
+        if r[state_index] == 'pending': return {-1: 'yellow'}
+        if r[state_index] == 'terminated': return {-1: 'grey'}
+        if r[state_index] == 'shutting-down': return {-1: 'cyan'}
+        return None
+    return header, fetch, rows_of, coloring
+
+
+def list_instances_in_region(params, verbose, attr, filter_terms):
+    """ list the instances in the current region (see 'taw instance list') """
+    header, fetch, rows_of, coloring = make_instance_lister(verbose, attr, filter_terms)
+    limit = output_row_limit(params)  # with --limit N, pages are as small as N and no more pages are requested than needed
+    completion_keywords = []
+
+    def instances():
+        for inst in fetch(get_ec2_client(), page_size=limit and min(1000, max(5, limit))):
+            completion_keywords.extend([{"host": extract_name_from_tags(inst.get('Tags'))}, {"instance_id": inst['InstanceId']},
+                                        {"ip": inst.get('PublicIpAddress')}])
+            yield inst
+    output_table(params, header, rows_of(instances(), get_ec2_client().meta.region_name), [coloring])
+    update_completion_keywords(completion_keywords, "instance=" + get_aws_region())
+
+
+def watch_instances(params, verbose, attr, filter_terms, interval, region_names):
+    """ show the instances in regions and refresh them every interval seconds until Ctrl-C.
+        A poll is a DescribeInstances per region (concurrently); the subnets, VPCs and prices are fetched only once.
+        The rows whose state changed since the last poll (or that are new) are highlighted, and only the changed lines are redrawn.
+    """
+    with_region = 1 < len(region_names)
+    header, fetch, rows_of, coloring = make_instance_lister(verbose, attr, filter_terms, with_region)
+    clients = [get_ec2_client_for_region(r) for r in region_names]  # creating clients is not thread-safe
+    changed_rows = set()
+
+    def changed_coloring(r):
+        return {-1: 'magenta'} if tuple([cell_to_str(c) for c in r]) in changed_rows else None
+    previous_states, previous_lines = None, None
+    try:
+        while True:
+            started = time.time()
+            results = run_concurrently(lambda c: list(fetch(c)), clients)
+            states, rows, errors = {}, [], []
+            changed_rows.clear()
+            for region_name, (_, instances, e) in zip(region_names, results):
+                if e is not None:
+                    errors.append("%s: %s" % (region_name, e))
+                    continue
+                for inst, row in zip(instances, rows_of(instances, region_name)):
+                    states[inst['InstanceId']] = inst['State']['Name']
+                    if previous_states is not None and previous_states.get(inst['InstanceId']) != states[inst['InstanceId']]:
+                        changed_rows.add(tuple([cell_to_str(c) for c in row]))
+                    rows.append(row)
+            shown_header, shown_rows, shown_coloring = arrange_rows(params, header, rows, [changed_coloring, coloring])
+            status = "Every %gs: %d instance(s) in %s; %d changed at %s (Ctrl-C to quit)" % (
+                interval, len(rows), ", ".join(region_names) if len(region_names) <= 3 else "%d regions" % len(region_names),
+                len(changed_rows), datetime.datetime.now().strftime('%X'))
+            lines = [status] + ["ERROR: " + e for e in errors] + [""] + multicolumn_tabulate(shown_rows, shown_header, shown_coloring).split("\n")
+            previous_lines = redraw_changed_lines(lines, previous_lines)
+            previous_states = states
+            time.sleep(max(0.0, interval - (time.time() - started)))
+    except KeyboardInterrupt:
+        end_redrawing()
+
+
 @instance_group.command("list")
 @click.option('--verbose', '-v', is_flag=True, help='Verbose output.')
 @click.option('--argdoc', is_flag=True, help='Show available attributes in a web browser')
-@click.option('--attr', '-a', multiple=True, help='Attribute name(s).')
+@click.option('--attr', '-a', multiple=True, help='Attribute name(s) or column header(s) to show (only they are shown).')
 @click.option('--allregions', is_flag=True, help='List for all regions.')
+@click.option('--watch', is_flag=True, help='Refresh the list until Ctrl-C, highlighting the instances whose state changed.')
+@click.option('--interval', type=float, default=5.0, help='Seconds between refreshes with --watch (default: 5).')
 @click.argument('subargs', nargs=-1)
 @pass_global_parameters
-def list_instance_instancecmd(params, verbose, argdoc, attr, allregions, subargs):
-    """ list instances """
+def list_instance_instancecmd(params, verbose, argdoc, attr, allregions, watch, interval, subargs):
+    """ list instances (that match filter terms if any).
+
+        \b
+        eg) taw instance list state=running name~web-* type=c5.*
+            taw instance list 'type!=t2.*' tag:project=foo
+            taw instance list -a instance_id -a state -a launch_time
+            taw instance list --watch --interval 10 name=worker-*
+        Keys are name, id, state, type, ip, private_ip, key, subnet, vpc, az, image, arch, sg and tag:KEY.
+    """
     if argdoc:
         click.launch('https://boto3.readthedocs.io/en/latest/reference/services/ec2.html#instance')
         return
+    if watch:
+        if allregions:
+            region_names = sorted([r['RegionName'] for r in get_ec2_client().describe_regions()['Regions']])
+        else:
+            region_names = [get_ec2_client().meta.region_name]
+        watch_instances(params, verbose, attr, filter_terms_of(subargs), max(1.0, interval), region_names)
+        return
     if allregions:
-        list_for_all_regions(params, subargs, 'instance', lambda x: list_instancecmd(params, verbose, argdoc, attr, False))
+        list_for_all_regions(params, subargs, 'instance', lambda: list_instances_in_region(params, verbose, attr, filter_terms_of(subargs)))
+        return
+    list_instances_in_region(params, verbose, attr, filter_terms_of(subargs))
+
+
+@instance_group.command("types", short_help='find instance types by vCPU/memory/GPU/price')
+@click.argument('prefix', default='')
+@click.option('--min-vcpu', 'min_vcpu', default=0, type=int, help="Minimum number of vCPUs")
+@click.option('--min-mem', 'min_mem', default=0, type=float, help="Minimum memory (GiB)")
+@click.option('--gpu', is_flag=True, help="Need GPU(s)")
+@click.option('--arch', help="Architecture (eg: x86_64, arm64)")
+@click.option('--max-price', 'max_price', type=float, help="Maximum price (USD/hour)")
+@click.option('--spot', is_flag=True, help="Use spot prices (instead of on-demand prices) for --max-price and --rank")
+@click.option('--rank', default='vcpu', type=click.Choice(['vcpu', 'mem', 'price', 'name']), help="Sort by the cost per vCPU (default), per GiB of memory, the price, or the name")
+@click.option('--noprice', is_flag=True, help="Do not look up prices")
+@click.option('--refresh', is_flag=True, help="Refresh the cached instance types and prices")
+@click.option('--allregions', is_flag=True, help="With --refresh, refresh the cached instance types of all regions (concurrently)")
+@pass_global_parameters
+def types_instancecmd(params, prefix, min_vcpu, min_mem, gpu, arch, max_price, spot, rank, noprice, refresh, allregions):
+    """ list the instance types that meet constraints (cheapest first)
+
+        \b
+        eg) taw instance types --min-vcpu 32 --min-mem 128 --gpu --arch x86_64 --max-price 3
+            taw instance types c5 --spot --rank mem
+            taw -f tsv instance types --min-vcpu 4 --max-price 0.2
+            taw instance types --refresh --allregions
+        The instance types and prices are cached locally (see 'taw instance types --refresh').
+    """
+    if noprice and (max_price is not None or rank in ['mem', 'price']): error_exit("--max-price and --rank mem/price need prices (do not use --noprice)")
+    if allregions:
+        if not refresh: error_exit("--allregions needs --refresh")
+        region_names = sorted([r['RegionName'] for r in get_ec2_client().describe_regions()['Regions']])
+        print_info("Refreshed the instance types of %d of %d regions" % (len(refresh_instance_type_catalogs(region_names)), len(region_names)))
+    get_instance_type_catalog(refresh=refresh and not allregions)
+    if not noprice:
+        get_instance_type_prices(market='on-demand', refresh=refresh)
+        get_instance_type_prices(market='spot', refresh=refresh)
+    results = query_instance_types(prefix=prefix, min_vcpu=min_vcpu, min_mem=min_mem, gpu=gpu, arch=arch, max_price=max_price,
+                                   market='spot' if spot else 'on-demand', rank='name' if noprice else rank)
+    if noprice:
+        output_table(params, instance_type_catalog_header, [instance_type_catalog_row(name, spec) for name, spec, _, _ in results])
         return
-    all_list_columns = [
-            (True , "tags"             , "Name"           , extract_name_from_tags)                                       ,
-            (True , "instance_id"      , "ID"             , ident)                                                        ,
-            (True , "instance_type"    , "Instance Type"  , ident)                                                        ,
-            (False, "key_name"         , "Key"            , ident)                                                        ,
-            (True , "public_ip_address", "Public IP"      , ident)                                                        ,
-            (True , "security_groups"  , "Security Groups", lambda l: ", ".join(security_group_list_to_strs(l)))          ,
-            (True , "state"            , "State"          , lambda d: dc(d, 'Name'))                                      ,
-            (False, "state_reason"     , "Reason"         , lambda d: dc(d, 'Message'))                                   ,
-            (False, "tags"             , "Tag"            , lambda a: list(map(lambda x: x['Key'] + "=" + x['Value'], a or []))),
-            (False, "subnet_id"        , "Subnet ID"      , ident)                                                        ,
-            (False, "vpc_id"           , "VPC ID"         , ident)                                                        ,
-        ]
-    list_columns = [x for x in all_list_columns if verbose or x[0]]
-    for v in attr: list_columns.append((True, v, v, ident))
-    header = [x[2] for x in list_columns]; rows = []
-    header += ['Subnet Name', 'VPC Name']
-    ec2 = get_ec2_connection()
-    instances = ec2.instances.all()
-    subnets = list(ec2.subnets.all())
-    vpcs = list(ec2.vpcs.all())
-    completion_keywords = []
-    try:
-        for inst in instances:
-            row = [f(getattr(inst, i)) for _, i, _, f in list_columns]
-            row.append([extract_name_from_tags(i.tags, inst.subnet_id) for i in subnets if i.id == inst.subnet_id])
-            row.append([extract_name_from_tags(i.tags, inst.vpc_id) for i in vpcs if i.id == inst.vpc_id])
-            rows.append(row)
-            completion_keywords += [{"host": row[0]}, {"instance_id": row[1]}, {"ip": inst.public_ip_address}]
-    except AttributeError as e:
-        error_exit(str(e) + "\nNo such attribute.\nTry 'taw list --argdoc' to see all attributes.")
-    update_completion_keywords(completion_keywords, "instance=" + get_aws_region())
 
-    def coloring(r):
-        if verbose: return None
-        if r[5] == 'stopped': return {-1: 'red'}
-        if r[5] == 'stopping': return {-1: 'green'}
-        if r[5] == 'pending': return {-1: 'yellow'}
-        if r[5] == 'stopped': return {-1: 'red'}
-        if r[5] == 'terminated': return {-1: 'grey'}
-        if r[5] == 'shutting-down': return {-1: 'cyan'}
-        return None
+    def price_str(price, unit=1):
+        return '' if price is None else "%.4f" % (price / unit)
 
-    output_table(params, header, rows, [coloring])
+    header = ['type', '#vcpu', 'mem (GiB)', '#GPU', 'GPU', 'arch', 'on-demand ($/h)', 'spot ($/h)', '$/vCPU/h', '$/GiB/h']
+    rows = []
+    for name, spec, on_demand_price, spot_price in results:
+        price = spot_price if spot else on_demand_price
+        rows.append([name, spec['vcpu'], "%g" % spec['mem'], spec['gpu'] or '', spec['gpu_desc'], spec['arch'],
+                     price_str(on_demand_price), price_str(spot_price), price_str(price, spec['vcpu']), price_str(price, spec['mem'])])
+    output_table(params, header, rows)
 
 
 @instance_group.command("showprice")
@@ -26,7 +26,7 @@ def security_group_list_to_strs(cs):
 @click.argument('restype', default='instance', metavar='[resource type (default: instance)]')
 @click.option('--verbose', '-v', is_flag=True, help='Verbose output.')
 @click.option('--argdoc', is_flag=True, help='Show available attributes in a web browser')
-@click.option('--attr', '-a', multiple=True, help='Attribute name(s).')
+@click.option('--attr', '-a', multiple=True, help='Attribute name(s) or column header(s) to show (only they are shown).')
 @click.option('--allregions', is_flag=True, help='List for all regions.')
 @click.argument('subargs', nargs=-1)
 @pass_global_parameters
@@ -40,6 +40,7 @@ def list_cmd(params, restype, verbose, argdoc, attr, subargs, allregions):
         keypairs        : list key pairs
         localkeypairs   : list local key pairs
         snapshots       : list snapshots
+        volumes         : list EBS volumes
         securitygroups  : list security groups
         sg              : list security groups (short hand)
         zone            : list zones
@@ -47,15 +48,22 @@ def list_cmd(params, restype, verbose, argdoc, attr, subargs, allregions):
         az              : list availability zones
         ip              : list elastic ip
         market          : list market AMIs
-        price           : list instance prices
+        price           : list instance prices (offline; see 'list price import')
         identity        : show my identity
     """
 
+    def redirect_to(args):
+        """ run another taw command in this process (connections and caches are reused) """
+        opts = params.global_opt_str + ['--region', get_aws_region()]  # --allregions may have switched the region
+        if params.output_noless: opts += ['--noless']
+        with taw.make_context('taw', opts + args) as ncon: _ = taw.invoke(ncon)
+
     def list_subnet(vpc_id_if_any):
         """ list subnets """
         if argdoc:
             click.launch('https://boto3.readthedocs.io/en/latest/reference/services/ec2.html#subnet')
             return
+        subnet_id_to_items = {}  # (data name, subnet ID) -> the list of the names of the related items (only the data that the shown columns need)
         all_list_columns = [
                 (True , "tags"                      , "Name"          , extract_name_from_tags),
                 (True , "subnet_id"                 , "Subnet ID"     , ident)                      ,
@@ -65,31 +73,38 @@ def list_cmd(params, restype, verbose, argdoc, attr, subargs, allregions):
                 (False, "default_for_az"            , "Default for AZ", ident)                      ,
                 (False, "available_ip_address_count", "# IP"          , ident)                      ,
                 (False, "availability_zone"         , "AZ"            , ident)                      ,
+                (True , "subnet_id"                 , "VPC Names"     , lambda x: subnet_id_to_items.get(('vpcs', x), [])     , ('vpcs',))     ,
+                (True , "subnet_id"                 , "Instances"     , lambda x: subnet_id_to_items.get(('instances', x), []), ('instances',)),
             ]
-        list_columns = [x for x in all_list_columns if verbose or x[0]]
-        for v in attr: list_columns.append((True, v, v, ident))
-        header = [x[2] for x in list_columns] + ['VPC Names', 'Instances']; rows = []
+        list_columns = select_list_columns(all_list_columns, verbose, attr)
+        header = [x[2] for x in list_columns]; rows = []
+        filter_terms, vpc_id_if_any = split_filter_terms(vpc_id_if_any)
+        subnet_filter = ResourceFilter(filter_terms, {
+                'name' : ('tag:Name'         , lambda s: extract_name_from_tags(s.tags)),
+                'id'   : ('subnet-id'        , lambda s: s.subnet_id)                   ,
+                'vpc'  : ('vpc-id'           , lambda s: s.vpc_id)                      ,
+                'cidr' : ('cidr-block'       , lambda s: s.cidr_block)                  ,
+                'state': ('state'            , lambda s: s.state)                       ,
+                'az'   : ('availability-zone', lambda s: s.availability_zone)           ,
+            })
+        vpc_filters = [{'Name': 'vpc-id', 'Values': list(vpc_id_if_any)}] if vpc_id_if_any else []
         ec2 = get_ec2_connection()
-        subnets = ec2.subnets.all()
-        instances = ec2.instances.all()
-        vpcs = ec2.vpcs.all()
+        subnets = [s for s in ec2.subnets.filter(Filters=vpc_filters + subnet_filter.ec2_filters()) if subnet_filter.matches(s)]
+        needs = data_needed_by_list_columns(list_columns)
+        if 'vpcs' in needs:
+            vpc_id_to_name = dict([(i.vpc_id, extract_name_from_tags(i.tags)) for i in ec2.vpcs.all()])
+            for subnet in subnets: subnet_id_to_items[('vpcs', subnet.subnet_id)] = [vpc_id_to_name[subnet.vpc_id]] if subnet.vpc_id in vpc_id_to_name else []
+        if 'instances' in needs:
+            for i in ec2.instances.all(): subnet_id_to_items.setdefault(('instances', i.subnet_id), []).append(extract_name_from_tags(i.tags))
         try:
             for subnet in subnets:
-                row = [f(getattr(subnet, i)) for _, i, _, f in list_columns]
-                vpc_is_found = False
-                for i in vpcs:
-                    if i.vpc_id == subnet.vpc_id:
-                        if len(vpc_id_if_any) == 0 or i.vpc_id in vpc_id_if_any:
-                            vpc_is_found = True
-                            row.append([extract_name_from_tags(i.tags)])
-                row.append([extract_name_from_tags(i.tags) for i in instances if i.subnet_id == subnet.subnet_id])
-                if vpc_is_found:
-                    rows.append(row)
+                row = [f(getattr(subnet, i)) for _, i, _, f in [c[:4] for c in list_columns]]
+                rows.append(row)
         except AttributeError as e:
             error_exit(str(e) + "\nNo such attribute.\nTry 'taw list --argdoc' to see all attributes.")
         output_table(params, header, rows)
 
-    def list_key_pairs(dummy_argument):
+    def list_key_pairs(filter_terms):
         """ list key pairs (only info) """
         if argdoc:
             click.launch('https://boto3.readthedocs.io/en/latest/reference/services/ec2.html#keypairinfo')
@@ -98,11 +113,14 @@ def list_cmd(params, restype, verbose, argdoc, attr, subargs, allregions):
                 (True, "key_name"       , "Name"       , ident),
                 (True, "key_fingerprint", "FingerPrint", ident),
             ]
-        list_columns = [x for x in all_list_columns if verbose or x[0]]
-        for v in attr: list_columns.append((True, v, v, ident))
+        list_columns = select_list_columns(all_list_columns, verbose, attr)
         header = [x[2] for x in list_columns]; rows = []
+        key_filter = ResourceFilter(filter_terms_of(filter_terms), {
+                'name'       : ('key-name'   , lambda k: k.key_name)       ,
+                'fingerprint': ('fingerprint', lambda k: k.key_fingerprint),
+            })
         ec2 = get_ec2_connection()
-        keys = ec2.key_pairs.all()
+        keys = [k for k in ec2.key_pairs.filter(Filters=key_filter.ec2_filters()) if key_filter.matches(k)]
         try:
             for key in keys:
                 row = [f(getattr(key, i)) for _, i, _, f in list_columns]
@@ -121,7 +139,7 @@ def list_cmd(params, restype, verbose, argdoc, attr, subargs, allregions):
             rows.append([os.path.basename(fn)[:-4], fp.strip().decode('utf-8')])
         output_table(params, header, rows)
 
-    def list_snapshots(dummy_argument):
+    def list_snapshots(filter_terms):
         """ list snapshots (of mine) """
         if argdoc:
             click.launch('https://boto3.readthedocs.io/en/latest/reference/services/ec2.html#snapshot')
@@ -137,11 +155,17 @@ def list_cmd(params, restype, verbose, argdoc, attr, subargs, allregions):
                 (False, "encrypted"    , "Encrypted"  , ident)                                ,
                 (False, "state_message", "Message"    , ident)                                ,
             ]
-        list_columns = [x for x in all_list_columns if verbose or x[0]]
-        for v in attr: list_columns.append((True, v, v, ident))
+        list_columns = select_list_columns(all_list_columns, verbose, attr)
         header = [x[2] for x in list_columns]; rows = []
+        snapshot_filter = ResourceFilter(filter_terms_of(filter_terms), {
+                'name'  : ('tag:Name'   , lambda s: extract_name_from_tags(s.tags)),
+                'id'    : ('snapshot-id', lambda s: s.snapshot_id)                 ,
+                'state' : ('status'     , lambda s: s.state)                       ,
+                'volume': ('volume-id'  , lambda s: s.volume_id)                   ,
+                'size'  : ('volume-size', lambda s: s.volume_size)                 ,
+            })
         ec2 = get_ec2_connection()
-        snapshots = ec2.snapshots.filter(OwnerIds=['self'])
+        snapshots = [s for s in ec2.snapshots.filter(OwnerIds=['self'], Filters=snapshot_filter.ec2_filters()) if snapshot_filter.matches(s)]
         try:
             for snapshot in snapshots:
                 row = [f(getattr(snapshot, i)) for _, i, _, f in list_columns]
@@ -193,39 +217,44 @@ def list_cmd(params, restype, verbose, argdoc, attr, subargs, allregions):
                     ranges = d['IpRanges']
                     return ["%s/%s(%s)" % (prot, port_range_str, i) for i in fs(ranges)]
             return [i for x in arr for i in conv(x)]
+        group_id_to_instances, vpc_id_to_name = {}, {}  # filled only if the columns that need them are shown
         all_list_columns = [
-                (True , "group_name"           , "Name"  , ident)            ,
-                (True , "group_id"             , "ID"    , ident)            ,
+                (True , "group_name"           , "Name"     , ident)            ,
+                (True , "group_id"             , "ID"       , ident)            ,
                 (True , "ip_permissions"       , "Ingress"  , str_sg_permission),
-                (True , "ip_permissions_egress", "Egress", str_sg_permission),
-                (False, "vpc_id"               , "VPC"   , ident)            ,
+                (True , "ip_permissions_egress", "Egress"   , str_sg_permission),
+                (False, "vpc_id"               , "VPC"      , ident)            ,
+                (False, "group_id"             , "Instances", lambda x: group_id_to_instances.get(x, [])                      , ('instances',)),
+                (True , "vpc_id"               , "VPC Names", lambda x: [vpc_id_to_name[x]] if x in vpc_id_to_name else [], ('vpcs',))     ,
             ]
-        list_columns = [x for x in all_list_columns if verbose or x[0]]
-        for v in attr: list_columns.append((True, v, v, ident))
+        list_columns = select_list_columns(all_list_columns, verbose, attr)
         header = [x[2] for x in list_columns]; rows = []
-        if verbose: header += ['Instances']
-        header += ['VPC Names']
+        filter_terms, sg_if_any = split_filter_terms(sg_if_any)
+        sg_filter = ResourceFilter(filter_terms, {
+                'name': ('group-name', lambda g: g.group_name),
+                'id'  : ('group-id'  , lambda g: g.group_id)  ,
+                'vpc' : ('vpc-id'    , lambda g: g.vpc_id)    ,
+            })
         ec2 = get_ec2_connection()
-        vpcs = ec2.vpcs.all()
         if sg_if_any:
             sg_id_likes = [i for i in sg_if_any if i.startswith("sg-")]
             sg_name_likes = [i for i in sg_if_any if not i.startswith("sg-")]
-            sg_ids = ec2.security_groups.filter(Filters=[{'Name': 'group-id', 'Values': list(sg_if_any)}])
-            sg_names = ec2.security_groups.filter(Filters=[{'Name': 'group-name', 'Values': list(sg_if_any)}])
-            sg_byvpc = ec2.security_groups.filter(Filters=[{'Name': 'vpc-id', 'Values': list(sg_if_any)}])
+            sg_ids = ec2.security_groups.filter(Filters=[{'Name': 'group-id', 'Values': list(sg_if_any)}] + sg_filter.ec2_filters())
+            sg_names = ec2.security_groups.filter(Filters=[{'Name': 'group-name', 'Values': list(sg_if_any)}] + sg_filter.ec2_filters())
+            sg_byvpc = ec2.security_groups.filter(Filters=[{'Name': 'vpc-id', 'Values': list(sg_if_any)}] + sg_filter.ec2_filters())
             security_groups = list(sg_ids) + list(sg_names) + list(sg_byvpc)
         else:
-            security_groups = ec2.security_groups.all()
-        instances = ec2.instances.all()
+            security_groups = ec2.security_groups.filter(Filters=sg_filter.ec2_filters())
+        security_groups = [g for g in security_groups if sg_filter.matches(g)]
+        needs = data_needed_by_list_columns(list_columns)
+        if 'vpcs' in needs:
+            vpc_id_to_name.update([(vpc.vpc_id, extract_name_from_tags(vpc.tags)) for vpc in ec2.vpcs.all()])
+        if 'instances' in needs:
+            for inst in ec2.instances.all():
+                for x in inst.security_groups: group_id_to_instances.setdefault(x['GroupId'], []).append(extract_name_from_tags(inst.tags))
         try:
             for security_group in security_groups:
-                row = [f(getattr(security_group, i)) for _, i, _, f in list_columns]
-                if verbose:
-                    insts = [extract_name_from_tags(inst.tags) for inst in instances if
-                             security_group.group_id in [x['GroupId'] for x in inst.security_groups]]
-                    row.append(insts)
-                vpc_names = [extract_name_from_tags(vpc.tags) for vpc in vpcs if vpc.vpc_id == security_group.vpc_id]
-                row.append(vpc_names)
+                row = [f(getattr(security_group, i)) for _, i, _, f in [c[:4] for c in list_columns]]
                 rows.append(row)
         except AttributeError as e:
             error_exit(str(e) + "\nNo such attribute.\nTry 'taw list --argdoc' to see all attributes.")
@@ -268,6 +297,11 @@ def list_cmd(params, restype, verbose, argdoc, attr, subargs, allregions):
                 if not (name in id_to_perm_bits): id_to_perm_bits[name] = 0
                 id_to_perm_bits[name] |= pstr_to_octal_bits(perm)
             return id_to_perm_bits
+
+        def acl_to_str(acl):
+            """ convert an ACL (given as a function that makes an ACL resource) into a string; it costs a GetBucketAcl/GetObjectAcl """
+            id_to_perm_bits = grants_to_id_to_perm_bits(acl().grants)
+            return ", ".join([k + "(" + perm_bit_to_str(v) + ")" for k, v in six.iteritems(id_to_perm_bits)])
         if argdoc:
             click.launch('http://boto3.readthedocs.io/en/latest/reference/services/s3.html#S3.Client.list_buckets')
             return
@@ -275,6 +309,7 @@ def list_cmd(params, restype, verbose, argdoc, attr, subargs, allregions):
         rows = []
         s3 = get_s3_connection()
         page_size = 2048
+        filter_terms, bucket_name_if_any = split_filter_terms(bucket_name_if_any)
         if 0 < len(bucket_name_if_any):
             """ list a specified bucket """
             _, bucket_name, bucket_path = decompose_rpath(bucket_name_if_any[0])
@@ -284,54 +319,71 @@ def list_cmd(params, restype, verbose, argdoc, attr, subargs, allregions):
             else:
                 key_search_regex_if_any = bucket_path
             if is_debugging: print("Key pattern = '%s'" % key_search_regex_if_any, file=sys.stderr)
+            # Content-Type and Permission cost a request per object, so they are fetched only if they are shown
             all_list_columns = [
                     (True , "key"          , "Name"         , ident)                     ,
                     (True , "size"         , "Size"         , ident)                     ,
-                    (False, "Object"       , "Content-Type" , lambda x: x().content_type),
+                    (False, "Object"       , "Content-Type" , lambda x: x().content_type, ('head_object',)),
                     (True , "last_modified", "Modified"     , ident)                     ,
                     (True , "owner"        , "Owner"        , lambda x: x['DisplayName']),
                     (False, "owner"        , "Owner ID"     , lambda x: x['ID'])         ,
                     (False, "storage_class", "Storage Class", ident)                     ,
+                    (False, "Acl"          , "Permission"   , acl_to_str                , ('object_acl',)) ,
                 ]
-            list_columns = [x for x in all_list_columns if verbose or x[0]]
-            for v in attr: list_columns.append((True, v, v, ident))
+            list_columns = select_list_columns(all_list_columns, verbose, attr)
             header = [x[2] for x in list_columns]; rows = []
-            if verbose: header += ['Permission']
+            object_filter = ResourceFilter(filter_terms, {
+                    'key'  : (None, lambda o: o.key)          ,
+                    'size' : (None, lambda o: o.size)         ,
+                    'class': (None, lambda o: o.storage_class),
+                }, pushdown=False)
+            key_prefix = object_filter.literal_prefix('key')  # listing only the keys with the prefix
             if key_search_regex_if_any and re.match(r'[^\*]+\*$', key_search_regex_if_any):
-                if is_debugging: print("Prefix='%s'" % key_search_regex_if_any[:-1], file=sys.stderr)
-                query_object = s3.Bucket(bucket_name).objects.filter(Prefix=key_search_regex_if_any[:-1]).page_size(page_size)
+                key_prefix = key_search_regex_if_any[:-1]
+            if output_row_limit(params): page_size = min(page_size, max(1, output_row_limit(params)))  # no more pages than --limit needs
+            if key_prefix:
+                if is_debugging: print("Prefix='%s'" % key_prefix, file=sys.stderr)
+                query_object = s3.Bucket(bucket_name).objects.filter(Prefix=key_prefix).page_size(page_size)
             else:
                 query_object = s3.Bucket(bucket_name).objects.page_size(page_size)
-            try:
-                for obj in query_object:
-                    if key_search_regex_if_any and not fnmatch.fnmatch(obj.key, key_search_regex_if_any): continue
-                    row = [f(getattr(obj, i)) for _, i, _, f in list_columns]  # noqa: F812
-                    if verbose:
-                        id_to_perm_bits = grants_to_id_to_perm_bits(obj.Acl().grants)
-                        row.append(", ".join([k + "(" + perm_bit_to_str(v) + ")" for k, v in six.iteritems(id_to_perm_bits)]))
-                    rows.append(row)
-            except AttributeError as e:
-                error_exit(str(e) + "\nNo such attribute.\nTry 'taw list --argdoc' to see all attributes.")
+
+            def object_rows():
+                """ rows are made as output_table consumes them, so the listing stops at --limit """
+                try:
+                    for obj in query_object:
+                        if key_search_regex_if_any and not fnmatch.fnmatch(obj.key, key_search_regex_if_any): continue
+                        if not object_filter.matches(obj): continue
+                        yield [f(getattr(obj, i)) for _, i, _, f in [c[:4] for c in list_columns]]  # noqa: F812
+                except AttributeError as e:
+                    error_exit(str(e) + "\nNo such attribute.\nTry 'taw list --argdoc' to see all attributes.")
+            rows = object_rows()
         else:
+            # NOTE: Region should be done better in the future (a GetBucketLocation per bucket).
+            #       see https://github.com/boto/boto3/issues/292
             all_list_columns = [
-                    (True, "name"         , "Name"         , ident),
-                    (True, "creation_date", "Creation Date", ident),
+                    (True , "name"         , "Name"         , ident)                                                            ,
+                    (True , "creation_date", "Creation Date", ident)                                                            ,
+                    (True , "Acl"          , "Permission"   , acl_to_str                                                       , ('bucket_acl',)),
+                    (False, "name"         , "Region"       , lambda x: s3.meta.client.get_bucket_location(Bucket=x)["LocationConstraint"], ('bucket_location',)),
                 ]
-            list_columns = [x for x in all_list_columns if verbose or x[0]]
-            for v in attr: list_columns.append((True, v, v, ident))
-            header = [x[2] for x in list_columns]; rows = []; header.append("Permission")
-            if verbose: header += ['Region']
+            list_columns = select_list_columns(all_list_columns, verbose, attr)
+            header = [x[2] for x in list_columns]; rows = []
+            bucket_filter = ResourceFilter(filter_terms, {'name': (None, lambda b: b.name)}, pushdown=False)
+            bucket_prefix = bucket_filter.literal_prefix('name')  # S3 lists only the buckets with the prefix
+
+            def buckets():
+                if bucket_prefix:
+                    import botocore.exceptions
+                    try:
+                        return list(s3.buckets.filter(Prefix=bucket_prefix).page_size(page_size))
+                    except botocore.exceptions.ParamValidationError:
+                        pass  # botocore before 1.35 does not know Prefix of ListBuckets; the buckets are filtered locally
+                return s3.buckets.all().page_size(page_size)
+
             try:
-                for b in s3.buckets.page_size(page_size):
-                    bucket_name = b.name
-                    row = [f(getattr(b, i)) for _, i, _, f in list_columns]
-                    id_to_perm_bits = grants_to_id_to_perm_bits(b.Acl().grants)
-                    row.append(", ".join([k + "(" + perm_bit_to_str(v) + ")" for k, v in six.iteritems(id_to_perm_bits)]))
-                    if verbose:
-                        # NOTE: should do better in the future.
-                        #       see https://github.com/boto/boto3/issues/292
-                        region_name_of_the_bucket = s3.meta.client.get_bucket_location(Bucket=bucket_name)["LocationConstraint"]
-                        row.append(region_name_of_the_bucket)
+                for b in buckets():
+                    if not bucket_filter.matches(b): continue
+                    row = [f(getattr(b, i)) for _, i, _, f in [c[:4] for c in list_columns]]
                     rows.append(row)
             except AttributeError as e:
                 error_exit(str(e) + "\nNo such attribute.\nTry 'taw list --argdoc' to see all attributes.")
@@ -346,15 +398,23 @@ def list_cmd(params, restype, verbose, argdoc, attr, subargs, allregions):
             rows.append(row)
         output_table(params, header, rows)
 
-    def list_elastic_ip(dummy_arg):
+    def list_elastic_ip(filter_terms):
         """ list all elastic IPs """
         if argdoc:
             click.launch('http://boto3.readthedocs.io/en/latest/reference/services/s3.html#S3.Client.list_buckets')
             return
+        address_filter = ResourceFilter(filter_terms_of(filter_terms), {
+                'name'      : ('tag:Name'          , lambda a: extract_name_from_tags(a.tags)),
+                'ip'        : ('public-ip'         , lambda a: a.public_ip)                   ,
+                'private_ip': ('private-ip-address', lambda a: a.private_ip_address)          ,
+                'instance'  : ('instance-id'       , lambda a: a.instance_id)                 ,
+                'domain'    : ('domain'            , lambda a: a.domain)                      ,
+            })
         ec2 = get_ec2_connection()
-        instances = ec2.instances.all()
+        instances = list(ec2.instances.all())
         header = ['Name', 'Allocation ID', 'Association ID', 'Public IP', 'Domain', 'Instance ID', 'Private IP', 'Network Interface ID', 'Instance Name']; rows = []
-        for i in ec2.vpc_addresses.all():
+        for i in ec2.vpc_addresses.filter(Filters=address_filter.ec2_filters()):
+            if not address_filter.matches(i): continue
             row = [extract_name_from_tags(i.tags)]
             row += [i.allocation_id, i.association_id, i.public_ip, i.domain, i.instance_id, i.private_ip_address, i.network_interface_id]
             row.append([extract_name_from_tags(inst.tags) for inst in instances if inst.instance_id == i.instance_id])
@@ -362,7 +422,7 @@ def list_cmd(params, restype, verbose, argdoc, attr, subargs, allregions):
         output_table(params, header, rows)
 
     def list_market_ami(option_strs):
-        """ list recommended AMIs in AMI Marketplace """
+        """ list recommended AMIs (see 'taw image refresh') and the ones registered from AMI Marketplace """
         multiplier = 1
         add_unit = ''
         search_terms = []
@@ -372,50 +432,75 @@ def list_cmd(params, restype, verbose, argdoc, attr, subargs, allregions):
             elif opt_str == 'week':
                 multiplier = 24 * 7
             elif opt_str == 'month':
-                multiplier = 24 * 31
+                multiplier = hours_per_month
             elif opt_str == 'year':
-                multiplier = 365
+                multiplier = 12 * hours_per_month
             else:
                 search_terms.append(opt_str)
             add_unit = '/' + opt_str
-        db_path = get_AMI_DB_file_path()
-        conn = sqlite3.connect(db_path)
+        conn = open_AMI_DB()
         header = ['Name', 'AMI']
         if verbose:
             header += ['Instance Type', 'Total' + add_unit]
         rows = []
-        my_region = get_aws_region()
-        for sql_row in conn.execute("SELECT * FROM ami_ids;"):
-            image_name = sql_row[0]
-            if 0 < len(search_terms) and all(map(lambda x: re.search(x, image_name, re.I) is None, search_terms)): continue
-            row = [image_name]
-            region_to_ami = pickle.loads(sql_row[1])
-            if my_region in region_to_ami:
-                row.append(region_to_ami[my_region])
-            else:
-                row.append("N/A")
+        for name, ami_id, image_name, _ in query_recommended_images(conn, get_aws_region()):  # see 'taw image refresh'
+            if 0 < len(search_terms) and all([re.search(t, name, re.I) is None and re.search(t, image_name, re.I) is None for t in search_terms]): continue
+            rows.append([name, ami_id] + ([[], []] if verbose else []))
+        images = search_AMI_DB(conn, search_terms)
+        image_id_to_ami = dict(conn.execute("SELECT image_id, ami_id FROM image_regions WHERE region = ?", (get_aws_region(),)).fetchall())
+        image_id_to_costs = {}
+        if verbose:
+            for image_id, instance_type, cost_total in conn.execute("SELECT image_id, instance_type, cost_total FROM image_costs ORDER BY image_id, instance_type"):
+                image_id_to_costs.setdefault(image_id, []).append((instance_type, cost_total))
+        for image_id, image_name in images:
+            row = [image_name, image_id_to_ami.get(image_id, "N/A")]
             if verbose:
-                type_to_cost = pickle.loads(sql_row[2])
                 its, tcs = [], []
-                for type_str in sorted(type_to_cost.keys()):
-                    d = type_to_cost[type_str]
-                    its.append(d['InstanceType'])
+                for instance_type, cost_total in image_id_to_costs.get(image_id, []):
+                    its.append(instance_type)
                     if multiplier == 1:
-                        tcs.append(d['CostTotal'])
+                        tcs.append(cost_total)
                     else:
-                        tcs.append("%9.2f" % (float(d['CostTotal']) * multiplier))
+                        tcs.append("%9.2f" % (float(cost_total) * multiplier))
                 row += [its, tcs]
             rows.append(row)
         output_table(params, header, rows)
         conn.close()
 
-    def list_instance_price(dummy_arg):
-        """ list the instance prices.
-            How to calculate the instance prices is really complicated so
-            I just decided to use the existing web service, ec2pricing.
-            It displays the price for each instance. It calculates spot prices, too.
+    def list_instance_price(option_strs):
+        """ list the on-demand instance prices in the offline price catalog.
+            eg) taw list price                          (all types in the current region, Linux, shared tenancy)
+                taw list price 'c5.*' m5.large month    (the monthly prices of some types)
+                taw list price 'r5*' region='us-*' os=Windows tenancy=Dedicated
+                taw list price import [FILE or URL]     (import a Price List bulk JSON file; the current region's by default)
         """
-        click.launch('http://ec2pricing.net/')
+        if 0 < len(option_strs) and option_strs[0] == 'import':
+            source = option_strs[1] if 1 < len(option_strs) else None
+            print_info("Importing %s ..." % (source or "the price list of %s" % get_aws_region()))
+            n, regions = import_price_catalog(source)
+            if n <= 0: error_exit("No instance prices were found in the price list")
+            print_info("Imported %d prices of %s" % (n, ", ".join(regions)))
+            return
+        unit_to_multiplier = {'hour': 1, 'day': 24, 'week': 24 * 7, 'month': hours_per_month, 'year': 12 * hours_per_month}
+        unit = 'hour'
+        region_pattern, os_name, tenancy = get_ec2_client().meta.region_name, 'Linux', 'Shared'
+        type_patterns = []
+        for opt_str in option_strs:
+            if opt_str in unit_to_multiplier:
+                unit = opt_str
+            elif opt_str.startswith('region='):
+                region_pattern = normalize_region_name(opt_str[7:], False) or opt_str[7:]
+            elif opt_str.startswith('os='):
+                os_name = opt_str[3:] if opt_str[3:] != '*' else None
+            elif opt_str.startswith('tenancy='):
+                tenancy = opt_str[8:] if opt_str[8:] != '*' else None
+            else:
+                type_patterns.append(opt_str)
+        rows = [[r[0], r[1], r[2], r[3], "%.4f" % (r[4] * unit_to_multiplier[unit])]
+                for r in query_price_catalog(region_pattern, type_patterns, os_name, tenancy)]
+        if len(rows) <= 0 and len(query_price_catalog(region_pattern)) <= 0:
+            error_exit("The offline price catalog has no prices for '%s'.\nImport them by 'taw list price import [FILE or URL]'." % region_pattern)
+        output_table(params, ['Region', 'Instance Type', 'OS', 'Tenancy', 'USD/' + unit], rows)
 
     def list_identity(dummy_arg):
         """ Show the identity of the user.
@@ -429,26 +514,22 @@ def list_cmd(params, restype, verbose, argdoc, attr, subargs, allregions):
         """ List instances.
             This is a shorthand for 'taw instance list' but has fewer options. Use 'taw instance list' where possible.
             """
-        s = boto3.session.Session()
-        import __main__
-        cmdline = [__main__.__file__] + params.global_opt_str + ['instance', 'list'] + list(subargs)
-        subprocess.check_call(cmdline)
+        redirect_to(['instance', 'list'] + list(subargs))
 
     def list_image(dummy_argument):
         """ List images.
             """
-        s = boto3.session.Session()
-        import __main__
-        cmdline = [__main__.__file__] + params.global_opt_str + ['image', 'list'] + list(subargs)
-        subprocess.check_call(cmdline)
+        redirect_to(['image', 'list'] + list(subargs))
+
+    def list_volumes(dummy_argument):
+        """ List EBS volumes.
+            """
+        redirect_to(['volume', 'list'] + list(subargs))
 
     def list_zones(dummy_argument):
         """ List Route53 zones.
             """
-        s = boto3.session.Session()
-        import __main__
-        cmdline = [__main__.__file__] + params.global_opt_str + ['zone', 'list'] + list(subargs)
-        subprocess.check_call(cmdline)
+        redirect_to(['zone', 'list'] + list(subargs))
 
     # def list_test():
         # """ test function. (can be eliminated) """
@@ -465,6 +546,7 @@ def list_cmd(params, restype, verbose, argdoc, attr, subargs, allregions):
             'keypairs'       : list_key_pairs,
             'localkeypairs'  : list_local_key_pairs,
             'snapshots'      : list_snapshots,
+            'volumes'        : list_volumes,
             'securitygroups' : list_security_groups,
             'sg'             : list_security_groups,
             'zone'           : list_zones,
@@ -3,6 +3,7 @@
 from __future__ import print_function
 from __future__ import absolute_import
 import sys
+import taw.apiprofile  # This must be the first import of taw modules (for --profile-api)
 import re, botocore
 from taw.util import *
 import taw.sshlike
@@ -16,6 +17,8 @@ import taw.sg
 import taw.keypair
 import taw.ip
 import taw.image
+import taw.cost
+import taw.volume
 import taw.completion
 import taw.shell
 from taw.taw import *  # This must be the end of imports
@@ -3,7 +3,7 @@
 from __future__ import print_function
 from __future__ import absolute_import
 import os, click
-import subprocess
+import subprocess, sys, six
 from taw.util import *
 from taw.taw import *
 
@@ -14,14 +14,77 @@ from taw.taw import *
 #  SSH COMMAND
 # ==============
 @taw.command("ssh")
-@click.argument('hostname', metavar='<host name>')
+@click.argument('hostname', metavar='<host name>', required=False)
 @click.argument('sshargs', nargs=-1)
+@click.option('--close', is_flag=True, help='Close the shared connection to the host (or all shared connections if no host is given).')
 @pass_global_parameters
-def ssh_cmd(params, hostname, sshargs):
-    """ do SSH to a specified host """
+def ssh_cmd(params, hostname, sshargs, close):
+    """ do SSH to a specified host
+
+        \b
+        Connections to a host are shared by ssh, scp, rsync and mosh
+        and are kept for a while after the last session ends,
+        so that subsequent commands can skip the handshake.
+        Use 'taw ssh --close [host]' to close them.
+    """
+    if close:
+        print_info("%d shared connection(s) closed" % close_ssh_master_connections(hostname))
+        return
+    if hostname is None: error_exit("Please specify a host name")
     ssh_like_call(params, 'ssh', hostname, sshargs)
 
 
+# ===============
+#  PSSH COMMAND
+# ===============
+@taw.command("pssh")
+@click.argument('targets', metavar='<host name patterns | tag=value>')
+@click.argument('command', nargs=-1, required=True)
+@click.option('--parallel', '-P', default=16, type=int, help='Maximum number of concurrent connections (default: 16).')
+@click.option('--collect', is_flag=True, help='Show the output grouped by host after all hosts finish.')
+@click.option('--accept-new-keys', is_flag=True, help='Accept host keys of hosts that are not in known_hosts yet.')
+@pass_global_parameters
+def pssh_cmd(params, targets, command, parallel, collect, accept_new_keys):
+    """ run a command on many hosts in parallel
+
+        \b
+        Targets are comma-separated host names (wildcards allowed) or instance IDs,
+        or a tag filter such as 'role=compute'. They are resolved with one API call.
+        eg) taw pssh 'worker-*' -- uptime
+            taw pssh role=compute -- df -h /
+    """
+    instances = convert_host_patterns_to_instances(targets.split(','))
+    if len(instances) <= 0: error_exit("No running instance matches '%s'" % targets)
+    ssh_options = ['-o', 'BatchMode=yes']  # never wait for a password prompt that nobody can answer
+    if accept_new_keys: ssh_options += ['-o', 'StrictHostKeyChecking=accept-new']
+    jobs = []
+    for instance in instances:
+        if ssh_route_to_instance(instance, False) is None:
+            print_warning("%s (%s) is not reachable (no public IP address nor bastion). Skipped." % (extract_name_from_tags(instance.tags), instance.id))
+            continue
+        jobs.append((extract_name_from_tags(instance.tags), instance, ssh_like_command_line('ssh', instance, command, ssh_options)))
+    if params.aws_dryrun:
+        for _, _, args in jobs: print(" ".join(args))
+        return
+    name_width = max([len(name) for name, _, _ in jobs] + [0])
+
+    def print_prefixed(index, line):
+        print("%-*s | %s" % (name_width, jobs[index][0], line))
+
+    results = run_subprocesses_in_parallel([args for _, _, args in jobs], parallel, None if collect else print_prefixed)
+    if collect:
+        for (name, _, _), (_, _, lines) in zip(jobs, results):
+            print_fence(name)
+            for line in lines: print(line)
+    header = ['Name', 'ID', 'Exit Code', 'Time (s)']
+    rows = [[name, instance.id, exit_code, "%.1f" % elapsed] for (name, instance, _), (exit_code, elapsed, _) in zip(jobs, results)]
+    print("", file=sys.stderr)
+    output_table(params, header, rows, [lambda r: {2: 'red'} if r[2] != 0 else None])
+    failed_hosts = [r[0] for r in rows if r[2] != 0]
+    if 0 < len(failed_hosts):
+        error_exit("%d of %d hosts failed: %s" % (len(failed_hosts), len(rows), ", ".join(failed_hosts)))
+
+
 # ==============
 #  MOSH COMMAND
 # ==============
@@ -49,12 +112,18 @@ def rssh_cmd(params, hostname, rsshargs):
 # ==============
 #  RSYNC COMMAND
 # ==============
-@taw.command("rsync")
+@taw.command("rsync", context_settings=dict(ignore_unknown_options=True))
 @click.argument('hostname', metavar='<host name>')
-@click.argument('rsshargs', nargs=-1)
+@click.argument('rsshargs', nargs=-1, type=click.UNPROCESSED)
 @pass_global_parameters
 def rsync_cmd(params, hostname, rsshargs):
-    """ do rsync to a specified host """
+    """ do rsync to/from a specified host
+
+        \b
+        Remote paths are written as ':path'.
+        eg) taw rsync worker-01 -av ./src/ :work/src/
+            taw rsync worker-01 -av :work/out/ ./out/
+    """
     ssh_like_call(params, 'rsync', hostname, rsshargs)
 
 
@@ -90,16 +159,10 @@ def scp_cmd(params, src, dst, key_file_path, preserve_flag, batch_flag, compress
     copying_local_to_remote = dest_host is not None
     if copying_local_to_remote:
         instance = convert_host_name_to_instance(dest_host)
-        if instance.public_ip_address is None: error_exit("The instance has no public IP address")
-        dest_host = instance.public_ip_address
         if dest_user == '_': dest_user = os.environ['USER']
-        if dest_user is None: dest_user = get_root_like_user_from_instance(instance)
-        if key_file_path is None: key_file_path = os.path.join(os.path.expanduser("~/.ssh"), instance.key_name + ".pem")
-        if os.path.exists(key_file_path):
-            args += ['-i', key_file_path]
-        else:
-            print_info("Key file '%s' does not exist.\nThe default keys might be used" % key_file_path)
-        args += list(src) + ["%s@%s:%s" % (dest_user, dest_host, dest_path)]
+        destination, route_options = ssh_destination_of_instance(instance, dest_user)
+        args += ssh_key_options(instance, key_file_path) + ssh_multiplexing_options(instance) + route_options
+        args += list(src) + ["%s:%s" % (destination, dest_path)]
     else:
         # copying remote to local
         sources_arr = [decompose_rpath(i) for i in src]
@@ -107,17 +170,11 @@ def scp_cmd(params, src, dst, key_file_path, preserve_flag, batch_flag, compress
             if host[1] != sources_arr[0][1]: error_exit("Multiple source hosts are not supported.")
             if host[0] != sources_arr[0][0]: error_exit("Multiple source users are not supported.")
         instance = convert_host_name_to_instance(sources_arr[0][1])
-        if instance.public_ip_address is None: error_exit("The instance has no public IP address")
-        src_host = instance.public_ip_address
         src_user = sources_arr[0][0]
         if src_user == '_': src_user = os.environ['USER']
-        if src_user is None: src_user = get_root_like_user_from_instance(instance)
-        if key_file_path is None: key_file_path = os.path.join(os.path.expanduser("~/.ssh"), instance.key_name + ".pem")
-        if os.path.exists(key_file_path):
-            args += ['-i', key_file_path]
-        else:
-            print_info("Key file '%s' does not exist.\nThe default keys might be used" % key_file_path)
-        args += ["%s@%s:%s" % (src_user, src_host, x[2]) for x in sources_arr]
+        source, route_options = ssh_destination_of_instance(instance, src_user)
+        args += ssh_key_options(instance, key_file_path) + ssh_multiplexing_options(instance) + route_options
+        args += ["%s:%s" % (source, x[2]) for x in sources_arr]
         args.append(dst)
     if params.aws_dryrun:
         print(" ".join(args))
@@ -126,3 +183,105 @@ def scp_cmd(params, src, dst, key_file_path, preserve_flag, batch_flag, compress
         subprocess.check_call(args)
     except:
         pass
+
+
+# ===============
+#  PSCP COMMAND
+# ===============
+@taw.command("pscp")
+@click.argument('targets', metavar='<host name patterns | tag=value>')
+@click.argument('src', nargs=-1, required=True)
+@click.argument('dst', nargs=1)
+@click.option('--gather', is_flag=True, help='Copy remote files from every host into <dst>/<host name>/.')
+@click.option('--relay', is_flag=True, help='Let hosts that have received the files forward them to the other hosts.')
+@click.option('--parallel', '-P', default=16, type=int, help='Maximum number of concurrent transfers (default: 16).')
+@click.option('-r', 'recursive_flag', is_flag=True, help='recursive copy')
+@click.option('-p', 'preserve_flag', is_flag=True, help='preserve attrs')
+@click.option('--accept-new-keys', is_flag=True, help='Accept host keys of hosts that are not in known_hosts yet.')
+@pass_global_parameters
+def pscp_cmd(params, targets, src, dst, gather, relay, parallel, recursive_flag, preserve_flag, accept_new_keys):
+    """ copy files to/from many hosts in parallel
+
+        \b
+        Remote paths are written as ':path'.
+        eg) taw pscp 'worker-*' data.tar.gz :/tmp/
+            taw pscp --gather 'worker-*' :/var/log/app.log ./logs   (into ./logs/<host name>/)
+        \b
+        With --relay, each host that has received the files sends them
+        to another host over the private network in the next round,
+        so the local uplink carries the data only a few times.
+        --relay needs an ssh-agent holding the key (the agent is forwarded),
+        and the destination must be a directory (eg, ':/tmp/').
+    """
+    instances = convert_host_patterns_to_instances(targets.split(','))
+    if len(instances) <= 0: error_exit("No running instance matches '%s'" % targets)
+    scp_flags = (['-r'] if recursive_flag else []) + (['-p'] if preserve_flag else [])
+    ssh_options = ['-o', 'BatchMode=yes']
+    if accept_new_keys: ssh_options += ['-o', 'StrictHostKeyChecking=accept-new']
+    names = [extract_name_from_tags(i.tags) for i in instances]
+    names = [n if names.count(n) == 1 else n + '-' + i.id for n, i in zip(names, instances)]
+    rows = []
+
+    def run_round(jobs):
+        """ jobs is a list of (name, instance, route, args). Adds a row per job and returns the list of exit codes. """
+        if params.aws_dryrun:
+            for _, _, _, args in jobs: print(" ".join(args))
+            return [0 for _ in jobs]
+        results = run_subprocesses_in_parallel([args for _, _, _, args in jobs], parallel)
+        for (name, instance, route, _), (exit_code, elapsed, lines) in zip(jobs, results):
+            rows.append([name, instance.id, route, exit_code, "%.1f" % elapsed])
+            if exit_code != 0:
+                print_warning("%s:\n%s" % (name, "\n".join(lines)))
+        return [exit_code for exit_code, _, _ in results]
+
+    if gather:
+        if dst.startswith(':'): error_exit("The destination must be a local directory with --gather")
+        if any([not s.startswith(':') for s in src]): error_exit("The sources must be remote paths (':path') with --gather")
+        jobs = []
+        for name, instance in zip(names, instances):
+            local_dir = os.path.join(dst, name)
+            if not params.aws_dryrun and not os.path.exists(local_dir): os.makedirs(local_dir)
+            destination, route_options = ssh_destination_of_instance(instance)
+            jobs.append((name, instance, 'direct', ['scp'] + scp_flags + ssh_key_options(instance) + ssh_multiplexing_options(instance) + route_options +
+                                                   ssh_options + [destination + s for s in src] + [local_dir]))
+        run_round(jobs)
+    else:
+        if not dst.startswith(':'): error_exit("The destination must be a remote path (':path')")
+        if any([s.startswith(':') for s in src]): error_exit("The sources must be local paths (use --gather to copy from hosts)")
+        dst_path = dst[1:]
+
+        def local_to(instance):
+            destination, route_options = ssh_destination_of_instance(instance)
+            return ['scp'] + scp_flags + ssh_key_options(instance) + ssh_multiplexing_options(instance) + route_options + ssh_options + \
+                list(src) + [destination + ':' + dst_path]
+
+        if not relay:
+            run_round([(name, instance, 'direct', local_to(instance)) for name, instance in zip(names, instances)])
+        else:
+            # the paths of the copies on a host that has received the files
+            # (':path' might be an existing directory on the hosts, where a copy lands as path/<file name>, so a directory is required)
+            if dst_path != '' and not dst_path.endswith('/'):
+                error_exit("The destination must be a directory (ending with '/') with --relay")
+            copied_paths = [dst_path + os.path.basename(s.rstrip('/')) for s in src]
+
+            def relay_to(seed, instance):
+                if instance.private_ip_address is None: error_exit("%s has no private IP address" % instance.id)
+                remote_args = ['scp'] + scp_flags + ssh_options + copied_paths + \
+                    ["%s@%s:%s" % (get_root_like_user_from_instance(instance), instance.private_ip_address, dst_path)]
+                return ssh_like_command_line('ssh', seed, [six.moves.shlex_quote(a) for a in remote_args], ['-A'] + ssh_options)
+
+            seeds = []  # (name, instance) that have the files
+            pending = list(zip(names, instances))
+            while 0 < len(pending):
+                # binomial tree: the local host and every seed send to one new host per round
+                jobs = [(pending[0][0], pending[0][1], 'direct', local_to(pending[0][1]))]
+                for (seed_name, seed), (name, instance) in zip(seeds, pending[1:]):
+                    jobs.append((name, instance, 'via ' + seed_name, relay_to(seed, instance)))
+                pending = pending[len(jobs):]
+                exit_codes = run_round(jobs)
+                seeds += [(name, instance) for (name, instance, _, _), exit_code in zip(jobs, exit_codes) if exit_code == 0]
+    if params.aws_dryrun: return
+    output_table(params, ['Name', 'ID', 'Route', 'Exit Code', 'Time (s)'], rows, [lambda r: {3: 'red'} if r[3] != 0 else None])
+    failed_hosts = [r[0] for r in rows if r[3] != 0]
+    if 0 < len(failed_hosts):
+        error_exit("%d of %d hosts failed: %s" % (len(failed_hosts), len(rows), ", ".join(failed_hosts)))
@@ -5,6 +5,7 @@ from __future__ import absolute_import
 import colorama
 import click
 from taw.util import *
+from taw.apiprofile import start_api_profiler, session_event_handlers
 
 # constants
 _VERSION_STRING = "0.0.0"
@@ -29,12 +30,18 @@ pass_global_parameters = click.make_pass_decorator(GlobalParameters)
 @click.option('--noheader', is_flag=True, help='Do not output the header line.')
 @click.option('--format', '-f', 'format_type', default='simple_with_color', help='Output format.', type=click.Choice(['csv', 'json', 'tsv', 'simple', 'simple_with_color']))
 @click.option('--noless', '-n', is_flag=True, help='Do not invoke less.')
+@click.option('--sort', 'sort_columns', metavar='COL[,COL]', help="Sort the rows of a list by columns (a header; '-COL' for the descending order).")
+@click.option('--group-by', 'group_by', metavar='COL', help='Group the rows of a list by a column with the counts and the sums of numeric columns.')
+@click.option('--limit', type=click.IntRange(min=0), help='Show only the first N rows of a list (listing stops there without --sort/--group-by).')
 @click.option('--debug', is_flag=True, help='Turn on debugging.')
 @click.option('--profile', '-p', 'aws_profile', help='Choose profile.', type=click.Choice(look_for_completion_profile()))
 @click.option('--dryrun', is_flag=True, help='Dry-run. This may not be supported by commands that do not change the state.')
 @click.option('--subprocess', help='Used internally')
+@click.option('--ssh-route', type=click.Choice(['auto', 'public', 'private', 'bastion']), default='auto', help='How ssh-like commands reach instances (default: auto).')
+@click.option('--profile-api', 'profile_api', is_flag=True, help='Show a summary of AWS API calls and timings at exit.')
+@click.option('--profile-api-trace', 'profile_api_trace', metavar='FILE', help='Write AWS API calls and timings to FILE as JSON.')
 @click.pass_context
-def taw(ctx, region, noheader, format_type, noless, debug, aws_profile, subprocess, dryrun):
+def taw(ctx, region, noheader, format_type, noless, sort_columns, group_by, limit, debug, aws_profile, subprocess, dryrun, ssh_route, profile_api, profile_api_trace):
     """ main command group """
     ctx.obj = GlobalParameters()
     opt_lists = []   # this is for command redirection such as ('taw instance list' -> 'taw list instance') (*)
@@ -44,6 +51,11 @@ def taw(ctx, region, noheader, format_type, noless, debug, aws_profile, subproce
         colorama.init()
     set_debugging_status(debug)
     if debug: opt_lists.append('--debug')
+    if profile_api or profile_api_trace:
+        if start_api_profiler(profile_api_trace):
+            for event_name, handler in session_event_handlers():
+                register_session_event_handler(event_name, handler)
+        opt_lists.append('--profile-api')  # a trace file is not shared with subprocesses
     if aws_profile:
         if aws_profile == "default":
             del os.environ["AWS_PROFILE"]
@@ -57,7 +69,8 @@ def taw(ctx, region, noheader, format_type, noless, debug, aws_profile, subproce
     else:
         region = read_default_region_from_config(aws_profile)
         set_aws_region(region)
-    ensure_credential(ctx.obj)
+    with profile_phase('credentials'):
+        ensure_credential(ctx.obj)
     ctx.obj.output_header = not noheader
     if noheader:
         opt_lists += ['--noheader']
@@ -65,8 +78,14 @@ def taw(ctx, region, noheader, format_type, noless, debug, aws_profile, subproce
     opt_lists += ['--format', format_type]
     ctx.obj.output_noless = noless
     if noless: opt_lists += ['--noless']
+    ctx.obj.output_sort, ctx.obj.output_group_by, ctx.obj.output_limit = sort_columns, group_by, limit
+    if sort_columns: opt_lists += ['--sort', sort_columns]
+    if group_by: opt_lists += ['--group-by', group_by]
+    if limit is not None: opt_lists += ['--limit', str(limit)]
     ctx.obj.aws_dryrun = dryrun
     if dryrun: opt_lists += ['--dryrun']
+    set_ssh_route(ssh_route)
+    if ssh_route != 'auto': opt_lists += ['--ssh-route', ssh_route]
     ctx.obj.global_opt_str = opt_lists  # Again, this is for command redirection.See the above (*)
     if subprocess:
         try:
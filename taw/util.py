@@ -1,15 +1,16 @@
 #!/usr/bin/env python3
 
 from __future__ import print_function
-import os, sys, click
+import os, sys, click, glob
 import subprocess, datetime, mimetypes
 import boto3
 import tabulate, json
 import pyperclip, time, sqlite3, pickle, readline
 from termcolor import colored
-import re
+import re, fnmatch, itertools
 import six
 import dns.resolver
+from taw.apiprofile import profile_phase, profiled_phase
 
 
 # Global variables
@@ -26,6 +27,28 @@ def set_debugging_status(s):
     is_debugging = s
 
 
+# boto3 session
+global_session_event_handlers = []  # (event name, handler) that must survive a change of the default session
+
+
+def get_boto3_session():
+    """ returns the default boto3 session (creating one if needed) """
+    if boto3.DEFAULT_SESSION is None:
+        boto3.setup_default_session(profile_name=param_profile)
+        for event_name, handler in global_session_event_handlers:
+            boto3.DEFAULT_SESSION.events.register(event_name, handler)
+    return boto3.DEFAULT_SESSION
+
+
+def register_session_event_handler(event_name, handler):
+    """ register a botocore event handler to the default session.
+        The handler is registered again when the default session is replaced by set_aws_profile.
+        Note that it only affects clients/resources that are created after the registration.
+    """
+    global_session_event_handlers.append((event_name, handler))
+    get_boto3_session().events.register(event_name, handler)
+
+
 # EC2 client
 global_ec2_client = None
 
@@ -141,6 +164,8 @@ def set_aws_profile(profile_name):
     if param_profile != profile_name:
         param_profile = profile_name
         boto3.setup_default_session(profile_name=param_profile)
+        for event_name, handler in global_session_event_handlers:
+            boto3.DEFAULT_SESSION.events.register(event_name, handler)
         if is_debugging: print("AWS DEFAULT PROFILE WAS SET TO " + profile_name, file=sys.stderr)
         global_ec2_client     = None  # noqa: E221
         global_ec2_connection = None
@@ -268,144 +293,483 @@ def normalize_region_name(region_name, error_on_exit=True):
     return None
 
 
-# TODO: Add (or check) C5n, R5, R5a, R4, X1e, X1, z1d, p2, g3, f1, h1, i3, d2
-#
-
-instance_type_name_to_instance_type = {
-    "t2.nano"        : {"vcpu" :   1, "mem" :  0.5, "desc" :  "3 credit minutes/hour, EBS backend"},
-    "t2.micro"       : {"vcpu" :   1, "mem" :    1, "desc" :  "6 credit minutes/hour, EBS backend"},
-    "t2.small"       : {"vcpu" :   1, "mem" :    2, "desc" :  "12 credit minutes/hour, EBS backend"},
-    "t2.medium"      : {"vcpu" :   2, "mem" :    4, "desc" :  "24 credit minutes/hour, EBS backend"},
-    "t2.large"       : {"vcpu" :   2, "mem" :    8, "desc" :  "36 credit minutes/hour, EBS backend"},
-    "t2.xlarge"      : {"vcpu" :   4, "mem" :   16, "desc" :  "54 credit minutes/hour, EBS backend"},
-    "t2.2xlarge"     : {"vcpu" :   8, "mem" :   32, "desc" :  "81 credit minutes/hour, EBS backend"},
-    "t3.nano"        : {"vcpu" :   2, "mem" :  0.5, "desc" :  "6 credit minutes/hour, EBS backend, up to 5 Gbps network"},
-    "t3.micro"       : {"vcpu" :   2, "mem" :    1, "desc" :  "12 credit minutes/hour, EBS backend, up to 5 Gbps network"},
-    "t3.small"       : {"vcpu" :   2, "mem" :    2, "desc" :  "24 credit minutes/hour, EBS backend, up to 5 Gbps network"},
-    "t3.medium"      : {"vcpu" :   2, "mem" :    4, "desc" :  "24 credit minutes/hour, EBS backend, up to 5 Gbps network"},
-    "t3.large"       : {"vcpu" :   2, "mem" :    8, "desc" :  "36 credit minutes/hour, EBS backend, up to 5 Gbps network"},
-    "t3.xlarge"      : {"vcpu" :   4, "mem" :   16, "desc" :  "96 credit minutes/hour, EBS backend, up to 5 Gbps network"},
-    "t3.2xlarge"     : {"vcpu" :   8, "mem" :   32, "desc" :  "192 credit minutes/hour, EBS backend, up to 5 Gbps network"},
-    "t3a.nano"       : {"vcpu" :   2, "mem" :  0.5, "desc" :  "AMD EPYC, 6 credit minutes/hour, EBS backend, up to 5 Gbps network"},
-    "t3a.micro"      : {"vcpu" :   2, "mem" :    1, "desc" :  "AMD EPYC, 12 credit minutes/hour, EBS backend, up to 5 Gbps network"},
-    "t3a.small"      : {"vcpu" :   2, "mem" :    2, "desc" :  "AMD EPYC, 24 credit minutes/hour, EBS backend, up to 5 Gbps network"},
-    "t3a.medium"     : {"vcpu" :   2, "mem" :    4, "desc" :  "AMD EPYC, 24 credit minutes/hour, EBS backend, up to 5 Gbps network"},
-    "t3a.large"      : {"vcpu" :   2, "mem" :    8, "desc" :  "AMD EPYC, 36 credit minutes/hour, EBS backend, up to 5 Gbps network"},
-    "t3a.xlarge"     : {"vcpu" :   4, "mem" :   16, "desc" :  "AMD EPYC, 96 credit minutes/hour, EBS backend, up to 5 Gbps network"},
-    "t3a.2xlarge"    : {"vcpu" :   8, "mem" :   32, "desc" :  "AMD EPYC, 192 credit minutes/hour, EBS backend, up to 5 Gbps network"},
-    "m5.large"       : {"vcpu" :   2, "mem" :    8, "desc" :  "Up to 3,500Mbps EBS"},
-    "m5.xlarge"      : {"vcpu" :   4, "mem" :   16, "desc" :  "Up to 3,500Mbps EBS"},
-    "m5.2xlarge"     : {"vcpu" :   8, "mem" :   32, "desc" :  "Up to 3,500Mbps EBS"},
-    "m5.4xlarge"     : {"vcpu" :  16, "mem" :   64, "desc" :  "3,500Mbps EBS"},
-    "m5.12xlarge"    : {"vcpu" :  48, "mem" :  192, "desc" :  "7Gbps EBS"},
-    "m5.24xlarge"    : {"vcpu" :  96, "mem" :  384, "desc" :  "14Gbps EBS"},
-    "m5.metal"       : {"vcpu" :  96, "mem" :  384, "desc" :  "14Gbps EBS, 48 physical CPU cores, 96 threads"},
-    "m5d.large"      : {"vcpu" :   2, "mem" :    8, "desc" :  "1 x 75 NVMe SSD, Up to 3,500Mbps EBS"},
-    "m5d.xlarge"     : {"vcpu" :   4, "mem" :   16, "desc" :  "1 x 150 NVMe SSD, Up to 3,500Mbps EBS"},
-    "m5d.2xlarge"    : {"vcpu" :   8, "mem" :   32, "desc" :  "1 x 300 NVMe SSD, Up to 3,500Mbps EBS"},
-    "m5d.4xlarge"    : {"vcpu" :  16, "mem" :   64, "desc" :  "2 x 300 NVMe SSD, 3,500Mbps EBS"},
-    "m5d.12xlarge"   : {"vcpu" :  48, "mem" :  192, "desc" :  "2 x 900 NVMe SSD, 7Gbps EBS"},
-    "m5d.24xlarge"   : {"vcpu" :  96, "mem" :  384, "desc" :  "4 x 900 NVMe SSD, 14Gbps EBS"},
-    "m5d.metal"      : {"vcpu" :  96, "mem" :  384, "desc" :  "4 x 900 NVMe SSD, 14Gbps EBS, 48 physical CPU cores, 96 threads"},
-    "m5a.large"      : {"vcpu" :   2, "mem" :    8, "desc" :  "AMD EPYC, Up to 2,120Mbps EBS, up to 10Gbps network"},
-    "m5a.xlarge"     : {"vcpu" :   4, "mem" :   16, "desc" :  "AMD EPYC, Up to 2,120Mbps EBS, up to 10Gbps network"},
-    "m5a.2xlarge"    : {"vcpu" :   8, "mem" :   32, "desc" :  "AMD EPYC, Up to 2,120Mbps EBS, up to 10Gbps network"},
-    "m5a.4xlarge"    : {"vcpu" :  16, "mem" :   64, "desc" :  "AMD EPYC, 2,120Mbps EBS, up to 10Gbps network"},
-    "m5a.12xlarge"   : {"vcpu" :  48, "mem" :  192, "desc" :  "AMD EPYC, 5Gbps EBS, 10Gbps network"},
-    "m5a.24xlarge"   : {"vcpu" :  96, "mem" :  384, "desc" :  "AMD EPYC, 10Gbps EBS, 20Gbps network"},
-    "m4.large"       : {"vcpu" :   2, "mem" :    8, "desc" :  "450Mbps EBS, EBS backend"},
-    "m4.xlarge"      : {"vcpu" :   4, "mem" :   16, "desc" :  "750Mbps EBS, EBS backend"},
-    "m4.2xlarge"     : {"vcpu" :   8, "mem" :   32, "desc" :  "1Gbps EBS, EBS backend"},
-    "m4.4xlarge"     : {"vcpu" :  16, "mem" :   64, "desc" :  "2Gbps EBS, EBS backend"},
-    "m4.10xlarge"    : {"vcpu" :  40, "mem" :  160, "desc" :  "4Gbps EBS, EBS backend"},
-    "m4.16xlarge"    : {"vcpu" :  64, "mem" :  256, "desc" :  "10Gbps EBS, EBS backend"},
-    # "m3.medium"      : {"vcpu" :   1, "mem" : 3.75, "desc" :  "1x4GB SSD"},
-    # "m3.large"       : {"vcpu" :   2, "mem" :  7.5, "desc" :  "1x32GB SSD"},
-    # "m3.xlarge"      : {"vcpu" :   4, "mem" :   15, "desc" :  "2x40GB SSD"},
-    # "m3.2xlarge"     : {"vcpu" :   8, "mem" :   30, "desc" :  "2x80GB SSD"},
-    "c5.large"       : {"vcpu" :   2, "mem" :    4, "desc" :  "Up to 3,500Mbps EBS, EBS backend"},
-    "c5.xlarge"      : {"vcpu" :   4, "mem" :    8, "desc" :  "Up to 3,500Mbps EBS, EBS backend"},
-    "c5.2xlarge"     : {"vcpu" :   8, "mem" :   16, "desc" :  "Up to 3,500Mbps EBS, EBS backend"},
-    "c5.4xlarge"     : {"vcpu" :  16, "mem" :   32, "desc" :  "3,500Mbps EBS, EBS backend"},
-    "c5.8xlarge"     : {"vcpu" :  36, "mem" :   72, "desc" :  "7Gbps EBS, EBS backend"},
-    "c5.18xlarge"    : {"vcpu" :  72, "mem" :  144, "desc" :  "14Gbps EBS, EBS backend"},
-    "c5d.large"      : {"vcpu" :   2, "mem" :    4, "desc" :  "1 x 50G NVMe SSD, Up to 3,500Mbps EBS, EBS backend"},
-    "c5d.xlarge"     : {"vcpu" :   4, "mem" :    8, "desc" :  "1 x 100G NVMe SSD, Up to 3,500Mbps EBS, EBS backend"},
-    "c5d.2xlarge"    : {"vcpu" :   8, "mem" :   16, "desc" :  "1 x 200G NVMe SSD, Up to 3,500Mbps EBS, EBS backend"},
-    "c5d.4xlarge"    : {"vcpu" :  16, "mem" :   32, "desc" :  "1 x 400G NVMe SSD, 3,500Mbps EBS, EBS backend"},
-    "c5d.8xlarge"    : {"vcpu" :  36, "mem" :   72, "desc" :  "1 x 900G NVMe SSD, 7Gbps EBS, EBS backend"},
-    "c5d.18xlarge"   : {"vcpu" :  72, "mem" :  144, "desc" :  "2 x 900G NVMe SSD, 14Gbps EBS, EBS backend"},
-    "c5n.large"      : {"vcpu" :   2, "mem" : 5.25, "desc" :  "EBS backend, up to 3,500Mbps EBS, up to 25Gbps network"},
-    "c5n.xlarge"     : {"vcpu" :   4, "mem" : 10.5, "desc" :  "EBS backend, up to 3,500Mbps EBS, up to 25Gbps network"},
-    "c5n.2xlarge"    : {"vcpu" :   8, "mem" :   21, "desc" :  "EBS backend, up to 3,500Mbps EBS, up to 25Gbps network"},
-    "c5n.4xlarge"    : {"vcpu" :  16, "mem" :   42, "desc" :  "EBS backend, 3,500Mbps EBS, up to 25Gbps network"},
-    "c5n.9xlarge"    : {"vcpu" :  36, "mem" :   96, "desc" :  "EBS backend, 7Gbps EBS, 50Gbps network"},
-    "c5n.18xlarge"   : {"vcpu" :  72, "mem" :  192, "desc" :  "EBS backend, 14Gbps EBS, 100Gbps network"},
-    "c4.large"       : {"vcpu" :   2, "mem" : 3.75, "desc" :  "500Mbps EBS, EBS backend"},
-    "c4.xlarge"      : {"vcpu" :   4, "mem" :  7.5, "desc" :  "750Mbps EBS, EBS backend"},
-    "c4.2xlarge"     : {"vcpu" :   8, "mem" :   15, "desc" :  "1Gbps EBS, EBS backend"},
-    "c4.4xlarge"     : {"vcpu" :  16, "mem" :   30, "desc" :  "2Gbps EBS, EBS backend"},
-    "c4.8xlarge"     : {"vcpu" :  32, "mem" :   60, "desc" :  "4Gbps EBS, EBS backend"},
-    # "c2.large"       : {"vcpu" :   2, "mem" : 3.75, "desc" :  "2x16GB SSD"},
-    # "c3.xlarge"      : {"vcpu" :   4, "mem" :  7.5, "desc" :  "2x40GB SSD"},
-    # "c3.2xlarge"     : {"vcpu" :   8, "mem" :   15, "desc" :  "2x80GB SSD"},
-    # "c3.4xlarge"     : {"vcpu" :  16, "mem" :   30, "desc" :  "2x160GB SSD"},
-    # "c3.8xlarge"     : {"vcpu" :  32, "mem" :   60, "desc" :  "2x320GB SSD"},
-    "x1.16xlarge"    : {"vcpu" :  64, "mem" :  976, "desc" :  "1x1920GB SSD, 7Gbps EBS"},
-    "x1.32xlarge"    : {"vcpu" : 128, "mem" : 1952, "desc" :  "2x1920GB SSD, 14 EBS"},
-    "x1e.xlarge"     : {"vcpu" :   4, "mem" :  122, "desc" :  "1x120 SSD, 500Mbps EBS"},
-    "x1e.2xlarge"    : {"vcpu" :   8, "mem" :  244, "desc" :  "1x240 SSD, 1Gbps EBS"},
-    "x1e.4xlarge"    : {"vcpu" :  16, "mem" :  488, "desc" :  "1x480 SSD, 1.75Gbps EBS"},
-    "x1e.8xlarge"    : {"vcpu" :  32, "mem" :  976, "desc" :  "1x960 SSD, 3.5Gbps EBS"},
-    "x1e.16xlarge"   : {"vcpu" :  64, "mem" : 1952, "desc" :  "1x1920 SSD, 7Gbps EBS"},
-    "x1e.32xlarge"   : {"vcpu" : 128, "mem" : 3904, "desc" :  "2x1920 SSD, 14Gbps EBS"},
-    "r4.large"       : {"vcpu" :   2, "mem" : 15.25, "desc" :  "Up to 10Gbit network"},
-    "r4.xlarge"      : {"vcpu" :   4, "mem" : 30.5, "desc" :  "Up to 10Gbit network"},
-    "r4.2xlarge"     : {"vcpu" :   8, "mem" :   61, "desc" :  "Up to 10Gbit network"},
-    "r4.4xlarge"     : {"vcpu" :  16, "mem" :  122, "desc" :  "Up to 10Gbit network"},
-    "r4.8xlarge"     : {"vcpu" :  32, "mem" :  244, "desc" :  "10Gbit network"},
-    "r4.16xlarge"    : {"vcpu" :  64, "mem" :  488, "desc" :  "25Gbit network"},
-    # "r3.large"       : {"vcpu" :   2, "mem" : 15.25, "desc" :  "1x32GB SSD"},
-    # "r3.xlarge"      : {"vcpu" :   4, "mem" : 30.5, "desc" :  "1x80GB SSD"},
-    # "r3.2xlarge"     : {"vcpu" :   8, "mem" :   61, "desc" :  "1x160GB SSD"},
-    # "r3.4xlarge"     : {"vcpu" :  16, "mem" :  122, "desc" :  "1x320GB SSD"},
-    # "r3.8xlarge"     : {"vcpu" :  32, "mem" :  244, "desc" :  "2x320GB SSD"},
-    "g2.2xlarge"     : {"vcpu" :   8, "mem" :   15, "desc" :  "1 GPU (Kepler, GK104), 1x60GB SSD"},
-    "g2.8xlarge"     : {"vcpu" :  32, "mem" :   60, "desc" :  "4 GPUs (Kepler, GK104), 2x120GB SSD"},
-    "i3.large"       : {"vcpu" :   2, "mem" : 15.25, "desc" :  "1x0.475T NVMe SSD"},
-    "i3.xlarge"      : {"vcpu" :   4, "mem" : 30.5, "desc" :  "1x0.95T NVMe SSD"},
-    "i3.2xlarge"     : {"vcpu" :   8, "mem" :   61, "desc" :  "1x1.9T NVMe SSD"},
-    "i3.4xlarge"     : {"vcpu" :  16, "mem" :  122, "desc" :  "2x1.9T NVMe SSD"},
-    "i3.8xlarge"     : {"vcpu" :  32, "mem" :  244, "desc" :  "4x1.9T NVMe SSD"},
-    "i3.16xlarge"    : {"vcpu" :  64, "mem" :  488, "desc" :  "8x1.9T NVMe SSD"},
-    # "i2.xlarge"      : {"vcpu" :   4, "mem" : 30.5, "desc" :  "1x800GB SSD"},
-    # "i2.2xlarge"     : {"vcpu" :   8, "mem" :   61, "desc" :  "2x800GB SSD"},
-    # "i2.4xlarge"     : {"vcpu" :  16, "mem" :  122, "desc" :  "4x800GB SSD"},
-    # "i2.8xlarge"     : {"vcpu" :  32, "mem" :  244, "desc" :  "8x800GB SSD"},
-    "d2.xlarge"      : {"vcpu" :   4, "mem" : 30.5, "desc" :  "3x2TB HDD"},
-    "d2.2xlarge"     : {"vcpu" :   8, "mem" :   61, "desc" :  "6x2TB HDD"},
-    "d2.4xlarge"     : {"vcpu" :  16, "mem" :  122, "desc" :  "12x2TB HDD"},
-    "d2.8xlarge"     : {"vcpu" :  36, "mem" :  244, "desc" :  "24x2TB HDD"},
-    "p4.2xlarge"     : {"vcpu" :   8, "mem" :   61, "desc" :  "1 GPU (Tesla V100)"},
-    "p4.8xlarge"     : {"vcpu" :  32, "mem" :  244, "desc" :  "4 GPUs (Tesla V100, NVLink)"},
-    "p4.16xlarge"    : {"vcpu" :  64, "mem" :  388, "desc" :  "16 GPUs (Tesla V100, NVLink)"},
-    "p2.xlarge"      : {"vcpu" :   4, "mem" :   61, "desc" :  "1 GPU (K80)"},
-    "p2.8xlarge"     : {"vcpu" :  32, "mem" :  488, "desc" :  "4 GPUs (K80)"},
-    "p2.16xlarge"    : {"vcpu" :  64, "mem" :  732, "desc" :  "16 GPUs (K80)"},
-    "p3.2xlarge"     : {"vcpu" :   8, "mem" :   61, "desc" :  "1 GPU (Tesla V100, 16GB), EBS backend only, 1.5Gb EBS, up to 10 Gb network"},
-    "p3.8xlarge"     : {"vcpu" :  32, "mem" :  244, "desc" :  "4 GPU (Tesla V100, 64GB, NVLink), EBS backend only, 7Gb EBS, 10 Gb network"},
-    "p3.16xlarge"    : {"vcpu" :  64, "mem" :  488, "desc" :  "8 GPU (Tesla V100, 128GB, NVLink), EBS backend only, 14Gb EBS, 25 Gb network"},
-    "p3dn.24xlarge"  : {"vcpu" :  96, "mem" :  768, "desc" :  "8 GPU (Tesla V100, 256GB, NVLink), 2 x 900G NVMe, EBS backend only, 14Gb EBS, 100 Gb network"},
-    "h1.2xlarge"     : {"vcpu" :   8, "mem" :   32, "desc" :  "1x2000 HDD, up to 10 Gbps"},
-    "h1.4xlarge"     : {"vcpu" :  16, "mem" :   64, "desc" :  "2x2000 HDD, up to 10 Gbps"},
-    "h1.8xlarge"     : {"vcpu" :  32, "mem" :  128, "desc" :  "4x2000 HDD, 10 Gbps"},
-    "h1.16xlarge"    : {"vcpu" :  64, "mem" :  256, "desc" :  "8x2000 HDD, 25 Gbps"},
-    "a1.medium"      : {"vcpu" :   1, "mem" :    2, "desc" :  "ARM CPU, EBS backend only, up to 10 Gb network"},
-    "a1.large"       : {"vcpu" :   2, "mem" :    4, "desc" :  "ARM CPU, EBS backend only, up to 10 Gb network"},
-    "a1.xlarge"      : {"vcpu" :   4, "mem" :    8, "desc" :  "ARM CPU, EBS backend only, up to 10 Gb network"},
-    "a1.2xlarge"     : {"vcpu" :   8, "mem" :   16, "desc" :  "ARM CPU, EBS backend only, up to 10 Gb network"},
-    "a1.4xlarge"     : {"vcpu" :  16, "mem" :   32, "desc" :  "ARM CPU, EBS backend only, up to 10 Gb network"},
-}
+# ===================================
+#  INSTANCE TYPE CATALOG (per region)
+# ===================================
+# The specs of the instance types offered in a region are fetched by DescribeInstanceTypes
+# and kept in a local SQLite database (~/.taw/instance_types.sqlite3) for instance_type_catalog_ttl seconds.
+instance_type_catalog_ttl = 7 * 24 * 3600
+instance_type_catalog_columns = ['vcpu', 'mem', 'gpu', 'gpu_desc', 'gpu_mem', 'network', 'ebs', 'arch']
+instance_type_catalog_header = ['type', '#vcpu', 'mem (GiB)', '#GPU', 'GPU', 'network', 'EBS (Mbps)', 'arch']
+region_to_instance_type_catalog = {}  # region name -> catalog (loaded in this process)
+
+
+def get_instance_type_catalog_file_path():
+    return os.path.join(taw_cache_dir, "instance_types.sqlite3")
+
+
+def open_instance_type_catalog_db():
+    """ open the local catalog database (creating it if needed). Returns a sqlite3 connection """
+    if not os.path.exists(taw_cache_dir): os.mkdir(taw_cache_dir)
+    conn = sqlite3.connect(get_instance_type_catalog_file_path())
+    conn.execute("CREATE TABLE IF NOT EXISTS instance_types (region text, name text, vcpu integer, mem real, gpu integer, gpu_desc text," +
+                 " gpu_mem real, network text, ebs integer, arch text, PRIMARY KEY (region, name))")
+    conn.execute("CREATE TABLE IF NOT EXISTS instance_type_regions (region text primary key, fetched_at real)")
+    conn.execute("CREATE TABLE IF NOT EXISTS prices (region text, name text, market text, price real, PRIMARY KEY (region, market, name))")
+    conn.execute("CREATE TABLE IF NOT EXISTS price_regions (region text, market text, fetched_at real, PRIMARY KEY (region, market))")
+    conn.execute("CREATE TABLE IF NOT EXISTS price_catalog (region text, instance_type text, os text, tenancy text, price real," +
+                 " PRIMARY KEY (region, instance_type, os, tenancy)) WITHOUT ROWID")
+    conn.execute("CREATE TABLE IF NOT EXISTS resource_price_catalog (region text, resource text, unit text, price real," +
+                 " PRIMARY KEY (region, resource)) WITHOUT ROWID")
+    conn.execute("CREATE TABLE IF NOT EXISTS price_catalog_imports (region text primary key, source text, imported_at real)")
+    return conn
+
+
+def get_ec2_client_for_region(region_name):
+    """ returns the EC2 client of the current region if region_name is it, or a new client for region_name """
+    ec2 = get_ec2_client()
+    return ec2 if region_name == ec2.meta.region_name else boto3.client('ec2', region_name=region_name)
+
+
+def instance_type_spec_from_api(t):
+    """ convert an item of DescribeInstanceTypes to a spec in the catalog """
+    gpus = t.get('GpuInfo', {}).get('Gpus', [])
+    return {'vcpu'    : t['VCpuInfo']['DefaultVCpus'],
+            'mem'     : t['MemoryInfo']['SizeInMiB'] / 1024.0,
+            'gpu'     : sum([g.get('Count', 0) for g in gpus]),
+            'gpu_desc': ", ".join(["%d x %s %s" % (g.get('Count', 0), g.get('Manufacturer', ''), g.get('Name', '')) for g in gpus]),
+            'gpu_mem' : t.get('GpuInfo', {}).get('TotalGpuMemoryInMiB', 0) / 1024.0,
+            'network' : t.get('NetworkInfo', {}).get('NetworkPerformance', ''),
+            'ebs'     : t.get('EbsInfo', {}).get('EbsOptimizedInfo', {}).get('MaximumBandwidthInMbps', 0),
+            'arch'    : ",".join(t.get('ProcessorInfo', {}).get('SupportedArchitectures', []))}
+
+
+def fetch_instance_types(ec2):
+    """ fetch the specs of all instance types offered in the region of an EC2 client. Returns a catalog (instance type name -> spec) """
+    catalog = {}
+    for page in ec2.get_paginator('describe_instance_types').paginate(PaginationConfig={'PageSize': 100}):
+        for t in page['InstanceTypes']:
+            catalog[t['InstanceType']] = instance_type_spec_from_api(t)
+    return catalog
+
+
+def refresh_instance_type_catalogs(region_names):
+    """ fetch the catalogs of regions concurrently (a thread per region) and store them to the local database.
+        Returns a dictionary (region name -> catalog) of the regions that could be fetched (the others are warned).
+    """
+    import concurrent.futures
+    import botocore.exceptions
+    fetched = {}
+    # clients are created here because creating them (unlike using them) is not thread-safe
+    clients = [get_ec2_client_for_region(r) for r in region_names]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(16, len(region_names)))) as executor:
+        future_to_region = dict([(executor.submit(fetch_instance_types, c), r) for c, r in zip(clients, region_names)])
+        for future in concurrent.futures.as_completed(future_to_region):
+            try:
+                fetched[future_to_region[future]] = future.result()
+            except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+                print_warning("Could not fetch the instance types in %s: %s" % (future_to_region[future], e))
+    if len(fetched) <= 0: return fetched
+    conn = open_instance_type_catalog_db()
+    with conn:
+        for region_name, catalog in six.iteritems(fetched):
+            conn.execute("DELETE FROM instance_types WHERE region = ?", (region_name,))
+            conn.executemany("INSERT INTO instance_types VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             [(region_name, name) + tuple([spec[c] for c in instance_type_catalog_columns]) for name, spec in six.iteritems(catalog)])
+            conn.execute("INSERT OR REPLACE INTO instance_type_regions VALUES (?, ?)", (region_name, time.time()))
+    conn.close()
+    region_to_instance_type_catalog.update(fetched)
+    return fetched
+
+
+def get_instance_type_catalog(region_name=None, refresh=False):
+    """ returns the catalog (a dictionary: instance type name -> spec) of a region (the current region by default).
+        A spec has vcpu, mem (GiB), gpu (# of GPUs), gpu_desc, gpu_mem (GiB), network, ebs (max. bandwidth in Mbps)
+        and arch (comma-separated). The local copy is used unless it is older than instance_type_catalog_ttl.
+        If the catalog cannot be fetched, the stale copy (or an empty catalog if there is none) is returned.
+    """
+    region_name = region_name or get_ec2_client().meta.region_name
+    if not refresh and region_name in region_to_instance_type_catalog: return region_to_instance_type_catalog[region_name]
+    conn = open_instance_type_catalog_db()
+    row = conn.execute("SELECT fetched_at FROM instance_type_regions WHERE region = ?", (region_name,)).fetchone()
+    catalog = dict([(r[0], dict(zip(instance_type_catalog_columns, r[1:])))
+                    for r in conn.execute("SELECT name, %s FROM instance_types WHERE region = ?" % ", ".join(instance_type_catalog_columns), (region_name,))])
+    conn.close()
+    if refresh or row is None or row[0] + instance_type_catalog_ttl < time.time():
+        fetched = refresh_instance_type_catalogs([region_name])
+        if region_name in fetched: return fetched[region_name]
+        if row is not None: print_warning("Using the instance types in %s cached at %s" % (region_name, time.strftime('%Y-%m-%d %H:%M', time.localtime(row[0]))))
+    region_to_instance_type_catalog[region_name] = catalog
+    return catalog
+
+
+def sorted_instance_type_names(catalog, prefix=''):
+    """ returns the names of instance types in a catalog that start with prefix, sorted by family and size """
+    names = [n for n in catalog.keys() if n.startswith(prefix)]
+    return sorted(names, key=lambda n: (n.split('.')[0], catalog[n]['vcpu'], catalog[n]['mem'], n))
+
+
+def instance_type_catalog_row(name, spec):
+    """ returns a row of instance_type_catalog_header for an instance type """
+    return [name, spec['vcpu'], "%g" % spec['mem'], spec['gpu'] or '', spec['gpu_desc'], spec['network'], spec['ebs'] or '', spec['arch']]
+
+
+# Prices (USD per hour of Linux instances with shared tenancy) are kept in the same database.
+# On-demand prices come from the Price List API, and spot prices from the spot price history (the lowest among AZs).
+instance_price_ttls = {'on-demand': 7 * 24 * 3600, 'spot': 3600}
+hours_per_month = 730.0  # AWS prices a month as 730 hours (eg, EBS volumes per GB-month)
+region_and_market_to_prices = {}  # (region name, market) -> prices (loaded in this process)
+
+
+def fetch_on_demand_prices(region_name):
+    """ fetch the on-demand prices in a region from the Price List API. Returns a dictionary (instance type name -> USD per hour) """
+    pricing = boto3.client('pricing', region_name='us-east-1')  # the Price List API is served in a few regions only
+    filters = [{'Type': 'TERM_MATCH', 'Field': k, 'Value': v} for k, v in [
+        ('regionCode', region_name), ('operatingSystem', 'Linux'), ('tenancy', 'Shared'),
+        ('preInstalledSw', 'NA'), ('capacitystatus', 'Used'), ('licenseModel', 'No License required')]]
+    prices = {}
+    for page in pricing.get_paginator('get_products').paginate(ServiceCode='AmazonEC2', Filters=filters, PaginationConfig={'PageSize': 100}):
+        for item in page['PriceList']:
+            product = json.loads(item) if isinstance(item, six.string_types) else item
+            name = product['product']['attributes'].get('instanceType')
+            for term in product.get('terms', {}).get('OnDemand', {}).values():
+                for dimension in term['priceDimensions'].values():
+                    usd = float(dimension['pricePerUnit'].get('USD', 0))
+                    if name is not None and 0 < usd: prices[name] = usd
+    return prices
+
+
+def fetch_spot_prices(region_name):
+    """ fetch the current spot prices in a region. Returns a dictionary (instance type name -> USD per hour in the cheapest AZ) """
+    ec2 = get_ec2_client_for_region(region_name)
+    prices = {}
+    for page in ec2.get_paginator('describe_spot_price_history').paginate(ProductDescriptions=['Linux/UNIX'], StartTime=datetime.datetime.utcnow(),
+                                                                          PaginationConfig={'PageSize': 1000}):
+        for p in page['SpotPriceHistory']:
+            price = float(p['SpotPrice'])
+            if p['InstanceType'] not in prices or price < prices[p['InstanceType']]: prices[p['InstanceType']] = price
+    return prices
+
+
+def get_instance_type_prices(region_name=None, market='on-demand', refresh=False):
+    """ returns the prices (a dictionary: instance type name -> USD per hour) of a market ('on-demand' or 'spot') in a region.
+        The local copy is used unless it is older than instance_price_ttls[market].
+        If the prices cannot be fetched, the stale copy (or an empty dictionary if there is none) is returned.
+    """
+    import botocore.exceptions
+    region_name = region_name or get_ec2_client().meta.region_name
+    if not refresh and (region_name, market) in region_and_market_to_prices: return region_and_market_to_prices[(region_name, market)]
+    if market == 'on-demand' and not refresh:
+        prices = get_price_catalog_prices(region_name)  # an imported price catalog needs no API calls
+        if 0 < len(prices):
+            region_and_market_to_prices[(region_name, market)] = prices
+            return prices
+    conn = open_instance_type_catalog_db()
+    row = conn.execute("SELECT fetched_at FROM price_regions WHERE region = ? AND market = ?", (region_name, market)).fetchone()
+    if refresh or row is None or row[0] + instance_price_ttls[market] < time.time():
+        try:
+            prices = (fetch_spot_prices if market == 'spot' else fetch_on_demand_prices)(region_name)
+            with conn:
+                conn.execute("DELETE FROM prices WHERE region = ? AND market = ?", (region_name, market))
+                conn.executemany("INSERT INTO prices VALUES (?, ?, ?, ?)", [(region_name, k, market, v) for k, v in six.iteritems(prices)])
+                conn.execute("INSERT OR REPLACE INTO price_regions VALUES (?, ?, ?)", (region_name, market, time.time()))
+        except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+            print_warning("Could not fetch the %s prices in %s: %s" % (market, region_name, e))
+    prices = dict(conn.execute("SELECT name, price FROM prices WHERE region = ? AND market = ?", (region_name, market)).fetchall())
+    conn.close()
+    region_and_market_to_prices[(region_name, market)] = prices
+    return prices
+
+
+# The offline price catalog is imported from the Price List bulk JSON files (an offer file of EC2 for a region)
+# and gives the on-demand prices by region, instance type, OS and tenancy.
+price_list_bulk_url_format = 'https://pricing.us-east-1.amazonaws.com/offers/v1.0/aws/AmazonEC2/current/%s/index.json'
+price_catalog_product_families = ['Compute Instance', 'Compute Instance (bare metal)']
+platform_details_to_price_list_os = {
+        'Linux/UNIX'              : 'Linux',
+        'Red Hat Enterprise Linux': 'RHEL',
+        'SUSE Linux'              : 'SUSE',
+        'Windows'                 : 'Windows',
+        'Ubuntu Pro'              : 'Ubuntu Pro',
+    }
+instance_tenancy_to_price_list_tenancy = {'default': 'Shared', 'dedicated': 'Dedicated', 'host': 'Host'}
+
+
+class JSONStreamReader(object):
+    """ reads a JSON document from a file incrementally.
+        The members of an object are visited one by one (members), and each value is decoded (value) or skipped (skip),
+        so only one member is held in memory at a time.
+    """
+
+    def __init__(self, f, chunk_size=1 << 20):
+        import codecs
+        self.f = f
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """ read the next chunk (at least as large as the unread text, so that a long value is read in a few rounds) """
+        if self.eof: return
+        data = self.f.read(max(self.chunk_size, len(self.buf) - self.pos))
+        if not data: self.eof = True
+        text = self.text_decoder.decode(data, final=self.eof) if isinstance(data, bytes) else data
+        self.buf = self.buf[self.pos:] + text
+        self.pos = 0
+
+    spaces = re.compile(r'[ \t\r\n]*')
+
+    def peek(self):
+        """ returns the next non-space character """
+        while True:
+            self.pos = self.spaces.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf): return self.buf[self.pos]
+            if self.eof: raise ValueError("Unexpected end of the JSON document")
+            self.fill()
+
+    def expect(self, c):
+        if self.peek() != c: raise ValueError("'%s' is expected but '%s' is found in the JSON document" % (c, self.peek()))
+        self.pos += 1
+
+    def value(self):
+        """ decode the next value """
+        self.peek()
+        while True:
+            try:
+                v, end = self.decoder.raw_decode(self.buf, self.pos)
+                if end < len(self.buf) or self.eof:  # a number at the end of the buffer may continue in the next chunk
+                    self.pos = end
+                    return v
+            except ValueError:
+                if self.eof: raise
+            self.fill()
+
+    def skip(self):
+        """ skip the next value (an object is skipped member by member) """
+        if self.peek() != '{': return self.value()
+        for _ in self.members(): self.value()
+
+    def members(self):
+        """ yields the keys of the next object. The value of each key must be read by value, skip or members before the next key. """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            c = self.peek()
+            self.pos += 1
+            if c == '}': return
+            if c != ',': raise ValueError("',' or '}' is expected but '%s' is found in the JSON document" % c)
+
+
+def stream_price_list_items(f):
+    """ yields ('product', SKU, product) and ('term', SKU, on-demand terms) from a Price List bulk JSON file.
+        The file is read incrementally (see JSONStreamReader), so a file of hundreds of MB is not loaded at once.
+    """
+    reader = JSONStreamReader(f)
+    for key in reader.members():
+        if key == 'products':
+            for sku in reader.members(): yield 'product', sku, reader.value()
+        elif key == 'terms':
+            for term_type in reader.members():
+                if term_type != 'OnDemand':
+                    reader.skip()
+                    continue
+                for sku in reader.members(): yield 'term', sku, reader.value()
+        else:
+            reader.skip()
+
+
+def price_list_resource_of_product(product):
+    """ returns (resource, unit) for the products of EBS volumes and public IPv4 addresses in a Price List, or None.
+        A resource is 'volume:<volume type>' (USD per GB-month) or 'address:idle'/'address:in-use' (USD per hour).
+    """
+    a = product.get('attributes', {})
+    if product.get('productFamily') == 'Storage' and 'volumeApiName' in a: return 'volume:' + a['volumeApiName'], 'GB-Mo'
+    if product.get('productFamily') == 'IP Address':
+        if a.get('usagetype', '').endswith('IdleAddress'): return 'address:idle', 'Hrs'
+        if a.get('usagetype', '').endswith('InUseAddress'): return 'address:in-use', 'Hrs'
+    return None
+
+
+def price_catalog_rows_from_price_list(f, default_region_name=None):
+    """ extract the on-demand prices of instances, EBS volumes and public IPv4 addresses from a Price List bulk JSON file.
+        Returns (a dictionary ((region, instance type, OS, tenancy) -> USD per hour),
+                 a dictionary ((region, resource) -> (unit, USD per unit)); see price_list_resource_of_product)
+    """
+    sku_to_key = {}
+    sku_to_resource = {}
+    sku_to_unit_prices = {}  # SKU -> {unit: USD per unit}
+    for kind, sku, item in stream_price_list_items(f):
+        if kind == 'product':
+            a = item.get('attributes', {})
+            region_name = a.get('regionCode', default_region_name)
+            if region_name is None: continue
+            resource = price_list_resource_of_product(item)
+            if resource is not None: sku_to_resource[sku] = (region_name,) + resource
+            if item.get('productFamily') not in price_catalog_product_families or 'instanceType' not in a: continue
+            if a.get('preInstalledSw', 'NA') != 'NA' or a.get('capacitystatus', 'Used') != 'Used': continue
+            if a.get('licenseModel', 'No License required') != 'No License required': continue
+            sku_to_key[sku] = (region_name, a['instanceType'], a.get('operatingSystem', 'Linux'), a.get('tenancy', 'Shared'))
+        else:
+            unit_prices = {}
+            for term in item.values():
+                for dimension in term.get('priceDimensions', {}).values():
+                    usd = float(dimension.get('pricePerUnit', {}).get('USD', 0))
+                    if 0 < usd: unit_prices[dimension.get('unit')] = max(usd, unit_prices.get(dimension.get('unit'), 0))  # not a free tier
+            if 0 < len(unit_prices): sku_to_unit_prices[sku] = unit_prices
+    key_to_price = {}
+    for sku, key in six.iteritems(sku_to_key):
+        price = sku_to_unit_prices.get(sku, {}).get('Hrs')
+        if price is not None and (key not in key_to_price or price < key_to_price[key]): key_to_price[key] = price
+    resource_key_to_price = {}
+    for sku, (region_name, resource, unit) in six.iteritems(sku_to_resource):
+        price = sku_to_unit_prices.get(sku, {}).get(unit)
+        if price is not None: resource_key_to_price[(region_name, resource)] = (unit, price)
+    return key_to_price, resource_key_to_price
+
+
+def import_price_catalog(source=None):
+    """ import a Price List bulk JSON file (a path or a URL) to the offline price catalog.
+        If source is None, the offer file for the current region is downloaded.
+        The prices of the regions in the file replace the old ones. Returns (# of prices, the list of regions).
+    """
+    region_name = None
+    if source is None:
+        region_name = get_ec2_client().meta.region_name
+        source = price_list_bulk_url_format % region_name
+    else:
+        m = re.search(r'/AmazonEC2/[^/]+/([a-z0-9-]+)/index\.json$', source)
+        if m: region_name = m.group(1)
+    if re.match(r'^https?://', source):
+        from six.moves.urllib.request import urlopen
+        f = urlopen(source)
+    else:
+        f = open(os.path.expanduser(source), 'rb')
+    try:
+        key_to_price, resource_key_to_price = price_catalog_rows_from_price_list(f, region_name)
+    finally:
+        f.close()
+    regions = sorted(set([k[0] for k in key_to_price.keys()]))
+    conn = open_instance_type_catalog_db()
+    with conn:
+        for r in regions:
+            conn.execute("DELETE FROM price_catalog WHERE region = ?", (r,))
+            conn.execute("DELETE FROM resource_price_catalog WHERE region = ?", (r,))
+            conn.execute("INSERT OR REPLACE INTO price_catalog_imports VALUES (?, ?, ?)", (r, source, time.time()))
+        conn.executemany("INSERT INTO price_catalog VALUES (?, ?, ?, ?, ?)", [k + (v,) for k, v in six.iteritems(key_to_price)])
+        conn.executemany("INSERT INTO resource_price_catalog VALUES (?, ?, ?, ?)",
+                         [k + v for k, v in six.iteritems(resource_key_to_price) if k[0] in regions])
+    conn.close()
+    for r in regions: region_and_market_to_prices.pop((r, 'on-demand'), None)
+    return len(key_to_price), regions
+
+
+def query_price_catalog(region_pattern, type_patterns=[], os_name='Linux', tenancy='Shared'):
+    """ returns the list of (region, instance type, OS, tenancy, USD per hour) in the offline price catalog.
+        region_pattern and type_patterns are globs (types match if any of the patterns matches); os_name/tenancy of None match any.
+    """
+    sql = "SELECT region, instance_type, os, tenancy, price FROM price_catalog WHERE region GLOB ?"
+    args = [region_pattern]
+    if 0 < len(type_patterns):
+        sql += " AND (" + " OR ".join(["instance_type GLOB ?"] * len(type_patterns)) + ")"
+        args += list(type_patterns)
+    if os_name is not None:
+        sql += " AND os = ?"
+        args.append(os_name)
+    if tenancy is not None:
+        sql += " AND tenancy = ?"
+        args.append(tenancy)
+    sql += " ORDER BY region, substr(instance_type, 1, instr(instance_type, '.') - 1), price, instance_type, os, tenancy"
+    conn = open_instance_type_catalog_db()
+    rows = conn.execute(sql, args).fetchall()
+    conn.close()
+    return rows
+
+
+def get_resource_price_catalog():
+    """ returns the prices of EBS volumes and public IPv4 addresses in the offline price catalog:
+        a dictionary ((region, resource) -> USD per unit); see price_list_resource_of_product for resources and units
+    """
+    conn = open_instance_type_catalog_db()
+    prices = dict([((r[0], r[1]), r[2]) for r in conn.execute("SELECT region, resource, price FROM resource_price_catalog")])
+    conn.close()
+    return prices
+
+
+def get_price_catalog_prices(region_name, os_name='Linux', tenancy='Shared'):
+    """ returns the prices (a dictionary: instance type name -> USD per hour) of a region in the offline price catalog """
+    return dict([(r[1], r[4]) for r in query_price_catalog(region_name, [], os_name, tenancy)])
+
+
+def get_local_instance_prices(region_pattern='*'):
+    """ returns a dictionary ((region, instance type, OS, tenancy) -> USD per hour) from local data only:
+        the offline price catalog, or else (for the regions it does not have) the Linux prices cached by 'taw instance types'
+    """
+    key_to_price = dict([(r[:4], r[4]) for r in query_price_catalog(region_pattern, [], None, None)])
+    catalog_regions = set([k[0] for k in key_to_price.keys()])
+    conn = open_instance_type_catalog_db()
+    for region_name, name, price in conn.execute("SELECT region, name, price FROM prices WHERE region GLOB ? AND market = 'on-demand'", (region_pattern,)):
+        if region_name not in catalog_regions: key_to_price[(region_name, name, 'Linux', 'Shared')] = price
+    conn.close()
+    return key_to_price
+
+
+def price_list_key_of_instance(region_name, instance_type, platform_details, platform, tenancy):
+    """ returns the key of get_local_instance_prices for an instance.
+        platform_details, platform and tenancy are those of DescribeInstances (eg, 'Linux/UNIX', None and 'default').
+    """
+    os_name = platform_details_to_price_list_os.get(platform_details or 'Linux/UNIX', 'Linux')
+    if (platform or '').lower() == 'windows': os_name = 'Windows'
+    return (region_name, instance_type, os_name, instance_tenancy_to_price_list_tenancy.get(tenancy or 'default', 'Shared'))
+
+
+def get_instance_hourly_price_function(region_name=None):
+    """ returns a function that gives the on-demand price (USD per hour) of an instance (a boto3 resource or a dict of DescribeInstances) or None.
+        Only local data is used (see get_local_instance_prices).
+    """
+    region_name = region_name or get_ec2_client().meta.region_name
+    key_to_price = get_local_instance_prices(region_name)
+
+    def price_of_instance(instance):
+        if isinstance(instance, dict):
+            return key_to_price.get(price_list_key_of_instance(region_name, instance['InstanceType'], instance.get('PlatformDetails'),
+                                                               instance.get('Platform'), instance.get('Placement', {}).get('Tenancy')))
+        return key_to_price.get(price_list_key_of_instance(region_name, instance.instance_type, getattr(instance, 'platform_details', None),
+                                                           instance.platform, (instance.placement or {}).get('Tenancy')))
+    return price_of_instance
+
+
+def query_instance_types(region_name=None, prefix='', min_vcpu=0, min_mem=0, gpu=False, arch=None, max_price=None, market='on-demand', rank='vcpu'):
+    """ find the instance types in a region that meet constraints with a query of the local catalog joined with the prices.
+        max_price (USD per hour) and rank apply to the prices of market ('on-demand' or 'spot'); types without a price are excluded by max_price.
+        rank is one of 'vcpu' (cost per vCPU), 'mem' (cost per GiB), 'price' and 'name' (family and size); types without a price come last.
+        The catalog and the prices must have been loaded (by get_instance_type_catalog and get_instance_type_prices).
+        Returns the list of (instance type name, spec, on-demand price or None, spot price or None).
+    """
+    region_name = region_name or get_ec2_client().meta.region_name
+    price = 'sp.price' if market == 'spot' else 'od.price'
+    order_by = "substr(t.name, 1, instr(t.name, '.') - 1), t.vcpu, t.mem, t.name"  # by family and size (like sorted_instance_type_names)
+    if rank != 'name':
+        order_by = "(%s IS NULL), %s, " % (price, {'vcpu': price + " / t.vcpu", 'mem': price + " / t.mem", 'price': price}[rank]) + order_by
+    sql = ("SELECT t.name, %s, od.price, sp.price FROM instance_types t" % ", ".join(["t." + c for c in instance_type_catalog_columns]) +
+           " LEFT JOIN prices od ON od.region = t.region AND od.market = 'on-demand' AND od.name = t.name" +
+           " LEFT JOIN prices sp ON sp.region = t.region AND sp.market = 'spot' AND sp.name = t.name" +
+           " WHERE t.region = ? AND substr(t.name, 1, length(?)) = ? AND ? <= t.vcpu AND ? <= t.mem AND ? <= t.gpu" +
+           " AND (? IS NULL OR (',' || t.arch || ',') LIKE ('%%,' || ? || ',%%'))" +
+           " AND (? IS NULL OR %s <= ?)" % price +
+           " ORDER BY " + order_by)
+    conn = open_instance_type_catalog_db()
+    rows = conn.execute(sql, (region_name, prefix, prefix, min_vcpu, min_mem, 1 if gpu else 0,
+                              arch, arch, max_price, max_price)).fetchall()
+    conn.close()
+    return [(r[0], dict(zip(instance_type_catalog_columns, r[1:-2])), r[-2], r[-1]) for r in rows]
 
 trusted_ami_owners = [
     'amazon',         # Amazon, of course
@@ -514,7 +878,149 @@ def multicolumn_tabulate(rows, header, coloring):
     return "\n".join(lines)
 
 
-def output_table(params, header, data, coloring=None):
+def select_list_columns(all_list_columns, verbose, attr, raw_column=None):
+    """ returns the columns to show out of all_list_columns, the list of (shown by default, attribute, header, function[, needs]).
+        needs is a tuple of the names of the data other than the listed items (eg, ('subnets',)) that the column needs;
+        a lister fetches only the data that the shown columns need (see data_needed_by_list_columns).
+        If attribute names are given (by --attr), only they are shown (a projection). A name is matched with the headers
+        (case-insensitive) and then the attributes (ignoring '_' and the case) of the columns; the other names are shown
+        as they are (raw_column(name) gives the column of such a name if raw_column is given).
+        Otherwise the default columns (or all of them if verbose) are shown.
+    """
+    if not attr: return [c for c in all_list_columns if verbose or c[0]]
+    normalize = lambda s: s.replace('_', '').lower()
+    list_columns = []
+    for v in attr:
+        matched = ([c for c in all_list_columns if c[2].lower() == v.lower()] +
+                   [c for c in all_list_columns if c[1] is not None and normalize(c[1]) == normalize(v)])
+        list_columns.append(matched[0] if matched else (raw_column(v) if raw_column else (True, v, v, ident)))
+    return list_columns
+
+
+def data_needed_by_list_columns(list_columns):
+    """ returns the set of the names of the data that columns need (see select_list_columns) """
+    return set([n for c in list_columns for n in (c[4] if 4 < len(c) else ())])
+
+
+def describe_each(method, result_key, page_size=None, **kwargs):
+    """ yields the items of a paginated EC2 describe operation page by page; the next page is requested only when it is needed """
+    ec2_client = get_ec2_client()
+    if page_size: kwargs['PaginationConfig'] = {'PageSize': page_size}
+    for page in ec2_client.get_paginator(method).paginate(**kwargs):
+        for item in page[result_key]: yield item
+
+
+def describe_all(method, result_key, **kwargs):
+    """ returns all the items of a paginated EC2 describe operation (eg, describe_all('describe_volumes', 'Volumes')) """
+    return list(describe_each(method, result_key, **kwargs))
+
+
+# ===========================
+#  SORT, GROUP-BY AND LIMIT
+# ===========================
+def output_row_limit(params):
+    """ returns N of --limit if rows can be cut at N as they are produced (without --sort and --group-by), or None.
+        A lister can request smaller pages then, and output_table stops consuming rows (and thus pages) at N.
+    """
+    if params.output_sort or params.output_group_by: return None
+    return params.output_limit
+
+
+def find_column_index(header, name, purpose):
+    """ returns the index of a column by a name (a header; case, spaces and '_' are ignored) """
+    normalize = lambda s: re.sub(r'[\s_]', '', s).lower()
+    for i, h in enumerate(header):
+        if normalize(h) == normalize(name): return i
+    error_exit("No column '%s' to %s. Columns are: %s" % (name, purpose, ", ".join(header)))
+
+
+def cell_to_str(v):
+    """ returns the string of a cell (a list of values is joined) """
+    if v is None: return ''
+    if isinstance(v, (list, tuple)): return ", ".join([cell_to_str(x) for x in v])
+    return str(v)
+
+
+def cell_to_number(v):
+    """ returns the number of a cell, or None if it is not a number """
+    if isinstance(v, bool) or v is None or isinstance(v, (list, tuple)): return None
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def sort_key_of_cell(v):
+    """ numbers come first in the numeric order, then strings, then empty cells """
+    n = cell_to_number(v)
+    if n is not None: return (0, n, '')
+    s = cell_to_str(v)
+    return (1 if s else 2, 0, s)
+
+
+def group_rows(header, rows, column_name):
+    """ returns (header, rows) of the groups of rows by a column, with the numbers of the rows and the sums of the numeric columns """
+    ci = find_column_index(header, column_name, 'group by')
+    groups = {}
+    for row in rows: groups.setdefault(cell_to_str(row[ci]), []).append(row)
+    numeric_columns = [i for i in range(len(header))
+                       if i != ci and any([cell_to_str(r[i]) for r in rows])
+                       and all([cell_to_number(r[i]) is not None for r in rows if cell_to_str(r[i])])]
+
+    def sum_str(rs, i):
+        ns = [cell_to_number(r[i]) for r in rs if cell_to_str(r[i])]
+        if all([float(n).is_integer() for n in ns]) and all(['.' not in cell_to_str(r[i]) for r in rs]): return int(sum(ns))
+        return "%.4f" % sum(ns)
+    new_header = [header[ci], 'Count'] + ['Sum of ' + header[i] for i in numeric_columns]
+    return new_header, [[g, len(rs)] + [sum_str(rs, i) for i in numeric_columns] for g, rs in sorted(groups.items())]
+
+
+def arrange_rows(params, header, data, coloring):
+    """ apply --group-by, --sort and --limit (global options) to rows in this order.
+        Returns (header, rows, coloring); coloring is dropped for groups because it is for the original rows.
+    """
+    if params.output_group_by:
+        header, data = group_rows(header, list(data), params.output_group_by)
+        coloring = None
+    if params.output_sort:
+        data = list(data)
+        for name in reversed(params.output_sort.split(',')):  # the sort is stable, so the first key is sorted last
+            descending = name.startswith('-')
+            ci = find_column_index(header, name.lstrip('-'), 'sort by')
+            data.sort(key=lambda row: sort_key_of_cell(row[ci]), reverse=descending)
+    if params.output_limit is not None:
+        data = itertools.islice(data, params.output_limit)  # a generator of rows is not consumed (nor paginated) further
+    return header, list(data), coloring
+
+
+def redraw_changed_lines(lines, previous_lines):
+    """ draw lines on the terminal screen from the top, rewriting only the lines that differ from previous_lines
+        (the lines drawn last time, or None to clear the screen first). Lines beyond the screen height are cut.
+        Returns the lines drawn, which are given as previous_lines next time.
+    """
+    import shutil
+    height = shutil.get_terminal_size((80, 24)).lines
+    if height - 1 < len(lines): lines = lines[:height - 2] + ["... %d more line(s)" % (len(lines) - height + 2)]
+    out = [] if previous_lines is not None else ["\x1b[?7l\x1b[2J"]  # no wrapping of long lines, which would shift the lines below
+    for i, line in enumerate(lines):
+        if previous_lines is None or len(previous_lines) <= i or previous_lines[i] != line:
+            out.append("\x1b[%d;1H%s\x1b[K" % (i + 1, line))
+    if previous_lines is not None and len(lines) < len(previous_lines):
+        out.append("\x1b[%d;1H\x1b[J" % (len(lines) + 1))  # erase the rest
+    out.append("\x1b[%d;1H" % (len(lines) + 1))
+    sys.stdout.write("".join(out))
+    sys.stdout.flush()
+    return lines
+
+
+def end_redrawing():
+    """ restore the terminal after redraw_changed_lines """
+    sys.stdout.write("\x1b[?7h\n")
+    sys.stdout.flush()
+
+
+@profiled_phase('render')
+def output_table(params, header, data, coloring=None, footer_rows=[]):
     """ output data in a table format.
 
         The acceptable format (which is given by params.output_format) is one of these:
@@ -524,7 +1030,9 @@ def output_table(params, header, data, coloring=None):
             html, latex, latex_booktabs, textile
 
         header is the list of header columns given by strings.
-        data is the list of rows, each of which is the list of columns of type string.
+        data is the list (or an iterable) of rows, each of which is the list of columns of type string.
+        Rows are grouped, sorted and limited by the global options (--group-by, --sort and --limit; see arrange_rows).
+        footer_rows (eg, a total) are appended after that as they are, or dropped if the rows are grouped (the columns differ).
         coloring is None if coloring is not needed.
             Otherwise it is the list of functions. Each function in the list takes
             one row (the list of columns) as an argument and returns either None or
@@ -543,6 +1051,8 @@ def output_table(params, header, data, coloring=None):
                     return {-1: 'red'}
                 return None
     """
+    header, data, coloring = arrange_rows(params, header, data, coloring)
+    if not params.output_group_by: data += list(footer_rows)
     format = params.output_format
     if format == 'csv' or format == 'tsv':
         import csv
@@ -612,18 +1122,133 @@ def extract_name_from_tags(cs, default_no_name="NO NAME"):
     return default_no_name
 
 
+# ====================
+#  FILTER EXPRESSIONS
+# ====================
+# Listers take filter terms such as 'state=running', 'name~web-*' and 'type!=t2.*' (all of them must hold):
+#   KEY=V1,V2   a value matches V1 or V2 ('*' and '?' are wildcards)
+#   KEY!=V1,V2  a value matches neither V1 nor V2
+#   KEY~V       a value contains V, or matches V if V has wildcards (case-insensitive)
+# KEY=... on a key that has an EC2 filter name is sent to EC2 (Filters); the other terms are evaluated locally.
+filter_term_regex = re.compile(r'^(tag:[^=!~]+|[A-Za-z_][\w.-]*)(!=|=|~)(.*)$')
+
+
+def split_filter_terms(args):
+    """ split command line arguments into (filter terms, the other arguments) """
+    return [a for a in args if filter_term_regex.match(a)], [a for a in args if not filter_term_regex.match(a)]
+
+
+def filter_terms_of(args):
+    """ returns the filter terms in the arguments of a lister that takes nothing else """
+    filter_terms, other_args = split_filter_terms(args)
+    if other_args: error_exit("Filter terms must be KEY=VALUE, KEY!=VALUE or KEY~VALUE ('%s')" % other_args[0])
+    return filter_terms
+
+
+def tags_of_item(item):
+    """ returns the tags (a dictionary) of a boto3 resource or of a dict of an API response """
+    tags = item.get('Tags') if isinstance(item, dict) else getattr(item, 'tags', None)
+    return dict([(t['Key'], t['Value']) for t in tags or []])
+
+
+class ResourceFilter(object):
+    """ a filter expression (a list of terms; see above) on the items of a lister.
+        fields is a dictionary (key -> (EC2 filter name or None, function: item -> a value or a list of values, or None)).
+        Keys 'tag:KEY' can always be used. If pushdown is False, nothing is sent to EC2 (eg, for S3 objects).
+    """
+
+    def __init__(self, terms, fields, pushdown=True):
+        self.terms = []  # [(key, operator, values, EC2 filter name, getter, evaluated by EC2)]
+        for t in terms:
+            key, op, value = filter_term_regex.match(t).groups()
+            if key.startswith('tag:'):
+                server_name, getter = key, (lambda k: lambda item: tags_of_item(item).get(k))(key[4:])
+            elif key in fields:
+                server_name, getter = fields[key]
+            else:
+                error_exit("Unknown filter key '%s'. Available keys are: %s, tag:KEY" % (key, ", ".join(sorted(fields.keys()))))
+            pushed = pushdown and op == '=' and server_name is not None
+            if getter is None and not pushed: error_exit("Filter key '%s' supports only '='" % key)
+            self.terms.append((key, op, [value] if op == '~' else value.split(','), server_name, getter, pushed))
+
+    def __len__(self):
+        return len(self.terms)
+
+    def ec2_filters(self):
+        """ returns the EC2 Filters of the terms that EC2 evaluates """
+        return [{'Name': server_name, 'Values': values} for _, _, values, server_name, _, pushed in self.terms if pushed]
+
+    def matches(self, item):
+        """ evaluate the terms that EC2 does not evaluate on an item """
+        for key, op, values, _, getter, pushed in self.terms:
+            if pushed: continue
+            v = getter(item)
+            vs = [('true' if x else 'false') if isinstance(x, bool) else str(x) for x in (v if isinstance(v, list) else [v]) if x is not None]
+            if op == '~':
+                p = values[0].lower()
+                hit = any([fnmatch.fnmatchcase(x.lower(), p) if re.search(r'[*?]', p) else p in x.lower() for x in vs])
+            else:
+                hit = any([fnmatch.fnmatchcase(x, p) for x in vs for p in values])
+                if op == '!=': hit = not hit
+            if not hit: return False
+        return True
+
+    def literal_prefix(self, key):
+        """ returns the literal prefix (up to a wildcard) that the values of key must start with by a term 'key=VALUE', or ''.
+            A service can narrow a listing by it (eg, S3 Prefix); the term is still evaluated locally.
+        """
+        for k, op, values, _, _, _ in self.terms:
+            if k == key and op == '=' and len(values) == 1: return re.split(r'[*?\[]', values[0])[0]
+        return ''
+
+    def literal_value(self, key):
+        """ returns the value of a term 'key=VALUE' that has no wildcard, or None. """
+        for k, op, values, _, _, _ in self.terms:
+            if k == key and op == '=' and len(values) == 1 and not re.search(r'[*?\[]', values[0]): return values[0]
+        return None
+
+
 class NoneInstanceID:
     """ This exception is raised when a given instance ID is None. """
 
 
+@profiled_phase('resolve')
+def convert_host_patterns_to_instances(patterns, running_only=True):
+    """ Convert host name patterns into instances with a single API call.
+        patterns is a list of host names with wildcards (eg, 'worker-*') or instance IDs,
+        or a single tag filter such as 'role=compute' (the value may contain wildcards).
+        Returns a list of instances sorted by their names; an empty list if nothing matches.
+    """
+    ec2 = get_ec2_connection()
+    filters = [{'Name': 'instance-state-name', 'Values': ['running']}] if running_only else []
+    if len(patterns) == 1 and '=' in patterns[0]:
+        tag_name, tag_value = patterns[0].split('=', 1)
+        filters.append({'Name': 'tag:' + tag_name, 'Values': [tag_value]})
+        instances = list(ec2.instances.filter(Filters=filters))
+    else:
+        instance_ids = [p for p in patterns if re.match(r'^i-[0-9a-f]+$', p)]
+        host_names = [p for p in patterns if p not in instance_ids]
+        if 0 < len(instance_ids) and 0 < len(host_names):
+            error_exit("Please specify either instance IDs or host names, not both")
+        if 0 < len(instance_ids):
+            filters.append({'Name': 'instance-id', 'Values': instance_ids})
+        else:
+            filters.append({'Name': 'tag:Name', 'Values': host_names})
+        instances = list(ec2.instances.filter(Filters=filters))
+    return sorted(instances, key=lambda i: (extract_name_from_tags(i.tags), i.id))
+
+
+@profiled_phase('resolve')
 def convert_host_name_to_instance(possible_instance_id, error_on_exit=True):
     """ Convert a given host name into the instance ID.
         If the input host name looks like an existing instance ID, then return the instance immediately.
         If the instance with the given host name exists, then return the instance.
         If there is no such instance, it prints an error and exits if error_on_exit.
         Otherwise returns None
+        If an instance (not a string) is given, it is returned as is.
     """
     if possible_instance_id is None: raise NoneInstanceID()
+    if not isinstance(possible_instance_id, six.string_types): return possible_instance_id
     ec2 = get_ec2_connection()
     if re.match(r'^i-[0-9a-f]+$', possible_instance_id):
         instances = list(ec2.instances.filter(Filters=[{'Name': 'instance-id', 'Values': [possible_instance_id]}]))
@@ -646,6 +1271,7 @@ class NoneVPCID:
     """ This exception is raised when a given VPC is None. """
 
 
+@profiled_phase('resolve')
 def convert_vpc_name_to_vpc(possible_vpc_id, error_on_exit=True):
     """ Convert a given VPC name into the VPC ID.
         If the input VPC name looks like an existing VPC ID, then return the VPC immediately.
@@ -676,6 +1302,7 @@ class NoneSubnetID:
     """ This exception is raised when a given subnet is None. """
 
 
+@profiled_phase('resolve')
 def convert_subnet_name_to_subnet(possible_subnet_id, error_on_exit=True, vpc_name_or_id_if_any=None):
     """ Convert a given subnet name into the subnet ID.
         If the input subnet name looks like an existing subnet ID, then return the subnet immediately.
@@ -713,6 +1340,7 @@ class NoneSecurityGroupID:
     """ This exception is raised when a given security group is None. """
 
 
+@profiled_phase('resolve')
 def convert_sg_name_to_sg(possible_sg_id, error_on_exit=True, vpc_name_or_id_if_any=None):
     """ Convert a given security group name into the security group ID.
         If the input security group name look like an existing security group ID, then return the security group immediately.
@@ -750,6 +1378,7 @@ class NoneAMIID:
     """ This exception is raised when a given AMI ID is None. """
 
 
+@profiled_phase('resolve')
 def convert_ami_name_to_ami(possible_ami_id, error_on_exit=True):
     """ Convert a given AMI name into image ID.
         If the input AMI name looks like an existing AMI ID, then return the AMI immediately.
@@ -787,28 +1416,209 @@ def get_root_like_user_from_instance(instance):
     return 'ec2-user'  # default
 
 
+# SSH connection sharing (ControlMaster)
+ssh_control_persist = '10m'  # how long an idle master connection is kept
+missing_key_file_paths = set()
+
+
+def get_ssh_control_directory():
+    """ returns the directory for the sockets of shared SSH connections (~/.taw/ssh),
+        or None if it cannot be created. The path is kept short because a UNIX socket path is limited to ~100 bytes.
+    """
+    ssh_control_dir = os.path.join(taw_cache_dir, "ssh")
+    if not os.path.exists(ssh_control_dir):
+        try:
+            if not os.path.exists(taw_cache_dir): os.mkdir(taw_cache_dir)
+            os.mkdir(ssh_control_dir, 0o700)
+        except:
+            return None
+    return ssh_control_dir
+
+
+def ssh_multiplexing_options(instance):
+    """ returns SSH options to share one connection per (instance, user, host, port) among ssh/scp/rsync/mosh calls.
+        The instance ID is in the socket name because the same private address may be used in different VPCs.
+    """
+    ssh_control_dir = get_ssh_control_directory()
+    if ssh_control_dir is None: return []
+    return ['-o', 'ControlMaster=auto',
+            '-o', 'ControlPath=' + os.path.join(ssh_control_dir, instance.instance_id + '-%C'),
+            '-o', 'ControlPersist=' + ssh_control_persist]
+
+
+def ssh_key_options(instance, key_file_path=None):
+    """ returns SSH options to use the key file of an instance (~/.ssh/<key name>.pem) """
+    if key_file_path is None: key_file_path = os.path.join(os.path.expanduser("~/.ssh"), instance.key_name + ".pem")
+    if os.path.exists(key_file_path):
+        return ['-i', key_file_path]
+    if key_file_path not in missing_key_file_paths:  # say it once (pssh may connect to many hosts with the same key)
+        missing_key_file_paths.add(key_file_path)
+        print_info("Key file '%s' does not exist.\nThe default keys might be used" % key_file_path)
+    return []
+
+
+def close_ssh_master_connections(hostname_or_instance=None):
+    """ close shared SSH connections (to a specified host, or all of them if hostname_or_instance is None).
+        Returns the number of connections closed.
+    """
+    ssh_control_dir = get_ssh_control_directory()
+    if ssh_control_dir is None: return 0
+    if hostname_or_instance is None:
+        socket_pattern = '*'
+    else:
+        socket_pattern = convert_host_name_to_instance(hostname_or_instance).instance_id + '-*'
+    num_closed = 0
+    with open(os.devnull, 'w') as devnull:
+        for path in glob.glob(os.path.join(ssh_control_dir, socket_pattern)):
+            if subprocess.call(['ssh', '-O', 'exit', '-o', 'ControlPath=' + path, 'taw-close'], stdout=devnull, stderr=devnull) == 0:
+                num_closed += 1
+    return num_closed
+
+
+# SSH routing
+ssh_route = 'auto'           # 'auto', 'public', 'private' or 'bastion'
+bastion_tag_name = 'bastion'  # an instance with this tag is the jump host of its VPC
+cached_caller_vpc_id = False  # False means 'not checked yet'
+cached_vpc_id_to_bastion = None
+
+
+def set_ssh_route(route):
+    """ set how ssh-like commands reach instances.
+        'public' : the public IP address
+        'private': the private IP address (the caller must be able to reach it, eg, in the same VPC or via VPN)
+        'bastion': the private IP address through the bastion of the VPC
+        'auto'   : 'private' if the caller runs in the same VPC, 'public' if the instance has a public IP address,
+                   and 'bastion' otherwise
+    """
+    global ssh_route
+    ssh_route = route
+
+
+def get_caller_vpc_id():
+    """ returns the VPC ID of the EC2 instance we are running on (None if we are not on EC2).
+        The instance metadata service is asked only if the machine looks like an EC2 instance.
+    """
+    global cached_caller_vpc_id
+    if cached_caller_vpc_id is not False: return cached_caller_vpc_id
+    cached_caller_vpc_id = None
+    looks_like_ec2 = False
+    for path in ['/sys/hypervisor/uuid', '/sys/devices/virtual/dmi/id/board_asset_tag', '/sys/devices/virtual/dmi/id/sys_vendor']:
+        try:
+            with open(path) as f:
+                content = f.read().strip()
+        except (IOError, OSError):
+            continue
+        if content.lower().startswith('ec2') or content.startswith('i-') or content == 'Amazon EC2':
+            looks_like_ec2 = True
+    if not looks_like_ec2: return None
+    from six.moves.urllib.request import Request, urlopen
+    metadata_url = 'http://169.254.169.254/latest/'
+    try:
+        token = urlopen(Request(metadata_url + 'api/token', method='PUT',
+                                headers={'X-aws-ec2-metadata-token-ttl-seconds': '60'}), timeout=1).read().decode('utf-8')
+
+        def get_metadata(path):
+            return urlopen(Request(metadata_url + 'meta-data/' + path, headers={'X-aws-ec2-metadata-token': token}), timeout=1).read().decode('utf-8')
+
+        mac = get_metadata('mac').strip()
+        cached_caller_vpc_id = get_metadata('network/interfaces/macs/%s/vpc-id' % mac).strip()
+    except Exception as e:
+        if is_debugging: print_info("Could not get the VPC ID from the instance metadata: " + str(e))
+    return cached_caller_vpc_id
+
+
+def get_bastion_for_vpc(vpc_id):
+    """ returns the bastion (a running instance tagged with bastion_tag_name) of a VPC, or None.
+        All bastions are looked up with one API call and cached.
+    """
+    global cached_vpc_id_to_bastion
+    if cached_vpc_id_to_bastion is None:
+        cached_vpc_id_to_bastion = {}
+        ec2 = get_ec2_connection()
+        for i in ec2.instances.filter(Filters=[{'Name': 'tag-key', 'Values': [bastion_tag_name]},
+                                               {'Name': 'instance-state-name', 'Values': ['running']}]):
+            if i.public_ip_address is not None: cached_vpc_id_to_bastion[i.vpc_id] = i
+    return cached_vpc_id_to_bastion.get(vpc_id)
+
+
+def ssh_jump_options(bastion):
+    """ returns SSH options to connect through a bastion (the connection to the bastion is shared, too) """
+    jump_args = ['ssh'] + ssh_key_options(bastion) + ssh_multiplexing_options(bastion) + \
+        ['-W', '%h:%p', get_root_like_user_from_instance(bastion) + "@" + bastion.public_ip_address]
+    # ProxyCommand expands %-tokens itself, so ControlPath's '%C' must reach the inner ssh as is.
+    jump_args = [a.replace('%C', '%%C') for a in jump_args]
+    return ['-o', 'ProxyCommand=' + " ".join([six.moves.shlex_quote(a) if a != '%h:%p' else a for a in jump_args])]
+
+
+def ssh_route_to_instance(instance, error_on_exit=True):
+    """ returns (address, SSH options) to reach an instance according to ssh_route.
+        If the instance cannot be reached, it prints an error and exits if error_on_exit; otherwise returns None.
+    """
+    route = ssh_route
+    if route == 'auto':
+        if instance.private_ip_address is not None and instance.vpc_id is not None and instance.vpc_id == get_caller_vpc_id():
+            route = 'private'
+        elif instance.public_ip_address is not None:
+            route = 'public'
+        else:
+            route = 'bastion'
+    if route == 'public':
+        if instance.public_ip_address is not None: return instance.public_ip_address, []
+        message = "The instance has no public IP address"
+    elif route == 'private':
+        if instance.private_ip_address is not None: return instance.private_ip_address, []
+        message = "The instance has no private IP address"
+    else:
+        bastion = get_bastion_for_vpc(instance.vpc_id)
+        if bastion is not None and bastion.id == instance.id and instance.public_ip_address is not None:
+            return instance.public_ip_address, []
+        if bastion is not None and instance.private_ip_address is not None:
+            return instance.private_ip_address, ssh_jump_options(bastion)
+        message = "The instance has no public IP address and its VPC (%s) has no bastion.\n" % instance.vpc_id + \
+                  "Tag a running instance with a public IP in the VPC as the bastion:\n" + \
+                  "  taw instance settag <bastion host> %s yes" % bastion_tag_name
+    if error_on_exit: error_exit(message)
+    return None
+
+
+def ssh_destination_of_instance(instance, user=None):
+    """ returns ('user@address', SSH options for the route) to connect to an instance
+        (user defaults to the root-like user). See ssh_route_to_instance.
+    """
+    address, route_options = ssh_route_to_instance(instance)
+    if user is None: user = get_root_like_user_from_instance(instance)
+    return user + "@" + address, route_options
+
+
+def ssh_like_command_line(command_name, instance, command_args, extra_ssh_options=[]):
+    """ build the command line of an SSH-like command (eg, 'ssh' or 'mosh') to run command_args on an instance.
+        For rsync, the remote paths in command_args are written as ':path' (like scp).
+    """
+    destination, route_options = ssh_destination_of_instance(instance)
+    ssh_options = ssh_key_options(instance) + ssh_multiplexing_options(instance) + route_options + list(extra_ssh_options)
+    if command_name == 'mosh':
+        args = ['mosh', "--ssh=" + " ".join([six.moves.shlex_quote(x) for x in ['ssh'] + ssh_options])]
+    elif command_name == 'rsync':
+        if not any([a.startswith(':') for a in command_args]): error_exit("Give a remote path as ':path' (eg, taw rsync HOST -av src/ :dst/)")
+        args = ['rsync', '-e', " ".join([six.moves.shlex_quote(x) for x in ['ssh'] + ssh_options])]
+        return args + [destination + a if a.startswith(':') else a for a in command_args]
+    else:
+        args = [command_name] + ssh_options
+    args += [destination]
+    args += list(command_args)
+    return args
+
+
 def ssh_like_call(params, command_name, hostname_or_instance_id, command_args, return_output=False):
     """ call an SSH-like command to login into a specified host with specified arguments
         params is a parameter object of click,
         command_name is a string such as 'ssh' or 'mosh',
-        hostname_or_instance_id is a hostname (Name tag) or an instance ID,
+        hostname_or_instance_id is a hostname (Name tag), an instance ID or an instance (to save a lookup),
         command_args is a list of arguments passed to command_name.
+        Connections are shared among calls (see ssh_multiplexing_options).
     """
     instance = convert_host_name_to_instance(hostname_or_instance_id)
-    if instance.public_ip_address is None:
-        error_exit("The instance has no public IP address")
-    # root user
-    root_user = get_root_like_user_from_instance(instance)
-    args = [command_name if command_name != 'mosh' else 'ssh']
-    key_file_path = os.path.join(os.path.expanduser("~/.ssh"), instance.key_name + ".pem")
-    if os.path.exists(key_file_path):
-        args += ['-i', key_file_path]
-    else:
-        print_info("Key file '%s' does not exist.\nThe default keys might be used" % key_file_path)
-    if command_name == 'mosh':
-        args = ['mosh', "--ssh=" + " ".join(args)]
-    args += [root_user + "@" + instance.public_ip_address]
-    args += list(command_args)
+    args = ssh_like_command_line(command_name, instance, command_args)
     if params.aws_dryrun:
         print(" ".join(args))
         return None
@@ -824,6 +1634,7 @@ def ssh_like_call(params, command_name, hostname_or_instance_id, command_args, r
         return None
 
 
+@profiled_phase('resolve')
 def convert_zone_name_to_zone_id(zone_name, error_on_exit=True):
     """ convert an Route53 zone name to the corresponding zone ID """
     if zone_name is not None and not zone_name.endswith('.'): zone_name += '.'
@@ -835,6 +1646,7 @@ def convert_zone_name_to_zone_id(zone_name, error_on_exit=True):
     return possible_zone_ids[0]
 
 
+@profiled_phase('resolve')
 def convert_eip_name_to_eip_id(eip_name, error_on_exit=True):
     """ convert an Elastic IP name/Elastic IP association ID/Elastic IP allocation ID to an Elastic IP allocation ID """
     ec2 = get_ec2_connection()
@@ -1011,18 +1823,124 @@ def get_AMI_DB_file_path():
     return os.path.join(os.path.expanduser("~/.aws"), "ami_db.sqlite3")
 
 
+ami_db_schema_version = 3  # 1: a row per image with pickled region and cost tables, 2: normalized tables, 3: recommended images
+
+
 def ensure_AMI_DB_exist():
-    """ ensure that the AMI database exists.
-        If there is not an existing one, create a new one
+    """ ensure that the AMI database exists with the current schema.
+        If there is not an existing one, create a new one. An old one (with pickled tables) is migrated.
     """
-    db_path = get_AMI_DB_file_path()
-    if os.path.exists(db_path): return
-    conn = sqlite3.connect(db_path)
-    conn.execute("CREATE TABLE ami_ids (name text primary key, id text, cost text);")
+    conn = sqlite3.connect(get_AMI_DB_file_path())
+    if ami_db_schema_version <= conn.execute("PRAGMA user_version").fetchone()[0]:
+        conn.close()
+        return
+    conn.execute("CREATE TABLE IF NOT EXISTS images (id integer PRIMARY KEY, name text UNIQUE)")
+    conn.execute("CREATE TABLE IF NOT EXISTS image_regions (image_id integer, region text, ami_id text, PRIMARY KEY (image_id, region))")
+    conn.execute("CREATE INDEX IF NOT EXISTS image_regions_by_region ON image_regions (region, image_id)")
+    conn.execute("CREATE TABLE IF NOT EXISTS image_costs (image_id integer, instance_type text, cost_for_license text, " +
+                 "cost_for_instance text, cost_total text, PRIMARY KEY (image_id, instance_type))")
+    conn.execute("CREATE TABLE IF NOT EXISTS recommended_images (region text, name text, architecture text, ami_id text, " +
+                 "image_name text, creation_date text, owner text, refreshed_at real, PRIMARY KEY (region, name))")
+    for fts in ['fts5', 'fts4']:  # keyword search of names (if SQLite has a full-text search module)
+        try:
+            conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS images_fts USING %s(name)" % fts)
+            break
+        except sqlite3.OperationalError:
+            pass
+    if conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'ami_ids'").fetchone() is not None:
+        all_migrated = True
+        for name, region_blob, cost_blob in conn.execute("SELECT name, id, cost FROM ami_ids").fetchall():
+            try:
+                store_AMI_to_local_database(conn, name, unpickle_legacy_AMI_DB_blob(region_blob), unpickle_legacy_AMI_DB_blob(cost_blob))
+            except Exception as e:
+                print_warning("Could not migrate the AMI info for '%s' (%s). Please register it again." % (name, e))
+                all_migrated = False
+        if all_migrated:
+            conn.execute("DROP TABLE ami_ids")
+        else:
+            conn.execute("ALTER TABLE ami_ids RENAME TO ami_ids_legacy")
+            print_warning("The old AMI info is kept in the table 'ami_ids_legacy' of %s" % get_AMI_DB_file_path())
+    conn.execute("PRAGMA user_version = %d" % ami_db_schema_version)
     conn.commit()
     conn.close()
 
 
+def open_AMI_DB():
+    """ open the AMI database (creating or migrating it if needed). Returns a sqlite3 connection """
+    ensure_AMI_DB_exist()
+    return sqlite3.connect(get_AMI_DB_file_path())
+
+
+def unpickle_legacy_AMI_DB_blob(blob):
+    """ unpickle a table in the old AMI database (which may be written by Python 2) """
+    if isinstance(blob, six.text_type): blob = blob.encode('latin-1')
+    if six.PY2: return pickle.loads(bytes(blob))
+    return pickle.loads(bytes(blob), encoding='latin-1')
+
+
+def AMI_DB_has_fts(conn):
+    return conn.execute("SELECT name FROM sqlite_master WHERE name = 'images_fts'").fetchone() is not None
+
+
+def AMI_DB_image_id(conn, image_name):
+    """ returns the ID of an image in the AMI database (adding the image if it is new) """
+    row = conn.execute("SELECT id FROM images WHERE name = ?", (image_name,)).fetchone()
+    if row is not None: return row[0]
+    image_id = conn.execute("INSERT INTO images (name) VALUES (?)", (image_name,)).lastrowid
+    if AMI_DB_has_fts(conn): conn.execute("INSERT INTO images_fts (rowid, name) VALUES (?, ?)", (image_id, image_name))
+    return image_id
+
+
+def store_AMI_to_local_database(conn, image_name, region_name_to_ami_id, instance_type_to_cost):
+    """ store (or replace) an image in the AMI database. The caller commits. """
+    image_id = AMI_DB_image_id(conn, image_name)
+    for table in ['image_regions', 'image_costs']: conn.execute("DELETE FROM %s WHERE image_id = ?" % table, (image_id,))
+    conn.executemany("INSERT INTO image_regions VALUES (?, ?, ?)", [(image_id, k, v) for k, v in six.iteritems(region_name_to_ami_id)])
+    conn.executemany("INSERT INTO image_costs VALUES (?, ?, ?, ?, ?)",
+                     [(image_id, k, d.get('CostForLicense'), d.get('CostForInstance'), d.get('CostTotal')) for k, d in six.iteritems(instance_type_to_cost)])
+
+
+def add_AMI_regions_to_local_database(conn, image_name, region_name_to_ami_id):
+    """ add (or replace) the AMI IDs of an image in some regions, keeping the other regions and the costs. The caller commits. """
+    image_id = AMI_DB_image_id(conn, image_name)
+    conn.executemany("INSERT OR REPLACE INTO image_regions VALUES (?, ?, ?)", [(image_id, k, v) for k, v in six.iteritems(region_name_to_ami_id)])
+
+
+def escape_glob(s):
+    """ escape the special characters of SQLite GLOB """
+    return re.sub(r'([\*?\[])', r'[\1]', s)
+
+
+def query_AMI_DB_by_name_prefix(conn, prefix, region_name):
+    """ returns [(image name, AMI ID in the region)] of the registered images whose names start with prefix (by an indexed query) """
+    return conn.execute("SELECT i.name, r.ami_id FROM images i JOIN image_regions r ON r.image_id = i.id " +
+                        "WHERE i.name GLOB ? AND r.region = ? ORDER BY i.name", (escape_glob(prefix) + '*', region_name)).fetchall()
+
+
+def search_AMI_DB(conn, search_terms):
+    """ returns [(image id, image name)] of the registered images whose names match any of search_terms (all images if none).
+        Terms are regular expressions matched anywhere in names ignoring the case. Plain words are first looked up
+        in the full-text index (as the prefixes of words in names), and if nothing is found there, matched as substrings.
+    """
+    if len(search_terms) <= 0: return conn.execute("SELECT id, name FROM images ORDER BY name").fetchall()
+
+    def search(words, regexps):
+        conditions, args = [], []
+        if 0 < len(words):
+            conditions.append("id IN (SELECT rowid FROM images_fts WHERE images_fts MATCH ?)")
+            args.append(" OR ".join(['"%s"*' % w for w in words]))
+        if 0 < len(regexps):
+            conn.create_function('regexp', 2, lambda pattern, value: re.search(pattern, value, re.I) is not None)
+            conditions += ["name REGEXP ?"] * len(regexps)
+            args += regexps
+        return conn.execute("SELECT id, name FROM images WHERE " + " OR ".join(conditions) + " ORDER BY name", args).fetchall()
+
+    words = [t for t in search_terms if re.match(r'^\w+$', t, re.U)] if AMI_DB_has_fts(conn) else []
+    rows = search(words, [t for t in search_terms if t not in words])
+    if 0 < len(rows) or len(words) <= 0: return rows
+    return search([], search_terms)  # eg, 'buntu' is not the prefix of a word but a substring of 'Ubuntu'
+
+
 def register_AMI_ID_to_local_database(do_not_open_browser):
     """ Register AMIs to the AMI database that is located on local disk """
     ensure_AMI_DB_exist()
@@ -1112,11 +2030,8 @@ def register_AMI_ID_to_local_database(do_not_open_browser):
     instance_type_to_cost = {}
     for d in cost_table: instance_type_to_cost[d['InstanceType']] = d
 
-    db_path = get_AMI_DB_file_path()
-    conn = sqlite3.connect(db_path)
-    conn.execute("DELETE FROM ami_ids WHERE name = ?", (image_name,))
-    conn.execute("INSERT INTO ami_ids VALUES(?, ?, ?)", (image_name,
-            pickle.dumps(region_name_to_ami_id), pickle.dumps(instance_type_to_cost)))
+    conn = open_AMI_DB()
+    store_AMI_to_local_database(conn, image_name, region_name_to_ami_id, instance_type_to_cost)
     conn.commit()
     conn.close()
     print_info("Successfully registered the AMI info for '%s'" % image_name)
@@ -1147,6 +2062,23 @@ def get_profile_cache_directory(profile_name_str=None):
     return profile_cache_dir
 
 
+def get_account_id():
+    """ returns the AWS account ID of the current profile.
+        It is cached in the profile cache directory, so GetCallerIdentity is called once per profile.
+    """
+    profile_cache_dir = get_profile_cache_directory()
+    cache_file_name = os.path.join(profile_cache_dir, 'account_id') if profile_cache_dir is not None else None
+    if cache_file_name is not None and os.path.exists(cache_file_name):
+        with open(cache_file_name) as f:
+            account_id = f.read().strip()
+        if account_id != '': return account_id
+    account_id = get_sts_client().get_caller_identity()['Account']
+    if cache_file_name is not None:
+        with open(cache_file_name, "w") as f:
+            print(account_id, file=f)
+    return account_id
+
+
 def update_completion_keywords(completion_keywords, cache_name):
     profile_cache_dir = get_profile_cache_directory()
     if profile_cache_dir is None: return
@@ -1300,11 +2232,83 @@ def wait_for_clipboard_to_update(minimum_size=0):
         time.sleep(1)
 
 
-def update_recommended_image_cache():
-    """ Update the file that contains recommended AWS EC2 images (eg., RetHat Enterprise Linux, Amazon Linux, Cent OS, Ubuntu, etc.) """
-    # NOTE: this is not (yet?) implemented.
-    ec2 = get_ec2_connection()
-    images = ec2.images.filter(Owners=['self'])
+# (family, owner, name pattern) of recommended images; the latest image of each family and architecture is kept
+recommended_image_families = [
+    ('amazon-linux-2023', 'amazon'      , 'al2023-ami-2023.*-kernel-*'),
+    ('amazon-linux-2'   , 'amazon'      , 'amzn2-ami-kernel-5.10-hvm-2.0.*-gp2'),
+    ('ubuntu-24.04'     , '099720109477', 'ubuntu/images/hvm-ssd-gp3/ubuntu-noble-24.04-*-server-*'),
+    ('ubuntu-22.04'     , '099720109477', 'ubuntu/images/hvm-ssd/ubuntu-jammy-22.04-*-server-*'),
+    ('rhel-9'           , '309956199498', 'RHEL-9.*_HVM-*-Hourly2-GP3'),
+    ('centos-7'         , '679593333241', 'CentOS Linux 7 x86_64*'),
+]
+recommended_image_architectures = ['x86_64', 'arm64']
+
+
+def fetch_recommended_images(ec2):
+    """ find the latest images of recommended_image_families in the region of an EC2 client (by a single DescribeImages).
+        Returns [(name, image)]; name is the family (with '-arm64' for arm64 images) and image is a dict of DescribeImages.
+    """
+    import fnmatch
+    families = [f for f in recommended_image_families if f[1] in trusted_ami_owners]
+    images = ec2.describe_images(Owners=sorted(set([f[1] for f in families])),
+                                 Filters=[{'Name': 'name', 'Values': [f[2] for f in families]},
+                                          {'Name': 'state', 'Values': ['available']},
+                                          {'Name': 'architecture', 'Values': recommended_image_architectures}])['Images']
+    name_to_image = {}
+    for i in images:
+        for family, owner, pattern in families:
+            if owner not in (i.get('OwnerId'), i.get('ImageOwnerAlias')) or not fnmatch.fnmatchcase(i.get('Name') or '', pattern): continue
+            name = family if i['Architecture'] == 'x86_64' else family + '-' + i['Architecture']
+            if name not in name_to_image or name_to_image[name]['CreationDate'] < i['CreationDate']: name_to_image[name] = i
+            break
+    return sorted(name_to_image.items())
+
+
+def update_recommended_image_cache(region_names):
+    """ Update the recommended AWS EC2 images (eg., RetHat Enterprise Linux, Amazon Linux, Ubuntu, etc.) of regions
+        in the AMI database. The regions are looked up concurrently (a thread per region).
+        Returns a dictionary (region name -> [(name, image)]) of the regions that were updated.
+    """
+    import concurrent.futures
+    import botocore.exceptions
+    clients = [get_ec2_client_for_region(r) for r in region_names]  # creating clients is not thread-safe
+    region_to_images = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(16, len(region_names)))) as executor:
+        future_to_region = dict([(executor.submit(fetch_recommended_images, c), r) for c, r in zip(clients, region_names)])
+        for future in concurrent.futures.as_completed(future_to_region):
+            try:
+                region_to_images[future_to_region[future]] = future.result()
+            except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+                print_warning("Could not look up the images in %s: %s" % (future_to_region[future], e))
+    conn = open_AMI_DB()
+    now = time.time()
+    with conn:
+        for region_name, images in six.iteritems(region_to_images):
+            conn.execute("DELETE FROM recommended_images WHERE region = ?", (region_name,))
+            conn.executemany("INSERT INTO recommended_images VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             [(region_name, n, i['Architecture'], i['ImageId'], i['Name'], i['CreationDate'],
+                               i.get('ImageOwnerAlias') or i['OwnerId'], now) for n, i in images])
+    conn.close()
+    return region_to_images
+
+
+def query_recommended_images(conn, region_name, prefix=''):
+    """ returns [(name, AMI ID, image name, creation date)] of the recommended images in a region whose names start with prefix """
+    return conn.execute("SELECT name, ami_id, image_name, creation_date FROM recommended_images WHERE region = ? AND name GLOB ? ORDER BY name",
+                        (region_name, escape_glob(prefix) + '*')).fetchall()
+
+
+def run_concurrently(func, args, max_workers=16):
+    """ call func for each of args concurrently. Returns [(arg, result or None, exception or None)] """
+    import concurrent.futures
+
+    def call(arg):
+        try:
+            return arg, func(arg), None
+        except Exception as e:
+            return arg, None, e
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(call, args))
 
 
 def is_gnu_parallel_available():
@@ -1328,6 +2332,35 @@ def parallel_subprocess_by_gnu_parallel(cmdlines):
     subprocess.check_call(['sem', '--wait'])
 
 
+def run_subprocesses_in_parallel(cmdlines, max_parallel, line_handler=None):
+    """ Execute specified command lines with at most max_parallel processes at a time.
+        stdin is /dev/null and stderr is merged into stdout.
+        If line_handler is given, it is called as line_handler(index of cmdline, line) for each output line
+        (one at a time); otherwise the output lines are collected.
+        Returns the list of (exit code, elapsed seconds, output lines) in the order of cmdlines.
+    """
+    import concurrent.futures, threading
+    output_lock = threading.Lock()
+
+    def run(index, args):
+        started = time.time()
+        lines = []
+        with open(os.devnull, 'r') as devnull:
+            proc = subprocess.Popen(args, stdin=devnull, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        for line in iter(proc.stdout.readline, b''):
+            line = line.decode('utf-8', 'replace').rstrip("\n")
+            if line_handler is None:
+                lines.append(line)
+            else:
+                with output_lock: line_handler(index, line)
+        proc.stdout.close()
+        return proc.wait(), time.time() - started, lines
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_parallel)) as executor:
+        futures = [executor.submit(run, i, args) for i, args in enumerate(cmdlines)]
+        return [f.result() for f in futures]
+
+
 def print_fence(message):
     """ Print a message with a fence """
     print("=" + message + "=" * (70 - len(message)))
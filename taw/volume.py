@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+from __future__ import print_function
+from __future__ import absolute_import
+import click, datetime
+import botocore.exceptions
+from taw.util import *
+from taw.taw import *  # This must be the end of imports
+
+
+# ========
+#  HELPER
+# ========
+def instance_id_to_name_of_volumes(volumes):
+    """ returns a dictionary (instance ID -> name) of the instances that volumes are attached to (by DescribeInstances, not per volume) """
+    instance_ids = sorted(set([a['InstanceId'] for v in volumes for a in v.get('Attachments', [])]))
+    instance_id_to_name = {}
+    for k in range(0, len(instance_ids), 200):  # the number of filter values is limited
+        for r in describe_each('describe_instances', 'Reservations', Filters=[{'Name': 'instance-id', 'Values': instance_ids[k:k + 200]}]):
+            for i in r['Instances']: instance_id_to_name[i['InstanceId']] = extract_name_from_tags(i.get('Tags'), i['InstanceId'])
+    return instance_id_to_name
+
+
+def age_in_days(t):
+    """ returns the days since t (a datetime given by the API) """
+    if t.tzinfo is not None: t = t.replace(tzinfo=None) - t.utcoffset()
+    return (datetime.datetime.utcnow() - t).total_seconds() / 86400.0
+
+
+def time_to_str(t):
+    return datetime.datetime.strftime(t, '%c')
+
+# ================
+#  VOLUME COMMAND
+# ================
+@taw.group("volume")
+@pass_global_parameters
+def volume_group(params):
+    """ manage EBS volumes """
+
+
+@volume_group.command("list")
+@click.option('--verbose', '-v', is_flag=True, help='Verbose output.')
+@click.option('--unattached', is_flag=True, help='List only the volumes that are not attached to any instance.')
+@click.argument('filter_terms', nargs=-1)
+@pass_global_parameters
+def list_volumecmd(params, verbose, unattached, filter_terms):
+    """ list EBS volumes with the instances that they are attached to.
+        Filter terms (eg, type=gp2 size!=8) narrow the list; keys are name, id, size, type, state, az, instance, encrypted and tag:KEY.
+    """
+    volume_filter = ResourceFilter(filter_terms_of(filter_terms), {
+            'name'     : ('tag:Name'              , lambda v: extract_name_from_tags(v.get('Tags'))),
+            'id'       : ('volume-id'             , lambda v: v['VolumeId'])                        ,
+            'size'     : ('size'                  , lambda v: v['Size'])                            ,
+            'type'     : ('volume-type'           , lambda v: v['VolumeType'])                      ,
+            'state'    : ('status'                , lambda v: v['State'])                           ,
+            'az'       : ('availability-zone'     , lambda v: v['AvailabilityZone'])                ,
+            'instance' : ('attachment.instance-id', lambda v: [a['InstanceId'] for a in v.get('Attachments', [])]),
+            'encrypted': ('encrypted'             , lambda v: v.get('Encrypted'))                   ,
+        })
+    filters = [{'Name': 'status', 'Values': ['available']}] if unattached else []
+    volumes = [v for v in describe_all('describe_volumes', 'Volumes', Filters=filters + volume_filter.ec2_filters()) if volume_filter.matches(v)]
+    instance_id_to_name = instance_id_to_name_of_volumes(volumes)
+    all_list_columns = [
+            (True , "Tags"            , "Name"       , extract_name_from_tags),
+            (True , "VolumeId"        , "Volume ID"  , ident)                 ,
+            (True , "Size"            , "Size (GB)"  , ident)                 ,
+            (True , "VolumeType"      , "Type"       , ident)                 ,
+            (True , "State"           , "State"      , ident)                 ,
+            (True , "AvailabilityZone", "AZ"         , ident)                 ,
+            (True , "Attachments"     , "Instance"   , lambda xs: [instance_id_to_name.get(a['InstanceId'], a['InstanceId']) for a in xs or []]),
+            (True , "Attachments"     , "Device"     , lambda xs: [a.get('Device') for a in xs or []]),
+            (True , "CreateTime"      , "Created"    , time_to_str)           ,
+            (False, "Iops"            , "IOPS"       , ident)                 ,
+            (False, "Throughput"      , "Throughput" , ident)                 ,
+            (False, "Encrypted"       , "Encrypted"  , ident)                 ,
+            (False, "SnapshotId"      , "Snapshot ID", ident)                 ,
+        ]
+    list_columns = [x for x in all_list_columns if verbose or x[0]]
+    header = [x[2] for x in list_columns]
+    rows = [[f(v.get(k)) for _, k, _, f in list_columns] for v in sorted(volumes, key=lambda v: v['CreateTime'])]
+    output_table(params, header, rows, [lambda r: {-1: 'yellow'} if r[header.index('State')] == 'available' else None])
+    idle_volumes = [v for v in volumes if v['State'] == 'available']
+    if 0 < len(idle_volumes):
+        region_name = get_ec2_client().meta.region_name
+        resource_prices = get_resource_price_catalog()
+        monthly = [resource_prices.get((region_name, 'volume:' + v['VolumeType'])) for v in idle_volumes]
+        cost_str = '' if None in monthly else " (USD %.2f/month)" % sum([p * v['Size'] for p, v in zip(monthly, idle_volumes)])
+        print_warning("%d volume(s) (%d GB) are not attached to any instance%s" % (len(idle_volumes), sum([v['Size'] for v in idle_volumes]), cost_str))
+
+
+# ==================
+#  SNAPSHOT COMMAND
+# ==================
+@taw.group("snapshot")
+@pass_global_parameters
+def snapshot_group(params):
+    """ manage EBS snapshots """
+
+
+@snapshot_group.command("list")
+@click.option('--verbose', '-v', is_flag=True, help='Verbose output.')
+@click.argument('filter_terms', nargs=-1)
+@pass_global_parameters
+def list_snapshotcmd(params, verbose, filter_terms):
+    """ list snapshots (of mine) with the instances that their volumes are attached to.
+        Filter terms (eg, tag:purpose=backup) narrow the list; keys are name, id, state, volume, size, description and tag:KEY.
+    """
+    snapshot_filter = ResourceFilter(filter_terms_of(filter_terms), {
+            'name'       : ('tag:Name'   , lambda s: extract_name_from_tags(s.get('Tags'))),
+            'id'         : ('snapshot-id', lambda s: s['SnapshotId'])                      ,
+            'state'      : ('status'     , lambda s: s['State'])                           ,
+            'volume'     : ('volume-id'  , lambda s: s['VolumeId'])                        ,
+            'size'       : ('volume-size', lambda s: s['VolumeSize'])                      ,
+            'description': ('description', lambda s: s.get('Description'))                ,
+        })
+    snapshots = [s for s in describe_all('describe_snapshots', 'Snapshots', OwnerIds=['self'], Filters=snapshot_filter.ec2_filters())
+                 if snapshot_filter.matches(s)]
+    volume_ids = set([s['VolumeId'] for s in snapshots])
+    volumes = [v for v in describe_all('describe_volumes', 'Volumes') if v['VolumeId'] in volume_ids] if 0 < len(volume_ids) else []
+    instance_id_to_name = instance_id_to_name_of_volumes(volumes)
+    volume_id_to_instances = dict([(v['VolumeId'], [instance_id_to_name.get(a['InstanceId'], a['InstanceId']) for a in v.get('Attachments', [])])
+                                   for v in volumes])
+    all_list_columns = [
+            (True , "Tags"        , "Name"       , extract_name_from_tags),
+            (True , "SnapshotId"  , "Snapshot ID", ident)                 ,
+            (True , "State"       , "State"      , ident)                 ,
+            (True , "Progress"    , "Progress"   , ident)                 ,
+            (True , "StartTime"   , "Started"    , time_to_str)           ,
+            (True , "VolumeId"    , "Volume ID"  , ident)                 ,
+            (True , "VolumeId"    , "Instance"   , lambda x: volume_id_to_instances.get(x, []))     ,
+            (True , "VolumeSize"  , "Size (GB)"  , ident)                 ,
+            (False, "Encrypted"   , "Encrypted"  , ident)                 ,
+            (False, "Description" , "Description", ident)                 ,
+        ]
+    list_columns = [x for x in all_list_columns if verbose or x[0]]
+    header = [x[2] for x in list_columns]
+    rows = [[f(s.get(k)) for _, k, _, f in list_columns] for s in sorted(snapshots, key=lambda s: s['StartTime'])]
+    output_table(params, header, rows)
+
+
+@snapshot_group.command("create")
+@click.argument('hostnames', nargs=-1, required=True)
+@click.option('--description', default='', help='Description of the snapshots.')
+@click.option('--exclude-boot', 'exclude_boot', is_flag=True, help='Do not take snapshots of the boot volumes.')
+@pass_global_parameters
+def create_snapshotcmd(params, hostnames, description, exclude_boot):
+    """ take snapshots of all the volumes attached to instances.
+        The volumes of an instance are snapshotted at the same moment (crash-consistent), and instances are done concurrently.
+        The snapshots get the tags of their volumes and a tag 'taw:instance' with the name of the instance.
+
+        \b
+        eg) taw snapshot create 'worker-*'
+            taw snapshot create role=db --exclude-boot
+    """
+    instances = convert_host_patterns_to_instances(list(hostnames), running_only=False)
+    if len(instances) <= 0: error_exit("No such instances")
+    if params.aws_dryrun:
+        output_table(params, ['Name', 'Instance ID', 'Volumes'],
+                     [[extract_name_from_tags(i.tags), i.instance_id, [d['Ebs']['VolumeId'] for d in i.block_device_mappings if 'Ebs' in d]]
+                      for i in instances])
+        return
+    ec2_client = get_ec2_client()
+
+    def create_snapshots(instance):
+        return ec2_client.create_snapshots(InstanceSpecification={'InstanceId': instance.instance_id, 'ExcludeBootVolume': exclude_boot},
+                                           Description=description, CopyTagsFromSource='volume',
+                                           TagSpecifications=[{'ResourceType': 'snapshot',
+                                                               'Tags': [{'Key': 'taw:instance', 'Value': extract_name_from_tags(instance.tags)}]}])['Snapshots']
+    rows = []
+    for instance, snapshots, e in run_concurrently(create_snapshots, instances):
+        if e is not None:
+            print_warning("Could not take snapshots of %s: %s" % (extract_name_from_tags(instance.tags), e))
+            continue
+        for s in snapshots:
+            rows.append([extract_name_from_tags(instance.tags), s['SnapshotId'], s['VolumeId'], s['VolumeSize'], s['State']])
+    output_table(params, ['Instance', 'Snapshot ID', 'Volume ID', 'Size (GB)', 'State'], rows)
+
+
+@snapshot_group.command("rm")
+@click.argument('snapshot_ids', nargs=-1)
+@click.option('--older-than', 'older_than', type=float, help='Remove the snapshots older than D days.')
+@click.option('--tag', multiple=True, help="Remove the snapshots with a tag (eg, --tag purpose=backup; the value may contain wildcards).")
+@click.option('--force', is_flag=True, help='Actually remove (otherwise shows what would be removed).')
+@pass_global_parameters
+def rm_snapshotcmd(params, snapshot_ids, older_than, tag, force):
+    """ remove snapshots of mine by IDs, age and/or tags.
+        Snapshots that back images (AMIs) are kept; use 'taw image prune' for them.
+
+        \b
+        eg) taw snapshot rm --older-than 30 --tag purpose=backup
+            taw snapshot rm snap-0123456789abcdef0 --force
+    """
+    if len(snapshot_ids) <= 0 and older_than is None and len(tag) <= 0: error_exit("Specify snapshot IDs, --older-than and/or --tag")
+    filters = []
+    for t in tag:
+        if '=' not in t: error_exit("A tag must be KEY=VALUE ('%s')" % t)
+        k, v = t.split('=', 1)
+        filters.append({'Name': 'tag:' + k, 'Values': [v]})
+    args = {'OwnerIds': ['self'], 'Filters': filters}
+    if 0 < len(snapshot_ids): args['SnapshotIds'] = list(snapshot_ids)
+    try:
+        snapshots = describe_all('describe_snapshots', 'Snapshots', **args)
+    except botocore.exceptions.ClientError as e:
+        if e.response.get('Error', {}).get('Code') != 'InvalidSnapshot.NotFound': raise
+        error_exit(e.response['Error'].get('Message') or str(e))
+    ec2_client = get_ec2_client()
+    snapshots_of_images = set([d['Ebs']['SnapshotId'] for i in ec2_client.describe_images(Owners=['self'])['Images']
+                               for d in i.get('BlockDeviceMappings', []) if d.get('Ebs', {}).get('SnapshotId')])
+    to_remove = [s for s in snapshots if (older_than is None or older_than < age_in_days(s['StartTime'])) and s['SnapshotId'] not in snapshots_of_images]
+    n_kept = len([s for s in snapshots if s['SnapshotId'] in snapshots_of_images])
+    output_table(params, ['Name', 'Snapshot ID', 'Started', 'Volume ID', 'Size (GB)'],
+                 [[extract_name_from_tags(s.get('Tags')), s['SnapshotId'], time_to_str(s['StartTime']), s['VolumeId'], s['VolumeSize']]
+                  for s in sorted(to_remove, key=lambda s: s['StartTime'])])
+    if 0 < n_kept: print_info("%d snapshot(s) are kept because images use them" % n_kept)
+    total_gb = sum([s['VolumeSize'] for s in to_remove])
+    if not force or params.aws_dryrun:
+        print("%d snapshot(s) (%d GB) would be removed. Please add --force to actually remove them." % (len(to_remove), total_gb))
+        return
+    n_removed = 0
+    for snapshot_id, _, e in run_concurrently(lambda x: ec2_client.delete_snapshot(SnapshotId=x), [s['SnapshotId'] for s in to_remove]):
+        if e is not None:
+            print_warning("Could not delete %s: %s" % (snapshot_id, e))
+        else:
+            n_removed += 1
+    print_info("Removed %d snapshot(s)" % n_removed)
@@ -105,17 +105,21 @@ def create_vpccmd(params, name, cidr, nosubnet, nogateway):
 @vpc_group.command("list")
 @click.option('--verbose', '-v', is_flag=True, help='Verbose output.')
 @click.option('--argdoc', is_flag=True, help='Show available attributes in a web browser')
-@click.option('--attr', '-a', multiple=True, help='Attribute name(s).')
+@click.option('--attr', '-a', multiple=True, help='Attribute name(s) or column header(s) to show (only they are shown).')
 @click.option('--allregions', is_flag=True, help='List for all regions.')
+@click.argument('filter_terms', nargs=-1)
 @pass_global_parameters
-def list_vpccmd(params, verbose, argdoc, attr, allregions):
-    """ list VPCs """
+def list_vpccmd(params, verbose, argdoc, attr, allregions, filter_terms):
+    """ list VPCs (that match filter terms if any; eg, 'taw vpc list name~prod cidr=10.*').
+        Keys are name, id, cidr, state, default and tag:KEY.
+    """
     if argdoc:
         click.launch('https://boto3.readthedocs.io/en/latest/reference/services/ec2.html#vpc')
         return
     if allregions:
-        list_for_all_regions(params, [], 'vpc', lambda x: list_vpccmd(params, verbose, argdoc, attr, False))
+        list_for_all_regions(params, filter_terms, 'vpc', lambda: list_vpccmd.callback(verbose=verbose, argdoc=argdoc, attr=attr, allregions=False, filter_terms=filter_terms))
         return
+    vpc_id_to_items = {}  # (data name, VPC ID) -> the list of the names of the items in the VPC (only the data that the shown columns need)
     all_list_columns = [
             (True , "tags"            , "Name"           , extract_name_from_tags),
             (True , "vpc_id"          , "ID"             , ident)                      ,
@@ -124,36 +128,36 @@ def list_vpccmd(params, verbose, argdoc, attr, allregions):
             (True , "is_default"      , "Default"        , ident)                      ,
             (False, "dhcp_options_id" , "DHCP Options ID", ident)                      ,
             (False, "instance_tenancy", "Tenancy"        , ident)                      ,
+            (False, "vpc_id"          , "Gateway"        , lambda x: vpc_id_to_items.get(('internet_gateways', x), []), ('internet_gateways',)),
+            (True , "vpc_id"          , "Subnet Names"   , lambda x: vpc_id_to_items.get(('subnets', x), [])          , ('subnets',))          ,
+            (True , "vpc_id"          , "Instances"      , lambda x: vpc_id_to_items.get(('instances', x), [])        , ('instances',))        ,
+            (True , "vpc_id"          , "Security Groups", lambda x: vpc_id_to_items.get(('security_groups', x), [])  , ('security_groups',))  ,
         ]
-    list_columns = [x for x in all_list_columns if verbose or x[0]]
-    for v in attr: list_columns.append((True, v, v, ident))
+    list_columns = select_list_columns(all_list_columns, verbose, attr)
     header = [x[2] for x in list_columns]
-    if verbose: header.append('Gateway')
-    header += ['Subnet Names', 'Instances', 'Security Groups']
     rows = []
+    vpc_filter = ResourceFilter(filter_terms_of(filter_terms), {
+            'name'   : ('tag:Name'  , lambda v: extract_name_from_tags(v.tags)),
+            'id'     : ('vpc-id'    , lambda v: v.vpc_id)                      ,
+            'cidr'   : ('cidr'      , lambda v: v.cidr_block)                  ,
+            'state'  : ('state'     , lambda v: v.state)                       ,
+            'default': ('is-default', lambda v: v.is_default)                  ,
+        })
     ec2 = get_ec2_connection()
-    instances = ec2.instances.all()
-    vpcs = ec2.vpcs.all()
-    subnets = ec2.subnets.all()
-
-    def subnet_id_to_subnet_name(subnet_id):
-        for s in subnets:
-            if s.subnet_id != subnet_id: continue
-            name = extract_name_from_tags(s.tags)
-            if name != 'NO NAME': return name
-            break
-        return subnet_id
-    sgs = ec2.security_groups.all()
-    if verbose:
-        internet_gateways = ec2.internet_gateways.all()
+    vpcs = [v for v in ec2.vpcs.filter(Filters=vpc_filter.ec2_filters()) if vpc_filter.matches(v)]
+    needs = data_needed_by_list_columns(list_columns)
+    if 'internet_gateways' in needs:
+        for i in ec2.internet_gateways.all():
+            for a in i.attachments: vpc_id_to_items.setdefault(('internet_gateways', a['VpcId']), []).append(i.internet_gateway_id)
+    if 'subnets' in needs:
+        for i in ec2.subnets.all(): vpc_id_to_items.setdefault(('subnets', i.vpc_id), []).append(extract_name_from_tags(i.tags, i.subnet_id))
+    if 'instances' in needs:
+        for i in ec2.instances.all(): vpc_id_to_items.setdefault(('instances', i.vpc_id), []).append(extract_name_from_tags(i.tags))
+    if 'security_groups' in needs:
+        for i in ec2.security_groups.all(): vpc_id_to_items.setdefault(('security_groups', i.vpc_id), []).append(i.group_name)
     try:
         for inst in vpcs:
-            row = [f(getattr(inst, i)) for _, i, _, f in list_columns]
-            if verbose:
-                row.append([i.internet_gateway_id for i in internet_gateways if any(map(lambda x: x['VpcId'] == inst.vpc_id, i.attachments))])
-            row.append([subnet_id_to_subnet_name(i.subnet_id) for i in subnets if i.vpc_id == inst.vpc_id])
-            row.append([extract_name_from_tags(i.tags) for i in instances if i.vpc_id == inst.vpc_id])
-            row.append([i.group_name for i in sgs if i.vpc_id == inst.vpc_id])
+            row = [f(getattr(inst, i)) for _, i, _, f in [c[:4] for c in list_columns]]
             rows.append(row)
     except AttributeError as e:
         error_exit(str(e) + "\nNo such attribute.\nTry 'taw list --argdoc' to see all attributes.")
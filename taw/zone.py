@@ -177,16 +177,22 @@ def rm_zonecmd(params, zonename, name, type_str, force):
 @zone_group.command("list")
 @click.option('--verbose', '-v', is_flag=True, help='Verbose output.')
 @click.option('--argdoc', is_flag=True, help='Show available attributes in a web browser')
-@click.option('--attr', '-a', multiple=True, help='Attribute name(s).')
+@click.option('--attr', '-a', multiple=True, help='Attribute name(s) or column header(s) to show (only they are shown).')
 @click.option('--allregions', is_flag=True, help='List for all regions.')
 @click.argument('zone_name_if_any', nargs=-1, metavar='<zone name>', shell_complete=click_complete_for_zones)
 @pass_global_parameters
 def list_zones(params, argdoc, verbose, attr, allregions, zone_name_if_any):
-    """ list all zones hosted by Route53 """
+    """ list all zones hosted by Route53, or the records in a zone (that match filter terms if any).
+
+        \b
+        eg) taw zone list example.com name=web* type=A
+        Keys of records are name, type, ttl and value.
+    """
     if argdoc:
         click.launch('http://boto3.readthedocs.io/en/latest/reference/services/route53.html#Route53.Client.list_hosted_zones')
         return
     if allregions: error_exit("Route53 zones are all global, so --allregions option is pointless.")
+    filter_terms, zone_name_if_any = split_filter_terms(zone_name_if_any)
     if zone_name_if_any:
         zone_name = zone_name_if_any[0]
         zone_id = convert_zone_name_to_zone_id(zone_name)
@@ -201,13 +207,32 @@ def list_zones(params, argdoc, verbose, attr, allregions, zone_name_if_any):
                 (True, "Type"           , "Type" , ident)                            ,
                 (True, "ResourceRecords", "Value", lambda x: [y['Value'] for y in x]),
             ]
-        list_columns = [x for x in all_list_columns if verbose or x[0]]
-        for v in attr: list_columns.append((True, v, v, ident))
+        list_columns = select_list_columns(all_list_columns, verbose, attr)
         header = [x[2] for x in list_columns]; rows = []
+        record_filter = ResourceFilter(filter_terms, {
+                'name' : (None, lambda r: remove_trailing_domain_name(r['Name'])),
+                'type' : (None, lambda r: r['Type'])                             ,
+                'ttl'  : (None, lambda r: r.get('TTL'))                          ,
+                'value': (None, lambda r: [x['Value'] for x in r.get('ResourceRecords', [])]),
+            }, pushdown=False)
+        # Route53 lists records in the order of their labels from the right (eg, example.com, a.example.com, b.example.com, a.b.example.com),
+        # so the records of an exact name are listed from name.zone until another name comes. A wildcard may match names of any labels
+        # (eg, 'web*' matches web1.dev, which comes after xyz), so a pattern is evaluated over the whole zone.
+        exact_name = record_filter.literal_value('name')
+        args = {'HostedZoneId': zone_id}
+        if exact_name: args['StartRecordName'] = exact_name + '.' + zone_name.rstrip('.') + '.'
+        limit = output_row_limit(params)
+        if limit: args['PaginationConfig'] = {'PageSize': min(300, max(1, limit))}  # no more pages than --limit needs
         r53 = get_r53_connection()
-        for zone in r53.list_resource_record_sets(HostedZoneId=zone_id)['ResourceRecordSets']:
-            row = [f(zone[i]) for _, i, _, f in list_columns]
-            rows.append(row)
+
+        def record_rows():
+            for page in r53.get_paginator('list_resource_record_sets').paginate(**args):
+                records = page['ResourceRecordSets']
+                for zone in records:
+                    if not record_filter.matches(zone): continue
+                    yield [f(zone[i]) for _, i, _, f in list_columns]
+                if exact_name and any([remove_trailing_domain_name(r['Name']) != exact_name for r in records]): break
+        rows = record_rows()
     else:
         completion_keywords = []
         r53 = get_r53_connection()